@@ -0,0 +1,246 @@
+"""
+batch_fitting.py
+
+Batch driver that replaces the per-bin notebook cells: partition the catalogue
+into [M/H] x alpha-sequence bins, run the BIC sweeps of all bins on one shared
+worker pool and write each bin's best model (in a `model_store.ModelStore`),
+BIC table and restart table together with a run manifest.
+
+Every bin uses the same root seed, so each bin's restarts are identical to
+those of `bic_vs_components.compute_bic_vs_n_components` and
+`gmm_analysis.fit_gmm_fixed_components` called on that bin alone with the same
+seed. The final model for the chosen K is the best restart of the sweep.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from fit_cache import data_hash
+from model_store import ModelStore
+from velocity_covariance import velocity_covariance_stack
+from xd_fitting import best_restart, restart_task
+
+# [M/H] ranges of the metallicity populations
+METALLICITY_BINS = {
+    'vmp': (-3.0, -2.0),
+    'imp': (-2.0, -1.6),
+    'mp1': (-1.6, -1.3),
+    'mp2': (-1.3, -1.0),
+}
+
+# Bins data shared with pool workers, set once per worker by `_init_worker`
+_WORKER_BINS = {}
+
+
+def alpha_sequence_masks(df, alpha_col='aom_xp', mh_col='mh_xgboost'):
+    """
+    Boolean masks of the high- and low-alpha sequences.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Catalogue with alpha-abundance and metallicity columns.
+    alpha_col, mh_col : str, optional
+        Column names of [alpha/M] and [M/H].
+
+    Returns
+    -------
+    high, low : ndarray
+        Boolean arrays of length ``len(df)``.
+    """
+    alpha = df[alpha_col].values
+    mh = df[mh_col].values
+
+    high = (((mh < -0.6) & (alpha > 0.28)) |
+            ((mh >= -0.6) & (mh <= 0.125) & (alpha > (-0.25 * mh + 0.13))) |
+            ((mh > 0.125) & (alpha > 0.1)))
+    low = (((mh < -0.8) & (alpha < 0.21)) |
+           ((mh >= -0.8) & (mh <= 0.07) & (alpha < (-0.21 * mh + 0.045))) |
+           ((mh > 0.07) & (alpha < 0.03)))
+    return high, low
+
+
+def default_bins():
+    """
+    The twelve bins of the paper: each metallicity population with all stars
+    and with the high- and low-alpha sequences only.
+
+    Returns
+    -------
+    list of dict
+        Bin definitions with keys ``name``, ``mh_range`` and ``alpha``
+        (``None``, ``'high'`` or ``'low'``), named like the files in
+        ``models/`` (e.g. ``'vmp'``, ``'vmp_high'``).
+    """
+    bins = []
+    for name, mh_range in METALLICITY_BINS.items():
+        bins.append({'name': name, 'mh_range': mh_range, 'alpha': None})
+        for alpha in ('high', 'low'):
+            bins.append({'name': f'{name}_{alpha}', 'mh_range': mh_range, 'alpha': alpha})
+    return bins
+
+
+def partition_catalogue(df, bins, mh_col='mh_xgboost', alpha_col='aom_xp'):
+    """
+    Split the catalogue into bins in a single pass over its columns.
+
+    The metallicity column and the alpha-sequence masks are computed once
+    and each bin only selects its rows.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Catalogue with velocities, uncertainties, [M/H] and (if any bin
+        selects an alpha sequence) [alpha/M].
+    bins : list of dict
+        Bin definitions, see `default_bins`. A bin may also carry a fixed
+        ``n_components``.
+    mh_col, alpha_col : str, optional
+        Column names of [M/H] and [alpha/M].
+
+    Returns
+    -------
+    dict
+        Mapping from bin name to its DataFrame; bins may overlap.
+    """
+    mh = df[mh_col].values
+    if any(b.get('alpha') for b in bins):
+        sequences = dict(zip(('high', 'low'), alpha_sequence_masks(df, alpha_col, mh_col)))
+
+    partitions = {}
+    for b in bins:
+        lo, hi = b['mh_range']
+        mask = (mh >= lo) & (mh < hi)
+        if b.get('alpha'):
+            mask &= sequences[b['alpha']]
+        partitions[b['name']] = df.iloc[np.flatnonzero(mask)]
+    return partitions
+
+
+def _init_worker(bin_data):
+    _WORKER_BINS.update(bin_data)
+
+
+def _bin_restart_task(name, K, restart, seed, w, tol, engine, bin_data=None):
+    X, cov_matrices = (bin_data or _WORKER_BINS)[name]
+    return name, restart_task(K, restart, seed, w, tol, engine, X=X, cov_matrices=cov_matrices)
+
+
+def run_batch_fits(df, bins, output_dir, max_components=8, n_init=50, seed=0, n_workers=1, w=0.1, tol=1e-6,
+                   engine="pygmmis", mh_col='mh_xgboost', alpha_col='aom_xp'):
+    """
+    Fit all bins on one worker pool and write models, BIC tables and a manifest.
+
+    All (bin, K, restart) fits are scheduled together, largest bin and
+    largest K first, so the pool stays busy until the last bin finishes.
+    For each bin the BIC of every restart is computed as in
+    `compute_bic_vs_n_components`. The model with the bin's ``n_components``
+    (if given) or with the lowest BIC is the best restart at that K.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Catalogue, see `partition_catalogue`.
+    bins : list of dict
+        Bin definitions, see `default_bins`.
+    output_dir : str
+        Directory for the models (``gmm_<name>.npz``, see
+        `model_store.ModelStore`), ``bic_<name>.json``,
+        ``restarts_<name>.csv`` and ``manifest.json``; created if needed.
+    max_components : int, optional
+        Largest K of the BIC sweep (default: 8).
+    n_init : int, optional
+        Restarts per K (default: 50).
+    seed : int, optional
+        Root seed shared by all bins (default: 0).
+    n_workers : int, optional
+        Worker processes (default: 1, serial).
+    w, tol : float, optional
+        EM settings, as in `xd_fitting.xd_restart`.
+    engine : {"numpy", "pygmmis"}, optional
+        EM implementation (default: ``"pygmmis"``).
+    mh_col, alpha_col : str, optional
+        Column names of [M/H] and [alpha/M].
+
+    Returns
+    -------
+    dict
+        The run manifest, as written to ``manifest.json``.
+    """
+    store = ModelStore(output_dir)
+    start = time.perf_counter()
+
+    partitions = partition_catalogue(df, bins, mh_col=mh_col, alpha_col=alpha_col)
+    bin_data = {name: (df_bin[['v_R', 'v_phi', 'v_Z']].values, velocity_covariance_stack(df_bin))
+                for name, df_bin in partitions.items() if len(df_bin) > 0}
+
+    # largest bins and largest K first: they take longest, which balances the pool
+    order = sorted(bin_data, key=lambda name: len(bin_data[name][0]), reverse=True)
+    tasks = [(name, K, i) for name in order for K in range(max_components, 0, -1) for i in range(n_init)]
+
+    records, models = {name: [] for name in bin_data}, {name: {} for name in bin_data}
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(bin_data,)) as executor:
+            futures = [executor.submit(_bin_restart_task, name, K, i, seed, w, tol, engine) for name, K, i in tasks]
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Fitting bins"):
+                name, (record, gmm) = future.result()
+                records[name].append(record)
+                models[name][record['K'], record['restart']] = gmm
+    else:
+        for name, K, i in tqdm(tasks, desc="Fitting bins"):
+            _, (record, gmm) = _bin_restart_task(name, K, i, seed, w, tol, engine, bin_data=bin_data)
+            records[name].append(record)
+            models[name][K, i] = gmm
+
+    manifest = {
+        'parameters': {'max_components': max_components, 'n_init': n_init, 'seed': seed, 'w': w, 'tol': tol,
+                       'engine': engine, 'mh_col': mh_col, 'alpha_col': alpha_col},
+        'bins': [],
+    }
+    definitions = {b['name']: b for b in bins}
+    for name in order:
+        n = len(bin_data[name][0])
+        restarts = pd.DataFrame(records[name]).sort_values(['K', 'restart'], ignore_index=True)
+        restarts['seed'] = seed
+        restarts['BIC'] = ((1 + 3 + 6) * restarts['K'] - 1) * np.log(n) - 2 * restarts['logL']
+        BIC_values = {K: restarts.loc[restarts['K'] == K, 'BIC'].tolist() for K in range(1, max_components + 1)}
+
+        best_K = definitions[name].get('n_components')
+        if best_K is None:
+            best_K = int(restarts.loc[restarts['BIC'].idxmin(), 'K'])
+        gmm = best_restart(restarts, models[name], best_K)
+
+        logL = float(restarts.loc[restarts['K'] == best_K, 'logL'].max())
+        files = {'model': f'gmm_{name}.npz', 'bic': f'bic_{name}.json', 'restarts': f'restarts_{name}.csv'}
+        store.save(f'gmm_{name}', gmm, logL=logL, n_stars=n, data_hash=data_hash(*bin_data[name]), w=w, tol=tol,
+                   seed=seed, n_init=n_init, engine=engine, mh_range=list(definitions[name]['mh_range']),
+                   alpha=definitions[name].get('alpha'))
+        with open(os.path.join(output_dir, files['bic']), 'w') as f:
+            json.dump(BIC_values, f)
+        restarts.to_csv(os.path.join(output_dir, files['restarts']), index=False)
+
+        manifest['bins'].append({
+            'name': name,
+            'mh_range': list(definitions[name]['mh_range']),
+            'alpha': definitions[name].get('alpha'),
+            'n_stars': n,
+            'n_components': best_K,
+            'logL': logL,
+            'min_BIC': float(min(BIC_values[best_K])),
+            'fit_seconds': float(restarts['seconds'].sum()),
+            'files': files,
+        })
+
+    skipped = [b['name'] for b in bins if b['name'] not in bin_data]
+    manifest['skipped_empty_bins'] = skipped
+    manifest['wall_seconds'] = time.perf_counter() - start
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
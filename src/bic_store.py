@@ -0,0 +1,240 @@
+"""
+bic_store.py
+
+Incremental store of BIC sweep results.
+
+A `BICStore` holds the BIC of every (K, restart) of a sweep and keeps the
+values of each K sorted as restarts are added, so the minimum, quartiles,
+median and maximum used by `bic_vs_components.plot_bic_vs_n_components` are
+read off directly instead of being recomputed from the raw lists. Restarts are
+identified by their index, so a seeded sweep can be extended with more
+restarts, or resumed, by fitting only the indices the store does not have yet
+(see the ``store`` argument of `bic_vs_components.compute_bic_vs_n_components`).
+
+The store is saved as JSON together with its summary table, and the plain
+``{K: [BIC, ...]}`` dicts of ``models/bic_values_*.json`` can be imported with
+`BICStore.from_bic_values`.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+FORMAT_VERSION = 1
+
+# Order statistics of the summary table, as (column, percentile)
+SUMMARY_PERCENTILES = (('min', 0), ('q25', 25), ('median', 50), ('q75', 75), ('max', 100))
+
+
+def _sorted_percentile(values, q):
+    """Percentile of sorted values with numpy's default linear interpolation."""
+    position = (len(values) - 1) * q / 100
+    lower = int(np.floor(position))
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class BICStore:
+    """
+    BIC values of a sweep, per component count and restart index.
+
+    Parameters
+    ----------
+    path : str, optional
+        JSON file the store is saved to by `save`.
+    n_stars : int, optional
+        Number of stars of the fitted bin.
+    seed : int, optional
+        Root seed of the restarts. Restarts added later must use the same seed
+        for the restart indices to refer to the same random streams.
+
+    Attributes
+    ----------
+    settings : dict
+        Fit settings recorded with the sweep (``w``, ``tol``, ``engine``, ...).
+    """
+
+    def __init__(self, path=None, n_stars=None, seed=None):
+        self.path = path
+        self.n_stars = n_stars
+        self.seed = seed
+        self.settings = {}
+        # K -> (BIC sorted ascending, restart index of each value)
+        self._values = {}
+        self._summary = None
+
+    @property
+    def components(self):
+        """Sorted component counts in the store."""
+        return sorted(self._values)
+
+    def __len__(self):
+        return sum(len(values) for values, _ in self._values.values())
+
+    def restarts(self, n_components):
+        """Sorted restart indices stored for one component count."""
+        if n_components not in self._values:
+            return np.array([], dtype=int)
+        return np.sort(self._values[n_components][1])
+
+    def add(self, n_components, bic, restarts=None):
+        """
+        Add BIC values of one component count.
+
+        Parameters
+        ----------
+        n_components : int
+            Component count.
+        bic : array_like
+            BIC values.
+        restarts : array_like of int, optional
+            Restart index of each value; defaults to the indices following
+            the largest stored one. Indices already in the store are skipped.
+
+        Returns
+        -------
+        int
+            Number of values added.
+        """
+        K = int(n_components)
+        bic = np.atleast_1d(np.asarray(bic, dtype=float))
+        values, indices = self._values.get(K, (np.empty(0), np.empty(0, dtype=int)))
+        if restarts is None:
+            start = indices.max() + 1 if len(indices) else 0
+            restarts = np.arange(start, start + len(bic))
+        restarts = np.atleast_1d(np.asarray(restarts, dtype=int))
+
+        new = ~np.isin(restarts, indices)
+        if not new.any():
+            return 0
+        bic, restarts = bic[new], restarts[new]
+
+        # merge the new values into the sorted ones
+        values = np.concatenate([values, bic])
+        indices = np.concatenate([indices, restarts])
+        order = np.argsort(values, kind='stable')
+        self._values[K] = values[order], indices[order]
+        self._summary = None
+        return int(new.sum())
+
+    def add_restarts(self, restarts):
+        """
+        Add the rows of a restart table.
+
+        Parameters
+        ----------
+        restarts : pd.DataFrame
+            Table with ``K``, ``restart`` and ``BIC`` columns, as returned by
+            `bic_vs_components.compute_bic_vs_n_components`.
+
+        Returns
+        -------
+        int
+            Number of values added.
+        """
+        return sum(self.add(K, group['BIC'].values, group['restart'].values)
+                   for K, group in restarts.groupby('K'))
+
+    def values(self, n_components):
+        """BIC values of one component count, sorted ascending."""
+        return self._values[int(n_components)][0]
+
+    def summary(self):
+        """
+        Order statistics per component count.
+
+        Returns
+        -------
+        pd.DataFrame
+            Indexed by K, with the number of restarts ``n`` and the columns
+            ``min``, ``q25``, ``median``, ``q75`` and ``max``.
+        """
+        if self._summary is None:
+            rows = {K: {'n': len(values),
+                        **{name: _sorted_percentile(values, q) for name, q in SUMMARY_PERCENTILES}}
+                    for K, (values, _) in sorted(self._values.items())}
+            columns = ['n'] + [name for name, _ in SUMMARY_PERCENTILES]
+            self._summary = pd.DataFrame.from_dict(rows, orient='index', columns=columns).rename_axis('K')
+        return self._summary
+
+    def best_n_components(self):
+        """Component count with the smallest BIC."""
+        return int(self.summary()['min'].idxmin())
+
+    def to_bic_values(self):
+        """
+        Plain ``{K: [BIC, ...]}`` dict with the values in restart order, as
+        returned by `compute_bic_vs_n_components`.
+        """
+        return {K: values[np.argsort(indices)].tolist() for K, (values, indices) in sorted(self._values.items())}
+
+    @classmethod
+    def from_bic_values(cls, BIC_values, path=None, **kwargs):
+        """
+        Build a store from a ``{K: [BIC, ...]}`` dict with int or string keys,
+        e.g. one loaded from ``models/bic_values_*.json``. The list position
+        is taken as the restart index.
+        """
+        store = cls(path, **kwargs)
+        for K, bic in BIC_values.items():
+            store.add(int(K), bic, np.arange(len(bic)))
+        return store
+
+    def save(self, path=None):
+        """
+        Write the store and its summary to JSON.
+
+        Parameters
+        ----------
+        path : str, optional
+            Output file; defaults to the store's ``path``, which it then
+            replaces.
+        """
+        if path is not None:
+            self.path = path
+        if self.path is None:
+            raise ValueError("No path given for the BIC store")
+        summary = self.summary()
+        content = {
+            'format_version': FORMAT_VERSION,
+            'n_stars': self.n_stars,
+            'seed': self.seed,
+            'settings': self.settings,
+            'summary': {str(K): row.to_dict() for K, row in summary.iterrows()},
+            'components': {str(K): {'BIC': values.tolist(), 'restart': indices.tolist()}
+                           for K, (values, indices) in sorted(self._values.items())},
+        }
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(content, f)
+        os.replace(tmp, self.path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a store written by `save`, or import a plain ``{K: [BIC, ...]}``
+        JSON file.
+
+        Returns
+        -------
+        BICStore
+        """
+        with open(path) as f:
+            content = json.load(f)
+        if 'format_version' not in content:
+            return cls.from_bic_values(content, path)
+        if content['format_version'] > FORMAT_VERSION:
+            raise ValueError(f"{path} was written with BIC store format {content['format_version']}, "
+                             f"newer than the supported version {FORMAT_VERSION}")
+
+        store = cls(path, n_stars=content['n_stars'], seed=content['seed'])
+        store.settings = content['settings']
+        for K, entry in content['components'].items():
+            store._values[int(K)] = np.array(entry['BIC'], dtype=float), np.array(entry['restart'], dtype=int)
+        if content.get('summary'):
+            store._summary = pd.DataFrame.from_dict(content['summary'], orient='index').rename_axis('K')
+            store._summary.index = store._summary.index.astype(int)
+            store._summary['n'] = store._summary['n'].astype(int)
+        return store
@@ -1,11 +1,20 @@
 # bic_vs_components.py
 
+import os
+
 import numpy as np
-import pygmmis
+import pandas as pd
 import matplotlib.pyplot as plt
-from tqdm import tqdm
 
-def compute_bic_vs_n_components(df_bin, max_components=8, n_init=50):
+from bic_store import BICStore
+from fit_cache import data_hash
+from velocity_covariance import velocity_covariance_stack
+from xd_fitting import (best_restart, cross_validate_components, fold_seed, run_xd_restarts, stratified_folds,
+                        warm_start_sweep)
+
+def compute_bic_vs_n_components(df_bin, max_components=8, n_init=50, covariance=None, seed=None, n_workers=1,
+                                return_restarts=False, engine="pygmmis", warm_start=None, cache=None, store=None,
+                                w=0.1, tol=1e-6):
     """
     Compute BIC for different numbers of Gaussian components (1 to max_components),
     using Extreme Deconvolution (XD) to account for measurement uncertainties.
@@ -14,74 +23,213 @@ def compute_bic_vs_n_components(df_bin, max_components=8, n_init=50):
     - df_bin (pd.DataFrame): DataFrame containing velocity and uncertainty columns.
     - max_components (int): Maximum number of GMM components to evaluate.
     - n_init (int): Number of initializations per component count.
+    - covariance (np.ndarray, optional): Per-star noise covariances, packed (N, 6)
+      or (N, 3, 3). Defaults to the packed covariance columns of df_bin if present,
+      otherwise diagonal matrices from the uncertainty columns.
+    - seed (int, optional): Root seed for the restarts. Restart i for K uses the same
+      random stream as restart i of `fit_gmm_fixed_components` with the same seed.
+    - n_workers (int): Worker processes; all (K, restart) fits share one pool and the
+      results do not depend on the number of workers.
+    - return_restarts (bool): Also return the per-restart table (K, restart, logL,
+      n_iter, seconds, seed).
+    - engine (str): EM implementation, "pygmmis" (default) or "numpy" (vectorized `xd_em`).
+    - warm_start (bool or dict, optional): Seed each K from splits of the best K-1 model
+      plus a few k-means restarts (`xd_fitting.warm_start_sweep`) instead of n_init
+      k-means restarts. A dict is passed on as options (n_warm, n_cold); each list in
+      BIC_values then holds min(n_warm, K-1) + n_cold entries. Requires engine="numpy".
+    - cache (fit_cache.FitCache or str, optional): Cache of seeded restarts shared with
+      `fit_gmm_fixed_components`, so fitting the chosen K afterwards reuses this sweep
+      (a string is taken as a cache directory). Not used with warm_start.
+    - store (bic_store.BICStore or str, optional): Store to extend or resume. Only the
+      restarts it does not have yet are fitted, up to n_init per K, and the new BIC
+      values are added to it (and saved if it has a path). A string is taken as the
+      store's JSON file, loaded if it exists. The store's seed is used when seed is
+      None. The store records engine, w, tol and a hash of the data, and a store
+      computed with different ones raises ValueError. Not used with warm_start.
+    - w (float): Minimum covariance regularisation of the EM (default 0.1).
+    - tol (float): Relative log-likelihood tolerance of the EM (default 1e-6).
 
     Returns:
-    - BIC_values (dict): Mapping from component count to list of BIC values.
+    - BIC_values (dict): Mapping from component count to list of BIC values; with a
+      store, all of the store's values for K = 1..max_components.
+    - restarts (pd.DataFrame): Only if return_restarts is True; with a store, only the
+      restarts fitted in this call.
     """
     X = df_bin[['v_R', 'v_phi', 'v_Z']].values
     n = len(X)
 
-    # Diagonal covariance matrices per star
-    uncertainties = np.stack([
-        df_bin['v_R_uncertainty'].values**2,
-        df_bin['v_phi_uncertainty'].values**2,
-        df_bin['v_Z_uncertainty'].values**2
-    ], axis=1)
-    cov_matrices = np.array([np.diag(u) for u in uncertainties])
-
-    BIC_values = {N: [] for N in range(1, max_components + 1)}
+    # Per-star noise covariance matrices (diagonal unless covariances are given)
+    cov_matrices = velocity_covariance_stack(df_bin, covariance)
 
     print("\nComputing BIC for different numbers of components...")
-    rng = np.random.RandomState()
+    if store is not None:
+        if warm_start:
+            raise ValueError("store is not used with warm_start")
+        if isinstance(store, str):
+            store = BICStore.load(store) if os.path.exists(store) else BICStore(store)
+        settings = {'engine': engine, 'w': w, 'tol': tol, 'data_hash': data_hash(X, cov_matrices)}
+        store = _prepare_store(store, n, seed, settings)
+        seed = store.seed
+
+    if warm_start:
+        if engine != "numpy":
+            raise ValueError("warm_start requires engine='numpy'")
+        options = warm_start if isinstance(warm_start, dict) else {}
+        restarts, _ = warm_start_sweep(X, cov_matrices, max_components, seed=seed, n_workers=n_workers, w=w, tol=tol,
+                                       **options)
+    elif store is not None:
+        # fit the missing restarts of each K, grouped by the range of indices they need
+        pending = {}
+        for N in range(1, max_components + 1):
+            have = store.restarts(N)
+            if len(have) < n_init:
+                first = int(have.max()) + 1 if len(have) else 0
+                pending.setdefault((first, n_init - len(have)), []).append(N)
+        tables = [run_xd_restarts(X, cov_matrices, components, n_init=n_new, seed=seed, n_workers=n_workers,
+                                  w=w, tol=tol, engine=engine, cache=cache, first_restart=first)[0]
+                  for (first, n_new), components in pending.items()]
+        restarts = (pd.concat(tables, ignore_index=True).sort_values(['K', 'restart'], ignore_index=True)
+                    if tables else pd.DataFrame(columns=['K', 'restart', 'logL', 'n_iter', 'seconds', 'seed']))
+    else:
+        restarts, _ = run_xd_restarts(
+            X, cov_matrices, range(1, max_components + 1), n_init=n_init, seed=seed, n_workers=n_workers,
+            w=w, tol=tol, engine=engine, cache=cache
+        )
+
+    # BIC = k*ln(n) - 2*logL
+    k = (1 + 3 + 6) * restarts['K'] - 1  # weights, means, covariances
+    restarts['BIC'] = k * np.log(n) - 2 * restarts['logL']
+
+    if store is not None:
+        store.add_restarts(restarts)
+        if store.path is not None:
+            store.save()
+        BIC_values = {N: values for N, values in store.to_bic_values().items() if N <= max_components}
+    else:
+        BIC_values = {N: restarts.loc[restarts['K'] == N, 'BIC'].tolist() for N in range(1, max_components + 1)}
+
+    if return_restarts:
+        return BIC_values, restarts
+    return BIC_values
 
-    for N in tqdm(range(1, max_components + 1), desc="Fitting GMMs"):
-        for _ in range(n_init):
-            gmm = pygmmis.GMM(K=N, D=3)
-            pygmmis.initFromKMeans(gmm, X)
-            logL, _ = pygmmis.fit(gmm, X, covar=cov_matrices, w=0.1, tol=1e-6, init_method='kmeans')
 
-            # BIC = k*ln(n) - 2*logL
-            k = (1 + 3 + 6) * N - 1  # weights, means, covariances
-            BIC = k * np.log(n) - 2 * logL
-            BIC_values[N].append(BIC)
+def compute_cv_vs_n_components(df_bin, max_components=8, n_folds=5, n_init=10, covariance=None, seed=None,
+                               n_workers=1, stratify='v_phi', return_folds=False, engine="pygmmis", cache=None):
+    """
+    Compute the K-fold cross-validated held-out deviance for 1 to max_components
+    Gaussian components, as an alternative to the BIC.
 
-    return BIC_values
+    Each K is first fitted to all stars (best of n_init restarts, as in
+    `compute_bic_vs_n_components`). For every fold the full-data model is then
+    refitted on the other folds, starting from its parameters, and scored on the
+    held-out stars with the deconvolved likelihood. All (K, fold) refits share one
+    worker pool.
 
+    Args:
+    - df_bin (pd.DataFrame): DataFrame containing velocity and uncertainty columns.
+    - max_components (int): Maximum number of GMM components to evaluate.
+    - n_folds (int): Number of folds.
+    - n_init (int): Restarts per K of the full-data fits.
+    - covariance (np.ndarray, optional): Per-star noise covariances, as in
+      `compute_bic_vs_n_components`.
+    - seed (int, optional): Root seed of the full-data restarts and of the fold
+      assignment.
+    - n_workers (int): Worker processes for the full-data restarts and the fold refits.
+    - stratify (str, optional): Column the folds are stratified on (default 'v_phi');
+      None assigns folds in catalogue order.
+    - return_folds (bool): Also return the per-(K, fold) table of
+      `xd_fitting.cross_validate_components`.
+    - engine (str): EM implementation of the full-data fits (default "pygmmis"); the refits
+      always use `xd_em`.
+    - cache (fit_cache.FitCache or str, optional): Restart cache shared with
+      `compute_bic_vs_n_components`, so the full-data fits reuse a BIC sweep with the
+      same seed.
 
-def plot_bic_vs_n_components(BIC_values, fig_name):
+    Returns:
+    - CV_values (dict): Mapping from component count to list of held-out deviances,
+      -2 x the held-out log-likelihood of each fold. Like the BIC, lower is better, and
+      the dict can be plotted with `plot_bic_vs_n_components(..., criterion='CV')`.
+    - folds (pd.DataFrame): Only if return_folds is True.
+    """
+    X = df_bin[['v_R', 'v_phi', 'v_Z']].values
+    cov_matrices = velocity_covariance_stack(df_bin, covariance)
+
+    print("\nCross-validating different numbers of components...")
+    restarts, models = run_xd_restarts(
+        X, cov_matrices, range(1, max_components + 1), n_init=n_init, seed=seed, n_workers=n_workers,
+        engine=engine, cache=cache
+    )
+    seed = int(restarts['seed'].iloc[0])
+    full_fits = {K: best_restart(restarts, models, K) for K in range(1, max_components + 1)}
+
+    values = df_bin[stratify].values if stratify else np.zeros(len(X))
+    folds = stratified_folds(values, n_folds, seed=fold_seed(seed))
+    scores = cross_validate_components(X, cov_matrices, full_fits, folds, n_workers=n_workers)
+    scores['deviance'] = -2 * scores['logL_test']
+
+    CV_values = {N: scores.loc[scores['K'] == N, 'deviance'].tolist() for N in range(1, max_components + 1)}
+
+    if return_folds:
+        return CV_values, scores
+    return CV_values
+
+
+def _prepare_store(store, n_stars, seed, settings):
+    """Check that a BIC store belongs to this bin and these settings, filling in what it lacks."""
+    if store.n_stars is not None and store.n_stars != n_stars:
+        raise ValueError(f"BIC store was computed for {store.n_stars} stars, not {n_stars}")
+    if store.seed is not None and seed is not None and store.seed != seed:
+        raise ValueError(f"BIC store was computed with seed {store.seed}, not {seed}")
+    for key, value in settings.items():
+        if store.settings.get(key, value) != value:
+            raise ValueError(f"BIC store was computed with {key} {store.settings[key]!r}, not {value!r}")
+
+    if store.seed is None:
+        # restarts are only extendable under a fixed root seed
+        store.seed = seed if seed is not None else int(np.random.SeedSequence().entropy)
+    store.n_stars = n_stars
+    store.settings.update(settings)
+    return store
+
+
+def plot_bic_vs_n_components(BIC_values, fig_name, criterion='BIC'):
     """
     Plots BIC vs. Number of Components and highlights the minimum BIC point.
 
     Args:
-    - BIC_values: Dictionary with BIC values for each component count.
+    - BIC_values: Dictionary with BIC values for each component count (int or string
+      keys, e.g. loaded from JSON), or a `bic_store.BICStore`, whose stored summary is
+      used directly.
     - fig_name: Path/filename to save the plot (e.g. 'output.png').
+    - criterion (str): Name of the plotted criterion, e.g. 'CV' for the output of
+      `compute_cv_vs_n_components`.
     """
-    
-    num_components = sorted([int(k) for k in BIC_values.keys()])
-    
-    smallest_bic = [min(BIC_values[str(N)] if str(N) in BIC_values else BIC_values[N]) for N in num_components]
-    median_bic   = [np.median(BIC_values[str(N)] if str(N) in BIC_values else BIC_values[N]) for N in num_components]
-    largest_bic  = [max(BIC_values[str(N)] if str(N) in BIC_values else BIC_values[N]) for N in num_components]
-    q25_bic      = [np.percentile(BIC_values[str(N)] if str(N) in BIC_values else BIC_values[N], 25) for N in num_components]
-    q75_bic      = [np.percentile(BIC_values[str(N)] if str(N) in BIC_values else BIC_values[N], 75) for N in num_components]
+    store = BIC_values if isinstance(BIC_values, BICStore) else BICStore.from_bic_values(BIC_values)
+    summary = store.summary()
+
+    num_components = summary.index.tolist()
+    smallest_bic = summary['min'].tolist()
+    median_bic   = summary['median'].tolist()
+    largest_bic  = summary['max'].tolist()
+    q25_bic      = summary['q25'].tolist()
+    q75_bic      = summary['q75'].tolist()
 
     # Find the minimum BIC value and corresponding component count
-    min_bic = min(smallest_bic)
-    min_index = smallest_bic.index(min_bic)
-    best_n_components = num_components[min_index]
+    best_n_components = int(summary['min'].idxmin())
+    min_bic = summary.loc[best_n_components, 'min']
 
     plt.figure(figsize=(8, 6))
-    plt.plot(num_components, smallest_bic, 'k-', label='Smallest BIC')
-    plt.plot(num_components, q25_bic, 'g-.', label='25th Percentile BIC')
-    plt.plot(num_components, median_bic, 'b--', label='Median BIC')
-    plt.plot(num_components, q75_bic, 'm-.', label='75th Percentile BIC')
-    plt.plot(num_components, largest_bic, 'r:', label='Largest BIC')
+    plt.plot(num_components, smallest_bic, 'k-', label=f'Smallest {criterion}')
+    plt.plot(num_components, q25_bic, 'g-.', label=f'25th Percentile {criterion}')
+    plt.plot(num_components, median_bic, 'b--', label=f'Median {criterion}')
+    plt.plot(num_components, q75_bic, 'm-.', label=f'75th Percentile {criterion}')
+    plt.plot(num_components, largest_bic, 'r:', label=f'Largest {criterion}')
 
     # Highlight the minimum BIC value
-    plt.plot(best_n_components, min_bic, 'ro', markersize=8, label='Minimum BIC')
+    plt.plot(best_n_components, min_bic, 'ro', markersize=8, label=f'Minimum {criterion}')
 
     plt.xlabel("Number of GMM Components", fontsize=14)
-    plt.ylabel("BIC Value", fontsize=14)
+    plt.ylabel(f"{criterion} Value", fontsize=14)
     plt.legend()
     plt.grid(True)
     plt.tight_layout()
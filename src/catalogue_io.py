@@ -0,0 +1,160 @@
+"""
+catalogue_io.py
+
+Out-of-core access to stellar catalogues for the velocity uncertainty stage:
+column-selective, row-range readers for FITS and Parquet files and an on-disk
+chunk store that records finished chunks so interrupted runs can be resumed.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from astropy.io import fits
+
+# Columns read by `montecarlo_velocity.generate_monte_carlo_samples`
+MONTE_CARLO_INPUT_COLUMNS = [
+    'ra', 'dec', 'rpgeo', 'pmra', 'pmdec', 'radial_velocity',
+    'parallax_error', 'pmra_error', 'pmdec_error', 'rpgeo_error', 'radial_velocity_error',
+]
+
+
+class CatalogueReader:
+    """
+    Read selected columns of a FITS or Parquet table in row ranges.
+
+    Only the requested columns of the requested rows are loaded: FITS tables
+    are memory-mapped and Parquet files are read one overlapping row group at
+    a time. Reading Parquet requires ``pyarrow``.
+
+    Parameters
+    ----------
+    path : str
+        Catalogue file; the format is taken from the extension
+        (``.fits``, ``.fit``, ``.fits.gz`` or ``.parquet``, ``.pq``).
+    columns : list of str
+        Columns to read.
+    hdu : int, optional
+        FITS extension holding the table (default: 1).
+    """
+
+    def __init__(self, path, columns, hdu=1):
+        self.path = path
+        self.columns = list(columns)
+        self.hdu = hdu
+        lower = path.lower()
+        if lower.endswith(('.parquet', '.pq')):
+            self.format = 'parquet'
+            try:
+                import pyarrow.parquet as pq
+            except ImportError as e:
+                raise ImportError("Reading Parquet catalogues requires pyarrow") from e
+            self._parquet = pq.ParquetFile(path)
+            metadata = self._parquet.metadata
+            self.num_rows = metadata.num_rows
+            sizes = [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+            self._row_group_starts = np.concatenate([[0], np.cumsum(sizes)])
+        elif lower.endswith(('.fits', '.fit', '.fits.gz')):
+            self.format = 'fits'
+            with fits.open(path, memmap=True) as hdul:
+                self.num_rows = hdul[hdu].header['NAXIS2']
+        else:
+            raise ValueError(f"Unsupported catalogue format: {path}")
+
+    def read_rows(self, start, stop):
+        """
+        Return rows ``[start, stop)`` of the selected columns as a DataFrame.
+        """
+        stop = min(stop, self.num_rows)
+        if self.format == 'fits':
+            with fits.open(self.path, memmap=True) as hdul:
+                rows = hdul[self.hdu].data[start:stop]
+                data = {col: np.array(rows.field(col)).astype(rows.field(col).dtype.newbyteorder('='))
+                        for col in self.columns}
+            return pd.DataFrame(data)
+
+        first = np.searchsorted(self._row_group_starts, start, side='right') - 1
+        last = np.searchsorted(self._row_group_starts, stop, side='left')
+        table = self._parquet.read_row_groups(list(range(first, last)), columns=self.columns)
+        offset = self._row_group_starts[first]
+        return table.slice(start - offset, stop - start).to_pandas()
+
+
+class ChunkStore:
+    """
+    Directory of finished chunks with a JSON manifest for checkpoint/resume.
+
+    Each chunk is written atomically to ``chunk_XXXXX.npz`` (one array per
+    column) and then recorded in ``manifest.json`` together with the run
+    parameters. Reopening a store with different parameters raises
+    ``ValueError`` rather than silently mixing runs.
+
+    Parameters
+    ----------
+    directory : str
+        Output directory, created if needed.
+    parameters : dict
+        JSON-serialisable description of the run (input, chunk size, seed, ...).
+    """
+
+    def __init__(self, directory, parameters):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._manifest_path = os.path.join(directory, 'manifest.json')
+
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path) as f:
+                manifest = json.load(f)
+            if manifest['parameters'] != parameters:
+                raise ValueError(f"Existing store in {directory} was written with different parameters: "
+                                 f"{manifest['parameters']}")
+            self.completed = set(manifest['completed'])
+        else:
+            self.completed = set()
+        self.parameters = parameters
+        self._write_manifest()
+
+    def _chunk_path(self, chunk_num):
+        return os.path.join(self.directory, f'chunk_{chunk_num:05d}.npz')
+
+    def _write_manifest(self):
+        tmp = self._manifest_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'parameters': self.parameters, 'completed': sorted(self.completed)}, f, indent=2)
+        os.replace(tmp, self._manifest_path)
+
+    def write(self, chunk_num, df_chunk):
+        """Persist a finished chunk and mark it complete."""
+        tmp = self._chunk_path(chunk_num) + '.tmp.npz'
+        np.savez(tmp, __columns__=np.array(df_chunk.columns, dtype=str),
+                 **{f'c{i}': df_chunk[col].values for i, col in enumerate(df_chunk.columns)})
+        os.replace(tmp, self._chunk_path(chunk_num))
+        self.completed.add(chunk_num)
+        self._write_manifest()
+
+    def read(self, chunk_num):
+        """Load one finished chunk as a DataFrame."""
+        with np.load(self._chunk_path(chunk_num)) as f:
+            columns = list(f['__columns__'])
+            return pd.DataFrame({col: f[f'c{i}'] for i, col in enumerate(columns)})
+
+
+def load_chunk_store(directory):
+    """
+    Concatenate all finished chunks of a store in chunk order.
+
+    Parameters
+    ----------
+    directory : str
+        Directory written by `ChunkStore`.
+
+    Returns
+    -------
+    pd.DataFrame
+        Combined output of all completed chunks.
+    """
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        manifest = json.load(f)
+    store = ChunkStore(directory, manifest['parameters'])
+    return pd.concat([store.read(i) for i in sorted(store.completed)], ignore_index=True)
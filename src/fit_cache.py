@@ -0,0 +1,188 @@
+"""
+fit_cache.py
+
+Content-addressed cache of XD restarts shared by
+`bic_vs_components.compute_bic_vs_n_components` and
+`gmm_analysis.fit_gmm_fixed_components`.
+
+A seeded restart is fully determined by the input velocities and noise
+covariances, K, the restart index, the root seed and the fit settings, so
+these are hashed into the cache key. A BIC sweep therefore fills the cache
+with exactly the restarts a later fit of the chosen K needs. Entries are small
+``.npz`` files, so they survive kernel restarts, and the least recently used
+ones are evicted once the cache exceeds its size limit.
+"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pygmmis
+
+
+def data_hash(X, cov_matrices):
+    """
+    SHA-256 digest of the velocities and noise covariances of a bin.
+
+    Parameters
+    ----------
+    X : ndarray
+        (N, 3) velocities.
+    cov_matrices : ndarray
+        Per-star noise covariances.
+
+    Returns
+    -------
+    str
+        Hex digest.
+    """
+    digest = hashlib.sha256()
+    for array in (X, cov_matrices):
+        array = np.ascontiguousarray(array, dtype=float)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def fit_key(data_digest, n_components, restart, seed, **settings):
+    """
+    Cache key of one restart.
+
+    Parameters
+    ----------
+    data_digest : str
+        Output of `data_hash`.
+    n_components, restart : int
+        Component count and restart index.
+    seed : int
+        Root seed of the run.
+    **settings
+        Remaining fit settings (``w``, ``tol``, ``engine``, ...); must be
+        JSON-serialisable.
+
+    Returns
+    -------
+    str
+        Hex digest.
+    """
+    description = {'data': data_digest, 'K': int(n_components), 'restart': int(restart), 'seed': int(seed),
+                   **settings}
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+class FitCache:
+    """
+    LRU cache of fitted restarts, in memory or backed by a directory.
+
+    Parameters
+    ----------
+    directory : str, optional
+        Directory for the ``<key>.npz`` entries, created if needed. Without a
+        directory the cache lives in memory only.
+    max_bytes : int, optional
+        Size limit; least recently used entries are evicted beyond it
+        (default: None, unlimited).
+
+    Attributes
+    ----------
+    hits, misses : int
+        Lookup counters.
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # key -> size in bytes, least recently used first
+        self._sizes = OrderedDict()
+        self._memory = {}
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            entries = [name for name in os.listdir(directory) if name.endswith('.npz')]
+            entries.sort(key=lambda name: os.path.getmtime(os.path.join(directory, name)))
+            for name in entries:
+                self._sizes[name[:-4]] = os.path.getsize(os.path.join(directory, name))
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def __contains__(self, key):
+        return key in self._sizes
+
+    @property
+    def nbytes(self):
+        """Total size of the cached entries."""
+        return sum(self._sizes.values())
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def get(self, key):
+        """
+        Look up a restart.
+
+        Returns
+        -------
+        (dict, pygmmis.GMM) or None
+            The restart record (``logL``, ``n_iter``, ``seconds``) and model,
+            or None on a miss.
+        """
+        if key not in self._sizes:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._sizes.move_to_end(key)
+
+        if self.directory is None:
+            entry = self._memory[key]
+        else:
+            path = self._path(key)
+            os.utime(path)
+            with np.load(path) as f:
+                entry = {name: f[name] for name in f.files}
+
+        gmm = pygmmis.GMM(K=len(entry['amp']), D=entry['mean'].shape[1])
+        gmm.amp[:], gmm.mean[:], gmm.covar[:] = entry['amp'], entry['mean'], entry['covar']
+        record = {'logL': float(entry['logL']), 'n_iter': int(entry['n_iter']), 'seconds': float(entry['seconds'])}
+        return record, gmm
+
+    def put(self, key, record, gmm):
+        """Store a restart record and its model, then evict down to ``max_bytes``."""
+        entry = {'amp': gmm.amp.copy(), 'mean': gmm.mean.copy(), 'covar': gmm.covar.copy(),
+                 'logL': np.float64(record['logL']), 'n_iter': np.int64(record['n_iter']),
+                 'seconds': np.float64(record['seconds'])}
+        if self.directory is None:
+            self._memory[key] = entry
+            size = sum(value.nbytes for value in entry.values())
+        else:
+            tmp = self._path(key) + '.tmp.npz'
+            np.savez(tmp, **entry)
+            os.replace(tmp, self._path(key))
+            size = os.path.getsize(self._path(key))
+        self._sizes[key] = size
+        self._sizes.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        total = self.nbytes
+        while total > self.max_bytes and len(self._sizes) > 1:
+            key, size = self._sizes.popitem(last=False)
+            total -= size
+            if self.directory is None:
+                del self._memory[key]
+            else:
+                os.remove(self._path(key))
+
+    def clear(self):
+        """Remove all entries."""
+        for key in list(self._sizes):
+            if self.directory is not None:
+                os.remove(self._path(key))
+        self._sizes.clear()
+        self._memory.clear()
@@ -0,0 +1,187 @@
+"""
+galactocentric_transform.py
+
+Closed-form, pure-NumPy version of the astropy ICRS -> Galactocentric transform
+restricted to what the velocity pipeline needs: Galactocentric cylindrical
+velocities (v_R, v_phi, v_Z) for arrays of any shape. The frame parameters are
+read once from an astropy `Galactocentric` frame, so results agree with
+``ICRS(...).transform_to(gc_frame)`` to round-off.
+"""
+
+import numpy as np
+import astropy.units as u
+
+# (1 mas/yr) * (1 pc) expressed in km/s
+PM_DISTANCE_TO_KMS = (1 * u.mas / u.yr).to(u.rad / u.s).value * (1 * u.pc).to(u.km).value
+
+
+def _rotation_matrix(angle, axis):
+    """Passive rotation matrix about a Cartesian axis (astropy convention)."""
+    c, s = np.cos(angle), np.sin(angle)
+    if axis == 'x':
+        return np.array([[1.0, 0.0, 0.0], [0.0, c, s], [0.0, -s, c]])
+    if axis == 'y':
+        return np.array([[c, 0.0, -s], [0.0, 1.0, 0.0], [s, 0.0, c]])
+    return np.array([[c, s, 0.0], [-s, c, 0.0], [0.0, 0.0, 1.0]])
+
+
+def galactocentric_frame_parameters(gc_frame):
+    """
+    Extract the affine ICRS -> Galactocentric transform from a frame.
+
+    Parameters
+    ----------
+    gc_frame : astropy.coordinates.Galactocentric
+        Target Galactocentric frame.
+
+    Returns
+    -------
+    A : ndarray
+        (3, 3) rotation matrix from ICRS Cartesian to Galactocentric Cartesian.
+    offset : ndarray
+        (3,) position offset in pc.
+    v_sun : ndarray
+        (3,) solar velocity in the Galactocentric frame in km/s.
+    """
+    ra_gc = gc_frame.galcen_coord.ra.to_value(u.rad)
+    dec_gc = gc_frame.galcen_coord.dec.to_value(u.rad)
+    roll = (gc_frame.get_roll0() - gc_frame.roll).to_value(u.rad)
+
+    R = _rotation_matrix(roll, 'x') @ _rotation_matrix(-dec_gc, 'y') @ _rotation_matrix(ra_gc, 'z')
+
+    galcen_distance = gc_frame.galcen_distance.to_value(u.pc)
+    z_d = (gc_frame.z_sun / gc_frame.galcen_distance).decompose().value
+    H = _rotation_matrix(-np.arcsin(z_d), 'y')
+
+    A = H @ R
+    offset = -H @ np.array([galcen_distance, 0.0, 0.0])
+    v_sun = gc_frame.galcen_v_sun.d_xyz.to_value(u.km / u.s)
+    return A, offset, v_sun
+
+
+def icrs_to_galactocentric_cartesian(ra, dec, distance, pmra, pmdec, vlos, gc_frame):
+    """
+    Galactocentric Cartesian positions and velocities for ICRS astrometry.
+
+    Parameters
+    ----------
+    ra, dec : ndarray
+        Sky positions in degrees.
+    distance : ndarray
+        Distances in pc.
+    pmra, pmdec : ndarray
+        Proper motions (pmra includes cos(dec)) in mas/yr.
+    vlos : ndarray
+        Radial velocities in km/s.
+    gc_frame : Galactocentric
+        Target Galactocentric frame.
+
+    Returns
+    -------
+    x, v : ndarray
+        Arrays of shape ``(3,) + broadcast shape`` with positions in pc and
+        velocities in km/s, in the precision of the inputs.
+    """
+    A, offset, v_sun = galactocentric_frame_parameters(gc_frame)
+    # follow the input precision so float32 sample blocks stay float32
+    dtype = np.result_type(ra, dec, distance, pmra, pmdec, vlos)
+    A, offset, v_sun = A.astype(dtype), offset.astype(dtype), v_sun.astype(dtype)
+
+    ra, dec = np.deg2rad(ra), np.deg2rad(dec)
+    cos_ra, sin_ra = np.cos(ra), np.sin(ra)
+    cos_dec, sin_dec = np.cos(dec), np.sin(dec)
+
+    r_hat = np.stack(np.broadcast_arrays(cos_dec * cos_ra, cos_dec * sin_ra, sin_dec))
+    e_ra = np.stack(np.broadcast_arrays(-sin_ra, cos_ra, np.zeros_like(ra)))
+    e_dec = np.stack(np.broadcast_arrays(-sin_dec * cos_ra, -sin_dec * sin_ra, cos_dec))
+
+    v_tan = PM_DISTANCE_TO_KMS * distance
+    v_icrs = vlos * r_hat + (v_tan * pmra) * e_ra + (v_tan * pmdec) * e_dec
+
+    extra = (1,) * (r_hat.ndim - 1)
+    x = np.tensordot(A, distance * r_hat, axes=1) + offset.reshape((3,) + extra)
+    v = np.tensordot(A, v_icrs, axes=1) + v_sun.reshape((3,) + extra)
+    return x, v
+
+
+def icrs_to_galactocentric_cylindrical(ra, dec, distance, pmra, pmdec, vlos, gc_frame):
+    """
+    Vectorized cylindrical velocities (v_R, v_phi, v_Z) in km/s.
+
+    Works on plain arrays of any (broadcastable) shape, e.g. a whole
+    (stars x samples) Monte Carlo block, in a single pass. Units follow the
+    catalogue columns: deg, pc, mas/yr and km/s. Rows with non-finite inputs
+    come out as NaN. The sign of v_phi follows
+    `compute_velocity_components_with_uncertainty` (positive for prograde).
+
+    Returns
+    -------
+    v_R, v_phi, v_Z : ndarray
+        Cylindrical velocity components in km/s.
+    """
+    x, v = icrs_to_galactocentric_cartesian(ra, dec, distance, pmra, pmdec, vlos, gc_frame)
+
+    rho = np.hypot(x[0], x[1])
+    v_R = (x[0] * v[0] + x[1] * v[1]) / rho
+    v_phi = -(x[0] * v[1] - x[1] * v[0]) / rho
+    return v_R, v_phi, v[2]
+
+
+def galactocentric_cylindrical_jacobian(ra, dec, distance, pmra, pmdec, vlos, gc_frame):
+    """
+    Jacobian of (v_R, v_phi, v_Z) with respect to (distance, pmra, pmdec, vlos).
+
+    Derived analytically from the same affine transform as
+    `icrs_to_galactocentric_cylindrical`. The distance derivative includes the
+    rotation of the cylindrical basis as the star moves in azimuth.
+
+    Parameters
+    ----------
+    ra, dec, distance, pmra, pmdec, vlos : ndarray
+        Astrometry of shape ``(N,)`` in deg, pc, mas/yr and km/s.
+    gc_frame : Galactocentric
+        Target Galactocentric frame.
+
+    Returns
+    -------
+    velocities : ndarray
+        (N, 3) array of (v_R, v_phi, v_Z) in km/s.
+    jacobian : ndarray
+        (N, 3, 4) array of partial derivatives, columns ordered as
+        (distance [pc], pmra [mas/yr], pmdec [mas/yr], vlos [km/s]).
+    """
+    A, _, _ = galactocentric_frame_parameters(gc_frame)
+    x, v = icrs_to_galactocentric_cartesian(ra, dec, distance, pmra, pmdec, vlos, gc_frame)
+
+    ra, dec = np.deg2rad(ra), np.deg2rad(dec)
+    cos_ra, sin_ra = np.cos(ra), np.sin(ra)
+    cos_dec, sin_dec = np.cos(dec), np.sin(dec)
+    r_hat = A @ np.stack([cos_dec * cos_ra, cos_dec * sin_ra, sin_dec])
+    e_ra = A @ np.stack([-sin_ra, cos_ra, np.zeros_like(ra)])
+    e_dec = A @ np.stack([-sin_dec * cos_ra, -sin_dec * sin_ra, cos_dec])
+
+    # Cartesian derivatives, each of shape (3, N)
+    dx_dd = r_hat
+    dv = np.stack([
+        PM_DISTANCE_TO_KMS * (pmra * e_ra + pmdec * e_dec),
+        PM_DISTANCE_TO_KMS * distance * e_ra,
+        PM_DISTANCE_TO_KMS * distance * e_dec,
+        r_hat,
+    ], axis=-1)  # (3, N, 4)
+
+    rho = np.hypot(x[0], x[1])
+    e_R = np.stack([x[0] / rho, x[1] / rho])
+    e_phi = np.stack([-x[1] / rho, x[0] / rho])
+    v_R = e_R[0] * v[0] + e_R[1] * v[1]
+    v_phi_proj = e_phi[0] * v[0] + e_phi[1] * v[1]
+    dphi_dd = (x[0] * dx_dd[1] - x[1] * dx_dd[0]) / rho**2
+
+    jacobian = np.empty((len(rho), 3, 4))
+    jacobian[:, 0, :] = e_R[0][:, None] * dv[0] + e_R[1][:, None] * dv[1]
+    jacobian[:, 1, :] = -(e_phi[0][:, None] * dv[0] + e_phi[1][:, None] * dv[1])
+    jacobian[:, 2, :] = dv[2]
+    jacobian[:, 0, 0] += dphi_dd * v_phi_proj
+    jacobian[:, 1, 0] += dphi_dd * v_R
+
+    velocities = np.stack([v_R, -v_phi_proj, v[2]], axis=1)
+    return velocities, jacobian
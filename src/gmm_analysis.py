@@ -4,12 +4,19 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.patches import Ellipse
-from tqdm import tqdm
 import pygmmis
 import pickle
 
+from velocity_covariance import velocity_covariance_stack
+from xd_fitting import best_restart, bootstrap_fits, run_xd_restarts, successive_halving_restarts
 
-def fit_gmm_fixed_components(df_bin, n_components, n_init=50):
+# Per-component quantities of `component_parameters`, in column order
+GMM_QUANTITIES = ['weight', 'v_R', 'sigma_R', 'v_phi', 'sigma_phi', 'v_Z', 'sigma_Z']
+
+
+def fit_gmm_fixed_components(df_bin, n_components, n_init=50, covariance=None, seed=None, n_workers=1,
+                             return_restarts=False, engine="pygmmis", early_stopping=None, stochastic=None,
+                             cache=None):
     """
     Fit a Gaussian Mixture Model (GMM) to 3D velocity data using Extreme Deconvolution (XD).
 
@@ -17,37 +24,155 @@ def fit_gmm_fixed_components(df_bin, n_components, n_init=50):
     ----------
     df_bin : pd.DataFrame
         DataFrame containing velocity components and their uncertainties ('v_R', 'v_phi', 'v_Z').
+        If the packed covariance columns from `process_data_monte_carlo` are present,
+        the full per-star covariances are used instead of the diagonal uncertainties.
     n_components : int
         Number of Gaussian components to fit.
     n_init : int, optional
         Number of initializations to avoid local minima (default: 50).
+    covariance : ndarray, optional
+        Per-star noise covariances in the packed (N, 6) layout or as (N, 3, 3).
+    seed : int, optional
+        Root seed for the restarts (see `xd_fitting.run_xd_restarts`). With a
+        seed, the result is identical for any ``n_workers``.
+    n_workers : int, optional
+        Number of worker processes for the restarts (default: 1).
+    return_restarts : bool, optional
+        Also return the per-restart table (logL, iteration count, wall time).
+    engine : {"numpy", "pygmmis"}, optional
+        EM implementation (default: ``pygmmis.fit``); ``"numpy"`` selects the
+        vectorized `xd_em` engine.
+    early_stopping : bool or dict, optional
+        Schedule the restarts with `xd_fitting.successive_halving_restarts`
+        instead of running each to convergence. A dict is passed on as
+        options (``min_iter``, ``eta``, ``batch_size``, ``plateau_window``).
+        Requires ``engine="numpy"``.
+    stochastic : bool or dict, optional
+        Fit each restart with mini-batch EM followed by full-data polishing
+        (`xd_em.xd_stochastic_em`), for bins of 10^5 stars and more. A dict
+        is passed on as options (``batch_size``, ``n_epochs``, ``kappa``).
+        Requires ``engine="numpy"``; not combined with ``early_stopping``.
+    cache : fit_cache.FitCache or str, optional
+        Cache of seeded restarts shared with `compute_bic_vs_n_components`;
+        restarts already in it are reused (a string is taken as a cache
+        directory). Not used with ``early_stopping``.
 
     Returns
     -------
     best_gmm : pygmmis.GMM
         Best-fitted GMM object with highest log-likelihood.
+    restarts : pd.DataFrame
+        Only if ``return_restarts`` is True.
     """
     X = df_bin[['v_R', 'v_phi', 'v_Z']].values
-    uncertainties = np.stack([
-        df_bin['v_R_uncertainty'].values**2,
-        df_bin['v_phi_uncertainty'].values**2,
-        df_bin['v_Z_uncertainty'].values**2
-    ], axis=1)
-    cov_matrices = np.array([np.diag(u) for u in uncertainties])
+    cov_matrices = velocity_covariance_stack(df_bin, covariance)
+
+    desc = f"Fitting GMM with {n_components} components"
+    if early_stopping:
+        if engine != "numpy" or stochastic:
+            raise ValueError("early_stopping requires engine='numpy' and no stochastic EM")
+        options = early_stopping if isinstance(early_stopping, dict) else {}
+        restarts, models = successive_halving_restarts(
+            X, cov_matrices, n_components, n_init=n_init, seed=seed, n_workers=n_workers, desc=desc, **options
+        )
+    else:
+        restarts, models = run_xd_restarts(
+            X, cov_matrices, [n_components], n_init=n_init, seed=seed, n_workers=n_workers,
+            engine=engine, stochastic=stochastic, cache=cache, desc=desc
+        )
+    best_gmm = best_restart(restarts, models, n_components)
+
+    if return_restarts:
+        return best_gmm, restarts
+    return best_gmm
 
-    best_gmm = None
-    best_logL = -np.inf
 
-    for _ in tqdm(range(n_init), desc=f"Fitting GMM with {n_components} components"):
-        gmm = pygmmis.GMM(K=n_components, D=3)
-        pygmmis.initFromKMeans(gmm, X)
-        logL, _ = pygmmis.fit(gmm, X, covar=cov_matrices, w=0.1, tol=1e-6, init_method='kmeans')
+def component_parameters(gmm):
+    """
+    Weights and velocity moments of each component.
+
+    Parameters
+    ----------
+    gmm : pygmmis.GMM
+        Fitted GMM model.
+
+    Returns
+    -------
+    ndarray
+        (K, 7) array with the columns of `GMM_QUANTITIES`: weight (%), then
+        mean and dispersion of v_R, v_phi and v_Z.
+    """
+    weights = gmm.amp / np.sum(gmm.amp) * 100
+    std_devs = np.sqrt(np.diagonal(gmm.covar, axis1=1, axis2=2))
+    return np.column_stack([weights, gmm.mean[:, 0], std_devs[:, 0], gmm.mean[:, 1], std_devs[:, 1],
+                            gmm.mean[:, 2], std_devs[:, 2]])
 
-        if logL > best_logL:
-            best_logL = logL
-            best_gmm = gmm
 
-    return best_gmm
+def bootstrap_gmm_parameters(df_bin, gmm, n_boot=200, method="resample", percentiles=(16, 84), covariance=None,
+                             seed=None, n_workers=1, return_replicates=False):
+    """
+    Bootstrap percentile intervals of the GMM parameters.
+
+    The data are resampled (or Poisson-reweighted) ``n_boot`` times and the
+    model is refitted to each replicate starting from ``gmm``
+    (`xd_fitting.bootstrap_fits`). The warm start keeps the component order,
+    so component ``k`` of every replicate is matched to component ``k`` of
+    ``gmm``.
+
+    Parameters
+    ----------
+    df_bin : pd.DataFrame
+        DataFrame the GMM was fitted on.
+    gmm : pygmmis.GMM
+        Full-data fit, e.g. from `fit_gmm_fixed_components`.
+    n_boot : int, optional
+        Number of replicates (default: 200).
+    method : {"resample", "poisson"}, optional
+        Bootstrap scheme, see `xd_fitting.bootstrap_fits`.
+    percentiles : tuple of float, optional
+        Lower and upper percentile of the intervals (default: (16, 84)).
+    covariance : ndarray, optional
+        Per-star noise covariances in the packed (N, 6) layout or as (N, 3, 3).
+    seed : int, optional
+        Root seed of the replicates; with a seed the result is identical for
+        any ``n_workers``.
+    n_workers : int, optional
+        Number of worker processes (default: 1).
+    return_replicates : bool, optional
+        Also return the parameters of every replicate.
+
+    Returns
+    -------
+    intervals : pd.DataFrame
+        One row per (component, quantity) with the full-data ``value``, the
+        interval bounds ``lower`` and ``upper`` and the bootstrap ``std``.
+        Pass it to `extract_gmm_parameters` as ``uncertainties``.
+    replicates : pd.DataFrame
+        Only if ``return_replicates`` is True: one row per (replicate,
+        component) with the columns of `GMM_QUANTITIES`.
+    """
+    X = df_bin[['v_R', 'v_phi', 'v_Z']].values
+    cov_matrices = velocity_covariance_stack(df_bin, covariance)
+
+    table, models = bootstrap_fits(X, cov_matrices, gmm, n_boot=n_boot, method=method, seed=seed,
+                                   n_workers=n_workers)
+    values = np.stack([component_parameters(models[b]) for b in table['replicate']])
+    lower, upper = np.percentile(values, percentiles, axis=0)
+    std = values.std(axis=0, ddof=1)
+    full = component_parameters(gmm)
+
+    intervals = pd.DataFrame([
+        {'component': k, 'quantity': quantity, 'value': full[k, j], 'lower': lower[k, j], 'upper': upper[k, j],
+         'std': std[k, j]}
+        for k in range(gmm.K) for j, quantity in enumerate(GMM_QUANTITIES)
+    ])
+
+    if return_replicates:
+        replicates = pd.DataFrame(values.reshape(-1, len(GMM_QUANTITIES)), columns=GMM_QUANTITIES)
+        replicates.insert(0, 'component', np.tile(np.arange(gmm.K), len(values)))
+        replicates.insert(0, 'replicate', np.repeat(table['replicate'].values, gmm.K))
+        return intervals, replicates
+    return intervals
 
 
 def plot_gmm_with_contributions(df_bin, gmm, bin_label, bins=100, x_limits=(-400, 400), y_limits=(-400, 400),
@@ -139,7 +264,7 @@ def plot_gmm_with_contributions(df_bin, gmm, bin_label, bins=100, x_limits=(-400
     plt.show()
 
 
-def extract_gmm_parameters(gmm, df, label, component_assignments=None):
+def extract_gmm_parameters(gmm, df, label, component_assignments=None, uncertainties=None):
     """
     Extracts and formats GMM parameters for structured reporting.
 
@@ -153,6 +278,9 @@ def extract_gmm_parameters(gmm, df, label, component_assignments=None):
         Label for the bin (e.g., a metallicity label).
     component_assignments : dict, optional
         Optional mapping from component names to GMM indices.
+    uncertainties : pd.DataFrame, optional
+        Intervals from `bootstrap_gmm_parameters`; each value is then printed
+        as ``value +upper/-lower``.
 
     Returns
     -------
@@ -186,16 +314,25 @@ def extract_gmm_parameters(gmm, df, label, component_assignments=None):
     std_devs = std_devs[ordered_indices]
     weights = weights[ordered_indices]
 
-    df_results = pd.DataFrame({
-        "Component": component_names,
-        "Weights (%)": weights,
-        r"$v_R$": means[:, 0],
-        r"$\sigma_R$": std_devs[:, 0],
-        r"$v_\phi$": means[:, 1],
-        r"$\sigma_\phi$": std_devs[:, 1],
-        r"$v_Z$": means[:, 2],
-        r"$\sigma_Z$": std_devs[:, 2]
-    })
+    columns = {
+        "Weights (%)": ('weight', weights, 1),
+        r"$v_R$": ('v_R', means[:, 0], 2),
+        r"$\sigma_R$": ('sigma_R', std_devs[:, 0], 2),
+        r"$v_\phi$": ('v_phi', means[:, 1], 2),
+        r"$\sigma_\phi$": ('sigma_phi', std_devs[:, 1], 2),
+        r"$v_Z$": ('v_Z', means[:, 2], 2),
+        r"$\sigma_Z$": ('sigma_Z', std_devs[:, 2], 2),
+    }
+    df_results = pd.DataFrame({"Component": component_names})
+    if uncertainties is None:
+        for column, (_, values, _) in columns.items():
+            df_results[column] = values
+    else:
+        intervals = uncertainties.set_index(['component', 'quantity'])
+        for column, (quantity, values, digits) in columns.items():
+            rows = intervals.loc[[(k, quantity) for k in ordered_indices]]
+            df_results[column] = [f"{value:.{digits}f} +{hi:.{digits}f}/-{lo:.{digits}f}" for value, hi, lo in
+                                  zip(values, rows['upper'] - rows['value'], rows['value'] - rows['lower'])]
 
     output = f"\n{label} ({num_stars} stars)\n"
     output += df_results.to_string(index=False, justify="center")
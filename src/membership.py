@@ -0,0 +1,198 @@
+"""
+membership.py
+
+Per-star component membership probabilities of a fitted velocity mixture.
+
+The fits are deconvolved, so star i is scored against the noise-convolved
+components N(v_i | mu_k, Sigma_k + V_i) with its own noise covariance V_i,
+exactly as in the E-step of `xd_em`. The catalogue is processed in chunks:
+from the cofactors of the packed 3x3 matrices T = Sigma_k + V_i only the
+determinant and the quadratic form dx^T adj(T) dx / det(T) are computed,
+never an inverse, and the posterior is normalised with a vectorized
+log-sum-exp. For diagonal noise, e.g. from the ``v_*_uncertainty`` columns,
+the off-diagonal terms are the component's own and cost no per-star work.
+Chunks can be spread over a thread pool, since numpy releases the GIL in the
+element-wise kernels.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from velocity_covariance import UNCERTAINTY_COLUMNS, VELOCITY_COVARIANCE_COLUMNS, pack_covariance
+from xd_em import LOG_2PI, chunk_slices, packed_noise
+
+
+def _score_chunk(X, diag, off, log_amp, mean, S, out, log_like):
+    """
+    Posterior of one chunk of stars into ``out`` (n, K) and their log-likelihood into ``log_like`` (n,).
+
+    ``X``, ``diag`` and ``off`` are transposed, (3, n): all terms are (K, n)
+    arrays, so the inner loops run over stars rather than the few components.
+    """
+    S = S[:, :, None]
+    a = diag[0] + S[:, 0]
+    b = diag[1] + S[:, 1]
+    c = diag[2] + S[:, 2]
+    if off is None:
+        d, e, f = S[:, 3], S[:, 4], S[:, 5]
+    else:
+        d = off[0] + S[:, 3]
+        e = off[1] + S[:, 4]
+        f = off[2] + S[:, 5]
+
+    # cofactors of T = Sigma_k + V_i; chi2 = dx^T adj(T) dx / det(T)
+    c00 = b * c - f * f
+    c11 = a * c - e * e
+    c22 = a * b - d * d
+    c01 = e * f - d * c
+    c02 = d * f - b * e
+    c12 = d * e - a * f
+    det = a * c00
+    det += d * c01
+    det += e * c02
+
+    dx0 = X[0] - mean[:, 0, None]
+    dx1 = X[1] - mean[:, 1, None]
+    dx2 = X[2] - mean[:, 2, None]
+    c01 *= 2 * dx1
+    c01 += c00 * dx0
+    c02 *= 2 * dx2
+    c01 += c02
+    q = c01 * dx0
+    c12 *= 2 * dx2
+    c12 += c11 * dx1
+    q += c12 * dx1
+    c22 *= dx2 * dx2
+    q += c22
+    q /= det
+
+    # log(amp_k N(x_i | mu_k, T_ik)) without the constant -1.5 log(2 pi)
+    np.log(det, out=det)
+    q += det
+    q *= -0.5
+    q += log_amp[:, None]
+
+    # vectorized log-sum-exp over components
+    peak = q.max(axis=0)
+    q -= peak
+    np.exp(q, out=q)
+    total = q.sum(axis=0)
+    q /= total
+    out[:] = q.T
+    if log_like is not None:
+        log_like[:] = peak + np.log(total) - 1.5 * LOG_2PI
+
+
+def membership_probabilities(gmm, X, noise, chunk_size=8192, n_threads=1, return_log_likelihood=False):
+    """
+    Posterior probability of each component for every star.
+
+    Parameters
+    ----------
+    gmm : pygmmis.GMM or model_store.StoredModel
+        Deconvolved mixture model.
+    X : ndarray
+        (N, 3) velocities.
+    noise : ndarray
+        Per-star noise: ``(N, 3)`` variances, ``(N, 6)`` packed covariances or
+        ``(N, 3, 3)`` (see `xd_em.packed_noise`). Diagonal noise takes the
+        fast path.
+    chunk_size : int, optional
+        Stars per chunk (default: 8192, which keeps the temporaries in cache).
+    n_threads : int, optional
+        Threads the chunks are spread over (default: 1).
+    return_log_likelihood : bool, optional
+        Also return each star's deconvolved log-likelihood, as in
+        `xd_em.xd_log_likelihood`.
+
+    Returns
+    -------
+    probabilities : ndarray
+        (N, K) membership probabilities; rows sum to one. Stars with missing
+        velocities get NaN.
+    log_likelihood : ndarray
+        (N,) log-likelihoods, only if ``return_log_likelihood`` is True.
+    """
+    X = np.ascontiguousarray(np.asarray(X, dtype=float).T)
+    diag, off = packed_noise(noise)
+    diag = np.ascontiguousarray(diag.T)
+    off = None if off is None else np.ascontiguousarray(off.T)
+    S = pack_covariance(np.asarray(gmm.covar))
+    log_amp = np.log(np.asarray(gmm.amp) / np.sum(gmm.amp))
+    mean = np.asarray(gmm.mean)
+
+    n = X.shape[1]
+    probabilities = np.empty((n, len(log_amp)))
+    log_like = np.empty(n) if return_log_likelihood else None
+
+    def score(rows):
+        _score_chunk(X[:, rows], diag[:, rows], None if off is None else off[:, rows], log_amp, mean, S,
+                     probabilities[rows], None if log_like is None else log_like[rows])
+
+    if n_threads > 1:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            list(executor.map(score, chunk_slices(n, chunk_size)))
+    else:
+        for rows in chunk_slices(n, chunk_size):
+            score(rows)
+
+    if return_log_likelihood:
+        return probabilities, log_like
+    return probabilities
+
+
+def score_membership(df, gmm, names=None, prefix='P_', covariance=None, chunk_size=8192, n_threads=1,
+                     log_likelihood_column=None):
+    """
+    Add membership-probability columns to a catalogue.
+
+    The noise is taken from ``covariance`` if given, otherwise from the
+    `VELOCITY_COVARIANCE_COLUMNS` if present, otherwise from the
+    `UNCERTAINTY_COLUMNS` (diagonal noise, the fast path).
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Catalogue with ``v_R``, ``v_phi`` and ``v_Z`` and noise columns; the
+        columns are added in place.
+    gmm : pygmmis.GMM or model_store.StoredModel
+        Deconvolved mixture model.
+    names : list of str or dict, optional
+        Column name suffix per component, either a list in component order or
+        a mapping from name to component index as in the
+        ``component_assignments`` of `gmm_analysis.extract_gmm_parameters`
+        (e.g. ``{'GS/E 1': 2}``). Defaults to the component indices.
+    prefix : str, optional
+        Column name prefix (default: ``'P_'``).
+    covariance : ndarray, optional
+        Per-star noise covariances, packed (N, 6) or (N, 3, 3).
+    chunk_size, n_threads : int, optional
+        See `membership_probabilities`.
+    log_likelihood_column : str, optional
+        Also store each star's deconvolved log-likelihood under this name.
+
+    Returns
+    -------
+    pd.DataFrame
+        ``df`` with the new columns.
+    """
+    if covariance is None:
+        if all(col in df.columns for col in VELOCITY_COVARIANCE_COLUMNS):
+            covariance = df[VELOCITY_COVARIANCE_COLUMNS].values
+        else:
+            covariance = df[UNCERTAINTY_COLUMNS].values**2
+
+    probabilities, log_like = membership_probabilities(gmm, df[['v_R', 'v_phi', 'v_Z']].values, covariance,
+                                                       chunk_size=chunk_size, n_threads=n_threads,
+                                                       return_log_likelihood=True)
+
+    if names is None:
+        names = {str(k): k for k in range(probabilities.shape[1])}
+    elif not isinstance(names, dict):
+        names = {name: k for k, name in enumerate(names)}
+    for name, k in names.items():
+        df[f'{prefix}{name}'] = probabilities[:, k]
+    if log_likelihood_column is not None:
+        df[log_likelihood_column] = log_like
+    return df
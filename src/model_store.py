@@ -0,0 +1,230 @@
+"""
+model_store.py
+
+Versioned on-disk store for fitted velocity mixtures, replacing the pickled
+``pygmmis.GMM`` objects in ``models/``.
+
+Each model is one ``<name>.npz`` file holding the ``amp``, ``mean`` and
+``covar`` arrays and a JSON ``__header__`` with the format version, K and the
+fit metadata (log-likelihood, data hash, hyperparameters, ...). Listing a store
+reads only the headers, and loaded models fetch their arrays on first use.
+Neither needs pygmmis, and the files can be inspected with plain
+``numpy.load``.
+
+The ``models/gmm_*.npz`` files are the canonical copies of the fitted models.
+The ``models/gmm_*.pkl`` files they were imported from are kept only because
+the notebooks still unpickle them; they hold the same arrays. The import
+recorded the settings the notebooks fitted them with (pygmmis, ``w=0.1``,
+``tol=1e-6``, k-means initialisation, ``n_init=50`` for the full bins and 100
+for the alpha-split ones); their log-likelihood and data hash were not kept
+and are stored as null.
+"""
+
+import json
+import os
+import pickle
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+FORMAT_VERSION = 1
+
+
+def _read_header(path):
+    with np.load(path) as f:
+        header = json.loads(str(f['__header__']))
+    if header.get('format_version', 0) > FORMAT_VERSION:
+        raise ValueError(f"{path} was written with model format {header['format_version']}, "
+                         f"newer than the supported version {FORMAT_VERSION}")
+    return header
+
+
+class StoredModel:
+    """
+    A mixture loaded from a `ModelStore`.
+
+    Provides the ``K``, ``D``, ``amp``, ``mean`` and ``covar`` attributes and
+    the ``draw`` method of ``pygmmis.GMM``, which is all that
+    `gmm_analysis.extract_gmm_parameters`,
+    `gmm_analysis.plot_gmm_with_contributions` and `residual_analysis` use.
+    The arrays are read from disk on first access.
+
+    Attributes
+    ----------
+    name : str
+        Model name in the store.
+    header : dict
+        Format version, K, D and the fit metadata.
+    """
+
+    def __init__(self, path, header):
+        self.path = path
+        self.name = header['name']
+        self.header = header
+        self._arrays = None
+
+    def _load(self):
+        if self._arrays is None:
+            with np.load(self.path) as f:
+                self._arrays = {key: f[key] for key in ('amp', 'mean', 'covar')}
+        return self._arrays
+
+    @property
+    def amp(self):
+        return self._load()['amp']
+
+    @property
+    def mean(self):
+        return self._load()['mean']
+
+    @property
+    def covar(self):
+        return self._load()['covar']
+
+    @property
+    def K(self):
+        return self.header['K']
+
+    @property
+    def D(self):
+        return self.header['D']
+
+    def draw(self, size=1, rng=np.random):
+        """
+        Draw samples from the mixture.
+
+        Follows ``pygmmis.GMM.draw`` exactly, so a given ``rng`` state gives
+        the same samples as the original model.
+
+        Returns
+        -------
+        ndarray
+            (size, D) samples.
+        """
+        ind = rng.choice(self.K, size=size, p=self.amp / self.amp.sum())
+        N = np.bincount(ind, minlength=self.K)
+
+        samples = np.empty((size, self.D))
+        lower = 0
+        for k in np.flatnonzero(N):
+            upper = lower + N[k]
+            samples[lower:upper, :] = rng.multivariate_normal(self.mean[k], self.covar[k], size=N[k])
+            lower = upper
+        return samples
+
+    def to_pygmmis(self):
+        """Return an equivalent ``pygmmis.GMM`` (imports pygmmis)."""
+        import pygmmis
+        gmm = pygmmis.GMM(K=self.K, D=self.D)
+        gmm.amp[:], gmm.mean[:], gmm.covar[:] = self.amp, self.mean, self.covar
+        return gmm
+
+    def __repr__(self):
+        return f"StoredModel(name={self.name!r}, K={self.K})"
+
+
+class ModelStore:
+    """
+    Directory of ``<name>.npz`` mixture models.
+
+    Parameters
+    ----------
+    directory : str
+        Store directory, created if needed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, f'{name}.npz')
+
+    def names(self):
+        """Sorted names of the stored models."""
+        return sorted(entry[:-4] for entry in os.listdir(self.directory) if entry.endswith('.npz'))
+
+    def __contains__(self, name):
+        return os.path.exists(self._path(name))
+
+    def save(self, name, gmm, **metadata):
+        """
+        Write a model with its fit metadata.
+
+        Parameters
+        ----------
+        name : str
+            Model name; an existing model of that name is replaced.
+        gmm : pygmmis.GMM or StoredModel
+            Object with ``amp``, ``mean`` and ``covar``.
+        **metadata
+            JSON-serialisable fit metadata, e.g. ``logL``, ``data_hash``,
+            ``w``, ``tol``, ``seed``, ``n_init``.
+
+        Returns
+        -------
+        StoredModel
+        """
+        amp, mean, covar = np.asarray(gmm.amp), np.asarray(gmm.mean), np.asarray(gmm.covar)
+        header = {
+            'format_version': FORMAT_VERSION,
+            'name': name,
+            'K': int(len(amp)),
+            'D': int(mean.shape[1]),
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            **metadata,
+        }
+        path = self._path(name)
+        tmp = path + '.tmp.npz'
+        np.savez_compressed(tmp, __header__=np.array(json.dumps(header)), amp=amp, mean=mean, covar=covar)
+        os.replace(tmp, path)
+        return StoredModel(path, header)
+
+    def load(self, name):
+        """
+        Open a stored model; its arrays are read on first access.
+
+        Returns
+        -------
+        StoredModel
+        """
+        path = self._path(name)
+        if not os.path.exists(path):
+            raise KeyError(f"No model '{name}' in {self.directory}")
+        return StoredModel(path, _read_header(path))
+
+    def list(self):
+        """
+        Headers of all stored models, without loading any arrays.
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per model, indexed by name.
+        """
+        headers = [_read_header(self._path(name)) for name in self.names()]
+        if not headers:
+            return pd.DataFrame(columns=['K', 'D']).rename_axis('name')
+        return pd.DataFrame(headers).set_index('name')
+
+    def import_pickle(self, path, name=None, **metadata):
+        """
+        Copy a pickled ``pygmmis.GMM`` (e.g. ``models/gmm_vmp.pkl``) into the store.
+
+        The name defaults to the file name without extension. Unpickling
+        imports pygmmis. A pickle holds no fit metadata, so ``logL`` and
+        ``data_hash`` are recorded as null unless given; the fit settings
+        (``w``, ``tol``, ``n_init``, ``engine``, ...) should be passed as
+        ``metadata``.
+
+        Returns
+        -------
+        StoredModel
+        """
+        with open(path, 'rb') as f:
+            gmm = pickle.load(f)
+        if name is None:
+            name = os.path.splitext(os.path.basename(path))[0]
+        metadata = {'logL': None, 'data_hash': None, **metadata}
+        return self.save(name, gmm, source=os.path.basename(path), **metadata)
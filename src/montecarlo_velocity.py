@@ -5,14 +5,156 @@ This module provides utilities for computing velocity uncertainties of stars usi
 Monte Carlo sampling, based on astrometric measurements and the Galactocentric frame.
 """
 
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import numpy as np
 import pandas as pd
+from scipy.special import ndtri
+from scipy.stats import qmc
 from tqdm import tqdm
 import astropy.units as u
 from astropy.coordinates import ICRS, Galactocentric, CylindricalRepresentation, CylindricalDifferential
 
+from galactocentric_transform import icrs_to_galactocentric_cylindrical, galactocentric_cylindrical_jacobian
+from catalogue_io import MONTE_CARLO_INPUT_COLUMNS, CatalogueReader, ChunkStore
+from velocity_covariance import VELOCITY_COVARIANCE_COLUMNS, RunningVelocityMoments, pack_covariance
+
+
+def _pm_correlation(df_chunk, correlation_pmra_pmdec):
+    """
+    Resolve the pmra/pmdec correlation coefficient for every star in a chunk.
+
+    ``None`` selects the per-star Gaia ``pmra_pmdec_corr`` column, a scalar is
+    shared by all stars and an array-like is taken as one value per star.
+    """
+    if correlation_pmra_pmdec is None:
+        rho = df_chunk['pmra_pmdec_corr'].values
+    else:
+        rho = np.asarray(correlation_pmra_pmdec, dtype=float)
+    return np.broadcast_to(rho, (len(df_chunk),))
+
+
+def _standard_normal(rng, size, dtype=np.float64):
+    """
+    Standard normal draws made directly in ``dtype``.
+
+    Only a `numpy.random.Generator` can draw in float32; a legacy state (e.g.
+    the global ``np.random``) then only seeds one, so no float64 copy of the
+    block is ever made.
+    """
+    if np.dtype(dtype) == np.float64:
+        return rng.standard_normal(size)
+    if not isinstance(rng, np.random.Generator):
+        rng = np.random.default_rng(rng.randint(2**31))
+    return rng.standard_normal(size, dtype=dtype)
+
 
-def generate_monte_carlo_samples(df_chunk, n_samples, correlation_pmra_pmdec):
+def standard_normal_block(num_stars, n_samples, n_dims, sampler="random", rng=None, dtype=np.float64):
+    """
+    Standard normal draws of shape ``(n_dims, num_stars, n_samples)``.
+
+    Parameters
+    ----------
+    num_stars, n_samples, n_dims : int
+        Block dimensions; ``n_dims`` is the number of independent inputs per star.
+    sampler : {"random", "sobol", "lhs"}, optional
+        ``"random"`` uses pseudo-random normals. ``"sobol"`` pushes a scrambled
+        Sobol sequence in ``n_dims`` dimensions through the inverse normal CDF.
+        Each star gets an independent random digital shift, so per-star
+        estimates stay unbiased and the stars stay uncorrelated; powers of two
+        for ``n_samples`` give the best balance. ``"lhs"`` uses an independent
+        Latin hypercube for each star and dimension.
+    rng : numpy.random.Generator, optional
+        Random number source; defaults to the global ``np.random`` state.
+    dtype : numpy dtype, optional
+        Precision of the returned block (default: float64). Pseudo-random
+        float32 normals are drawn directly in float32, which is a different
+        stream than float64 for the same seed. The quasi-random points are
+        the same in both precisions: they are transformed one dimension at a
+        time in float64 and written into the block, so only a single
+        ``(num_stars, n_samples)`` float64 slice is ever alive.
+
+    Returns
+    -------
+    ndarray
+        Array of shape ``(n_dims, num_stars, n_samples)``.
+    """
+    if sampler == "random":
+        rng = np.random if rng is None else rng
+        return _standard_normal(rng, (n_dims, num_stars, n_samples), dtype)
+
+    if rng is None or rng is np.random:
+        rng = np.random.default_rng(np.random.randint(2**31))
+
+    z = np.empty((n_dims, num_stars, n_samples), dtype=dtype)
+    if sampler == "sobol":
+        bits = 30
+        engine = qmc.Sobol(d=n_dims, scramble=True, bits=bits, seed=rng)
+        base = (engine.random(n_samples) * 2**bits).astype(np.uint64).T  # (n_dims, n_samples)
+        shift = rng.integers(0, 2**bits, size=(n_dims, num_stars), dtype=np.uint64)
+        for d in range(n_dims):
+            z[d] = ndtri((np.bitwise_xor(base[d], shift[d, :, None]) + 0.5) / 2**bits)
+    elif sampler == "lhs":
+        # all strata are drawn before the jitter, as for one (n_dims, ...) block;
+        # the ranks are exact in float32 up to 2**24 samples
+        for d in range(n_dims):
+            z[d] = np.argsort(rng.random((num_stars, n_samples)), axis=1)
+        for d in range(n_dims):
+            z[d] = ndtri((z[d] + rng.random((num_stars, n_samples))) / n_samples)
+    else:
+        raise ValueError(f"Unknown sampler '{sampler}', expected 'random', 'sobol' or 'lhs'")
+    return z
+
+
+def sample_correlated_proper_motions(pmra, pmdec, pmra_err, pmdec_err, rho, n_samples, rng=None, z=None):
+    """
+    Draw correlated (pmra, pmdec) samples for all stars in one vectorized call.
+
+    The per-star 2x2 covariance is never formed explicitly; its Cholesky factor
+    is applied analytically to a block of standard normal draws,
+
+    ``pmra = mu_a + s_a z_1`` and
+    ``pmdec = mu_d + s_d (rho z_1 + sqrt(1 - rho^2) z_2)``.
+
+    Parameters
+    ----------
+    pmra, pmdec : ndarray
+        Proper motions of each star, shape ``(N,)``.
+    pmra_err, pmdec_err : ndarray
+        Proper-motion uncertainties of each star, shape ``(N,)``.
+    rho : float or ndarray
+        Correlation coefficient, scalar or shape ``(N,)``.
+    n_samples : int
+        Number of samples to draw for each star.
+    rng : numpy.random.Generator, optional
+        Random number source; defaults to the global ``np.random`` state.
+    z : ndarray, optional
+        Pre-drawn standard normals of shape ``(2, N, n_samples)``, e.g. from a
+        quasi-random `standard_normal_block`; ``rng`` is then unused. Otherwise
+        the normals are drawn in the precision of ``pmra`` and ``pmra_err``.
+
+    Returns
+    -------
+    pmra_samples, pmdec_samples : ndarray
+        Arrays of shape ``(N, n_samples)``.
+    """
+    rho = np.clip(np.broadcast_to(rho, np.shape(pmra)), -1.0, 1.0)[:, None]
+    dtype = np.result_type(pmra, pmra_err)
+    if z is None:
+        rng = np.random if rng is None else rng
+        z = _standard_normal(rng, (2, len(pmra), n_samples), dtype)
+    z = z.astype(dtype, copy=False)
+    rho = rho.astype(z.dtype)
+
+    pmra_samples = pmra[:, None] + pmra_err[:, None] * z[0]
+    pmdec_samples = pmdec[:, None] + pmdec_err[:, None] * (rho * z[0] + np.sqrt(1.0 - rho**2) * z[1])
+    return pmra_samples, pmdec_samples
+
+
+def generate_monte_carlo_samples(df_chunk, n_samples, correlation_pmra_pmdec, rng=None, sampler="random",
+                                 dtype=np.float64):
     """
     Generate Monte-Carlo samples for each star using its uncertainties.
 
@@ -22,8 +164,21 @@ def generate_monte_carlo_samples(df_chunk, n_samples, correlation_pmra_pmdec):
         Subset of the dataframe containing stellar data.
     n_samples : int
         Number of samples to draw for each star.
-    correlation_pmra_pmdec : float
-        Correlation coefficient between **pmra** and **pmdec**.
+    correlation_pmra_pmdec : float, array-like or None
+        Correlation coefficient between **pmra** and **pmdec**. A scalar is
+        applied to every star, an array gives one value per star and ``None``
+        uses the Gaia ``pmra_pmdec_corr`` column of ``df_chunk``.
+    rng : numpy.random.Generator, optional
+        Random number source; defaults to the global ``np.random`` state.
+    sampler : {"random", "sobol", "lhs"}, optional
+        Pseudo-random (default) or quasi-random normals over the six inputs
+        (see `standard_normal_block`). The pm correlation is applied on top.
+    dtype : numpy dtype, optional
+        Precision of the sample arrays (default: float64). ``np.float32`` halves
+        their memory: the normals are drawn directly in float32 (see
+        `standard_normal_block`), so no float64 sample array is allocated.
+        Pseudo-random float32 draws differ from the float64 ones for the same
+        seed; quasi-random points are the same in both precisions.
 
     Returns
     -------
@@ -33,33 +188,47 @@ def generate_monte_carlo_samples(df_chunk, n_samples, correlation_pmra_pmdec):
     """
     num_stars = len(df_chunk)
 
-    ra, dec, distance = df_chunk['ra'].values, df_chunk['dec'].values, df_chunk['rpgeo'].values
-    pmra, pmdec = df_chunk['pmra'].values, df_chunk['pmdec'].values
-    vlos = df_chunk['radial_velocity'].values
-
-    pmra_err = df_chunk['pmra_error'].values
-    pmdec_err = df_chunk['pmdec_error'].values
-    dist_err = df_chunk['rpgeo_error'].values
-    vlos_err = df_chunk['radial_velocity_error'].values
-    parallax_err = df_chunk['parallax_error'].values
-
-    ra_samples = np.random.normal(ra[:, None], parallax_err[:, None], (num_stars, n_samples))
-    dec_samples = np.random.normal(dec[:, None], parallax_err[:, None], (num_stars, n_samples))
-    distance_samples = np.random.normal(distance[:, None], dist_err[:, None], (num_stars, n_samples))
-    vlos_samples = np.random.normal(vlos[:, None], vlos_err[:, None], (num_stars, n_samples))
-
-    pmra_samples = np.zeros((num_stars, n_samples))
-    pmdec_samples = np.zeros((num_stars, n_samples))
+    ra, dec, distance, pmra, pmdec, vlos = (
+        df_chunk[col].values.astype(dtype, copy=False)
+        for col in ['ra', 'dec', 'rpgeo', 'pmra', 'pmdec', 'radial_velocity']
+    )
+    pmra_err, pmdec_err, dist_err, vlos_err, parallax_err = (
+        df_chunk[col].values.astype(dtype, copy=False)
+        for col in ['pmra_error', 'pmdec_error', 'rpgeo_error', 'radial_velocity_error', 'parallax_error']
+    )
 
-    for i in tqdm(range(num_stars), desc="Generating Monte Carlo Samples"):
-        cov = correlation_pmra_pmdec * pmra_err[i] * pmdec_err[i]
-        cov_matrix = np.array([[pmra_err[i]**2, cov], [cov, pmdec_err[i]**2]])
-        samples = np.random.multivariate_normal([pmra[i], pmdec[i]], cov_matrix, n_samples)
-        pmra_samples[i, :], pmdec_samples[i, :] = samples[:, 0], samples[:, 1]
+    rho = _pm_correlation(df_chunk, correlation_pmra_pmdec)
+
+    if sampler == "random":
+        rng = np.random if rng is None else rng
+        if np.dtype(dtype) != np.float64 and not isinstance(rng, np.random.Generator):
+            rng = np.random.default_rng(rng.randint(2**31))
+        samples = []
+        for loc, scale in [(ra, parallax_err), (dec, parallax_err), (distance, dist_err), (vlos, vlos_err)]:
+            # loc + scale * z in place, the same arithmetic as rng.normal
+            z = _standard_normal(rng, (num_stars, n_samples), dtype)
+            z *= scale[:, None]
+            z += loc[:, None]
+            samples.append(z)
+        ra_samples, dec_samples, distance_samples, vlos_samples = samples
+
+        pmra_samples, pmdec_samples = sample_correlated_proper_motions(
+            pmra, pmdec, pmra_err, pmdec_err, rho, n_samples, rng=rng
+        )
+    else:
+        z = standard_normal_block(num_stars, n_samples, 6, sampler=sampler, rng=rng, dtype=dtype)
+        ra_samples = ra[:, None] + parallax_err[:, None] * z[0]
+        dec_samples = dec[:, None] + parallax_err[:, None] * z[1]
+        distance_samples = distance[:, None] + dist_err[:, None] * z[2]
+        vlos_samples = vlos[:, None] + vlos_err[:, None] * z[3]
+
+        pmra_samples, pmdec_samples = sample_correlated_proper_motions(
+            pmra, pmdec, pmra_err, pmdec_err, rho, n_samples, z=z[4:]
+        )
 
-    dec_samples = np.clip(dec_samples, -90, 90)
-    ra_samples = np.mod(ra_samples, 360)
-    distance_samples = np.clip(distance_samples, 1e-5, None)
+    np.clip(dec_samples, -90, 90, out=dec_samples)
+    np.mod(ra_samples, 360, out=ra_samples)
+    np.clip(distance_samples, 1e-5, None, out=distance_samples)
 
     return ra_samples, dec_samples, distance_samples, pmra_samples, pmdec_samples, vlos_samples
 
@@ -126,13 +295,36 @@ def compute_velocity_components_with_uncertainty(ra, dec, distance, pmra, pmdec,
 
 
 def compute_velocity_components_for_samples(ra_samples, dec_samples, distance_samples,
-                                            pmra_samples, pmdec_samples, vlos_samples, gc_frame):
+                                            pmra_samples, pmdec_samples, vlos_samples, gc_frame,
+                                            method="numpy"):
     """
     Compute (v_R, v_phi, v_Z) for all Monte Carlo samples.
 
-    Returns:
-    - v_R_samples, v_phi_samples, v_Z_samples: np.ndarray
+    Parameters
+    ----------
+    ra_samples, dec_samples, distance_samples, pmra_samples, pmdec_samples, vlos_samples : ndarray
+        Sample arrays of shape ``(num_stars, n_samples)`` in deg, pc, mas/yr and km/s.
+    gc_frame : Galactocentric
+        Target Galactocentric frame.
+    method : {"numpy", "astropy"}, optional
+        ``"numpy"`` (default) transforms the whole block in one closed-form pass
+        with `icrs_to_galactocentric_cylindrical`. ``"astropy"`` loops over
+        samples through `compute_velocity_components_with_uncertainty` and is
+        kept as the reference implementation for validation.
+
+    Returns
+    -------
+    v_R_samples, v_phi_samples, v_Z_samples : ndarray
+        Velocity samples in km/s, shape ``(num_stars, n_samples)``.
     """
+    if method == "numpy":
+        return icrs_to_galactocentric_cylindrical(
+            ra_samples, dec_samples, distance_samples,
+            pmra_samples, pmdec_samples, vlos_samples, gc_frame
+        )
+    if method != "astropy":
+        raise ValueError(f"Unknown method '{method}', expected 'numpy' or 'astropy'")
+
     num_stars, n_samples = ra_samples.shape
 
     v_R_samples = np.zeros((num_stars, n_samples))
@@ -151,33 +343,622 @@ def compute_velocity_components_for_samples(ra_samples, dec_samples, distance_sa
     return v_R_samples, v_phi_samples, v_Z_samples
 
 
-def process_data_monte_carlo(df, gc_frame, chunk_size=100000, n_samples=100, correlation_pmra_pmdec=0.0):
+def monte_carlo_velocity_moments(df_chunk, gc_frame, n_samples, correlation_pmra_pmdec=0.0,
+                                 method="numpy", block_size=None, rng=None, sampler="random", dtype=np.float64):
+    """
+    Monte Carlo velocity standard deviations and covariances for one chunk of stars.
+
+    Parameters
+    ----------
+    df_chunk : pandas.DataFrame
+        Stellar data (see `generate_monte_carlo_samples`).
+    gc_frame : Galactocentric
+        Target Galactocentric frame.
+    n_samples : int
+        Number of samples per star.
+    correlation_pmra_pmdec : float, array-like or None, optional
+        As in `generate_monte_carlo_samples`.
+    method : str, optional
+        Velocity transform (see `compute_velocity_components_for_samples`).
+    block_size : int, optional
+        If given, draw the samples in blocks of at most ``block_size`` per star
+        and fold them into a `RunningVelocityMoments` accumulator, so peak memory
+        scales with ``block_size`` rather than ``n_samples``.
+    rng : numpy.random.Generator, optional
+        Random number source; defaults to the global ``np.random`` state.
+    sampler : {"random", "sobol", "lhs"}, optional
+        Sampling scheme (see `standard_normal_block`).
+    dtype : numpy dtype, optional
+        Precision of the sample arrays; moments are always accumulated in float64.
+
+    Returns
+    -------
+    std : ndarray
+        (N, 3) standard deviations of (v_R, v_phi, v_Z).
+    packed_cov : ndarray
+        (N, 6) covariance in the layout of `VELOCITY_COVARIANCE_COLUMNS`.
+    """
+    if block_size is None:
+        samples = generate_monte_carlo_samples(
+            df_chunk, n_samples, correlation_pmra_pmdec, rng=rng, sampler=sampler, dtype=dtype
+        )
+        v_R_samp, v_phi_samp, v_Z_samp = compute_velocity_components_for_samples(
+            *samples, gc_frame, method=method
+        )
+        std = np.stack([np.std(v, axis=1, dtype=np.float64) for v in (v_R_samp, v_phi_samp, v_Z_samp)], axis=1)
+        packed_cov = pack_covariance(sample_velocity_covariance(v_R_samp, v_phi_samp, v_Z_samp))
+        return std, packed_cov
+
+    moments = RunningVelocityMoments(len(df_chunk))
+    for start in range(0, n_samples, block_size):
+        samples = generate_monte_carlo_samples(
+            df_chunk, min(block_size, n_samples - start), correlation_pmra_pmdec, rng=rng, sampler=sampler,
+            dtype=dtype
+        )
+        moments.update(*compute_velocity_components_for_samples(*samples, gc_frame, method=method))
+    return moments.std, moments.packed_covariance
+
+
+def adaptive_monte_carlo_velocity_moments(df_chunk, gc_frame, rtol=0.05, atol=0.0, min_samples=30, batch_size=20,
+                                          max_samples=1000, correlation_pmra_pmdec=0.0, method="numpy", rng=None,
+                                          sampler="random", dtype=np.float64):
+    """
+    Monte Carlo velocity moments with per-star adaptive sample counts.
+
+    Every star first gets ``min_samples`` draws. Sampling then continues in
+    rounds of ``batch_size`` draws, but only for stars whose uncertainty
+    estimates have not converged. A star has converged when the estimated
+    standard error of each of its three standard deviations is below
+    ``max(rtol * sigma, atol)``. The relative error is
+    ``sqrt((kurtosis - 1) / n) / 2``, from the sample kurtosis, so heavy-tailed
+    (e.g. distant, distance-dominated) stars draw more samples than
+    near-Gaussian ones. ``atol`` (km/s) stops early for stars whose
+    uncertainties are small in absolute terms; most of the savings over a fixed
+    ``n_samples`` come from these stars. No star exceeds ``max_samples``.
+
+    Parameters
+    ----------
+    df_chunk : pandas.DataFrame
+        Stellar data (see `generate_monte_carlo_samples`).
+    gc_frame : Galactocentric
+        Target Galactocentric frame.
+    rtol : float, optional
+        Target relative standard error of each standard deviation (default: 0.05).
+    atol : float, optional
+        Standard error in km/s that is always accepted (default: 0).
+    min_samples, batch_size, max_samples : int, optional
+        Initial draws, draws per later round and per-star cap.
+    correlation_pmra_pmdec : float, array-like or None, optional
+        As in `generate_monte_carlo_samples`.
+    method : str, optional
+        Velocity transform (see `compute_velocity_components_for_samples`).
+    rng : numpy.random.Generator, optional
+        Random number source; defaults to the global ``np.random`` state.
+    sampler : {"random", "sobol", "lhs"}, optional
+        Sampling scheme for each round (see `standard_normal_block`).
+    dtype : numpy dtype, optional
+        Precision of the sample arrays; moments are always accumulated in float64.
+
+    Returns
+    -------
+    std : ndarray
+        (N, 3) standard deviations of (v_R, v_phi, v_Z).
+    packed_cov : ndarray
+        (N, 6) covariance in the layout of `VELOCITY_COVARIANCE_COLUMNS`.
+    n_used : ndarray
+        (N,) number of samples drawn for each star.
+    """
+    num_stars = len(df_chunk)
+    rho = _pm_correlation(df_chunk, correlation_pmra_pmdec)
+    df_chunk = df_chunk.assign(pmra_pmdec_corr=rho)
+
+    moments = RunningVelocityMoments(num_stars)
+    shift = None
+    power_sums = np.zeros((4, num_stars, 3))  # sums of (v - shift)**k for k = 1..4
+
+    active = np.arange(num_stars)
+    n_draw = min(min_samples, max_samples)
+    while active.size and n_draw > 0:
+        samples = generate_monte_carlo_samples(df_chunk.iloc[active], n_draw, None, rng=rng, sampler=sampler,
+                                               dtype=dtype)
+        v = compute_velocity_components_for_samples(*samples, gc_frame, method=method)
+        moments.update(*v, rows=active)
+
+        v = np.stack(v, axis=1).astype(np.float64, copy=False)
+        if shift is None:
+            shift = v.mean(axis=2)
+        y = v - shift[active][:, :, None]
+        for k in range(4):
+            power_sums[k, active] += np.sum(y**(k + 1), axis=2)
+
+        n = moments.count[active][:, None]
+        r1, r2, r3, r4 = (power_sums[k, active] / n for k in range(4))
+        var = r2 - r1**2
+        m4 = r4 - 4 * r1 * r3 + 6 * r1**2 * r2 - 3 * r1**4
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rel_err = np.sqrt(np.maximum(m4 / var**2 - 1.0, 0.0) / n) / 2
+            # NaN (invalid or degenerate stars) compares False and counts as converged
+            unconverged = np.any(rel_err >= np.maximum(rtol, atol / np.sqrt(var)), axis=1)
+        active = active[unconverged & (moments.count[active] < max_samples)]
+        if active.size:
+            n_draw = min(batch_size, max_samples - moments.count[active].min())
+
+    return moments.std, moments.packed_covariance, moments.count.copy()
+
+
+# Peak number of (stars x samples-in-flight) arrays alive at once in the NumPy
+# path: the six input cubes, the three velocity cubes and the transform and
+# moment temporaries (measured with tracemalloc). The count holds for float32 as
+# well, since its normals are drawn directly in single precision.
+MONTE_CARLO_LIVE_ARRAYS = 36
+# Per-star bytes independent of the sample count (DataFrame row, outputs, accumulators)
+MONTE_CARLO_BYTES_PER_STAR = 512
+
+_BYTE_UNITS = {'B': 1, 'KB': 1e3, 'MB': 1e6, 'GB': 1e9, 'KIB': 2**10, 'MIB': 2**20, 'GIB': 2**30}
+
+
+def _parse_bytes(memory_budget):
+    """Convert an int or a string such as ``'2GB'`` or ``'512MiB'`` to bytes."""
+    if isinstance(memory_budget, str):
+        text = memory_budget.strip().upper().replace(' ', '')
+        for unit in sorted(_BYTE_UNITS, key=len, reverse=True):
+            if text.endswith(unit):
+                return int(float(text[:-len(unit)]) * _BYTE_UNITS[unit])
+        return int(float(text))
+    return int(memory_budget)
+
+
+def estimate_chunk_size(memory_budget, n_samples, block_size=None, dtype=np.float64,
+                        live_arrays=MONTE_CARLO_LIVE_ARRAYS):
+    """
+    Largest chunk size whose Monte Carlo working set fits in a memory budget.
+
+    Parameters
+    ----------
+    memory_budget : int or str
+        Budget in bytes, or a string with units (``'2GB'``, ``'512MiB'``).
+    n_samples : int
+        Samples per star.
+    block_size : int, optional
+        Samples held at once when streaming (see `monte_carlo_velocity_moments`).
+    dtype : numpy dtype, optional
+        Precision of the sample arrays.
+    live_arrays : float, optional
+        Number of (stars x samples) arrays alive at the peak.
+
+    Returns
+    -------
+    int
+        Chunk size (at least 1).
+    """
+    samples_in_flight = min(n_samples, block_size) if block_size else n_samples
+    bytes_per_star = live_arrays * samples_in_flight * np.dtype(dtype).itemsize + MONTE_CARLO_BYTES_PER_STAR
+    return max(1, int(_parse_bytes(memory_budget) // bytes_per_star))
+
+
+def _process_chunk_monte_carlo(df_chunk, gc_frame, n_samples, correlation_pmra_pmdec, method, block_size, seed_seq,
+                               adaptive=None, sampler="random", dtype=np.float64):
+    """
+    Worker for `process_data_monte_carlo`: add uncertainty columns to one chunk.
+
+    Returns the chunk and its wall time in seconds. ``seed_seq`` (a
+    `numpy.random.SeedSequence`) gives the chunk its own Generator; ``None``
+    falls back to the global ``np.random`` state. ``adaptive`` holds keyword
+    arguments for `adaptive_monte_carlo_velocity_moments`, with ``n_samples``
+    as the per-star cap, and adds an ``n_mc_samples`` column.
+    """
+    start = time.perf_counter()
+    rng = None if seed_seq is None else np.random.default_rng(seed_seq)
+
+    if adaptive is None:
+        std, packed_cov = monte_carlo_velocity_moments(
+            df_chunk, gc_frame, n_samples, correlation_pmra_pmdec, method=method, block_size=block_size, rng=rng,
+            sampler=sampler, dtype=dtype
+        )
+    else:
+        std, packed_cov, n_used = adaptive_monte_carlo_velocity_moments(
+            df_chunk, gc_frame, max_samples=n_samples, correlation_pmra_pmdec=correlation_pmra_pmdec,
+            method=method, rng=rng, sampler=sampler, dtype=dtype, **adaptive
+        )
+        df_chunk['n_mc_samples'] = n_used
+
+    df_chunk['v_R_uncertainty'] = std[:, 0]
+    df_chunk['v_phi_uncertainty'] = std[:, 1]
+    df_chunk['v_Z_uncertainty'] = std[:, 2]
+    df_chunk[VELOCITY_COVARIANCE_COLUMNS] = packed_cov
+    return df_chunk, time.perf_counter() - start
+
+
+def process_data_monte_carlo(df, gc_frame, chunk_size=100000, n_samples=100, correlation_pmra_pmdec=0.0,
+                             method="numpy", block_size=None, n_workers=1, seed=None, adaptive_rtol=None,
+                             adaptive_atol=0.0, sampler="random", memory_budget=None, dtype=np.float64):
     """
     Process dataset in chunks, compute Monte Carlo velocity uncertainties.
 
+    ``correlation_pmra_pmdec`` may be a scalar, a per-star array or ``None`` to
+    use the Gaia ``pmra_pmdec_corr`` column (see `generate_monte_carlo_samples`).
+    ``method`` selects the velocity transform (see
+    `compute_velocity_components_for_samples`). Setting ``block_size`` streams
+    the samples through running moment accumulators instead of materialising
+    the full (chunk_size x n_samples) cubes (see `monte_carlo_velocity_moments`).
+
+    If ``seed`` is given or ``n_workers > 1``, every chunk draws from its own
+    Generator spawned from ``np.random.SeedSequence(seed)``, so a seeded run is
+    bit-identical for any ``n_workers``. With ``n_workers > 1`` the chunks are
+    processed in a process pool and reassembled in their original order.
+
+    Setting ``adaptive_rtol`` switches to adaptive per-star sample counts (see
+    `adaptive_monte_carlo_velocity_moments`, with ``adaptive_atol`` as ``atol``).
+    Then ``n_samples`` is the per-star cap, ``block_size`` (default 20) the
+    draws per round, and the number of samples per star goes into an
+    ``n_mc_samples`` column.
+
+    ``sampler`` selects pseudo-random or quasi-random (``"sobol"``, ``"lhs"``)
+    draws (see `standard_normal_block`).
+
+    ``memory_budget`` (bytes or e.g. ``'4GB'``, shared by all workers) overrides
+    ``chunk_size`` with the largest chunk that fits (see `estimate_chunk_size`).
+    ``dtype=np.float32`` stores the sample cubes in single precision, halving
+    their footprint; moments are still accumulated in float64 (see
+    `compare_float32_accuracy`).
+
     Returns:
     - pd.DataFrame: With added v_R_uncertainty, v_phi_uncertainty, v_Z_uncertainty
+      and the six unique velocity covariance terms (`VELOCITY_COVARIANCE_COLUMNS`)
     """
+    adaptive = None
+    if adaptive_rtol is not None:
+        adaptive = {'rtol': adaptive_rtol, 'atol': adaptive_atol, 'batch_size': block_size or 20}
+
+    if memory_budget is not None:
+        samples_in_flight = max(30, block_size or 20) if adaptive is not None else n_samples
+        chunk_size = estimate_chunk_size(_parse_bytes(memory_budget) / max(n_workers, 1), samples_in_flight,
+                                         block_size=None if adaptive is not None else block_size, dtype=dtype)
+        print(f"Using chunk_size={chunk_size} for a memory budget of {memory_budget}")
+
     num_chunks = len(df) // chunk_size + 1
-    df_combined = []
 
-    for chunk_num in range(num_chunks):
+    if seed is not None or n_workers > 1:
+        seed_seqs = np.random.SeedSequence(seed).spawn(num_chunks)
+    else:
+        seed_seqs = [None] * num_chunks
+
+    def chunk_args(chunk_num):
         start_idx, end_idx = chunk_num * chunk_size, min((chunk_num + 1) * chunk_size, len(df))
         df_chunk = df.iloc[start_idx:end_idx].reset_index(drop=True)
+        rho_chunk = correlation_pmra_pmdec
+        if rho_chunk is not None and np.ndim(rho_chunk) > 0:
+            rho_chunk = np.asarray(rho_chunk)[start_idx:end_idx]
+        return df_chunk, gc_frame, n_samples, rho_chunk, method, block_size, seed_seqs[chunk_num], adaptive, sampler, dtype
+
+    def report(chunk_num, df_chunk, elapsed, n_done):
+        rate = len(df_chunk) / elapsed if elapsed > 0 else float('inf')
+        print(f"Processed chunk {chunk_num + 1}/{num_chunks} ({n_done}/{num_chunks} done): "
+              f"{len(df_chunk)} stars in {elapsed:.2f} s ({rate:.0f} stars/s)")
+
+    df_combined = [None] * num_chunks
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(_process_chunk_monte_carlo, *chunk_args(i)): i for i in range(num_chunks)}
+            for n_done, future in enumerate(as_completed(futures), start=1):
+                chunk_num = futures[future]
+                df_chunk, elapsed = future.result()
+                df_combined[chunk_num] = df_chunk
+                report(chunk_num, df_chunk, elapsed, n_done)
+    else:
+        for chunk_num in range(num_chunks):
+            df_chunk, elapsed = _process_chunk_monte_carlo(*chunk_args(chunk_num))
+            df_combined[chunk_num] = df_chunk
+            report(chunk_num, df_chunk, elapsed, chunk_num + 1)
+
+    df_out = pd.concat(df_combined, ignore_index=True)
+    if adaptive is not None and len(df_out):
+        total = int(df_out['n_mc_samples'].sum())
+        print(f"Adaptive sampling: {total} transforms, {total / (len(df_out) * n_samples):.1%} "
+              f"of a fixed n_samples={n_samples} run")
+    return df_out
+
+
+def process_catalogue_monte_carlo(input_path, output_dir, gc_frame, chunk_size=100000, n_samples=100,
+                                  correlation_pmra_pmdec=0.0, method="numpy", block_size=None, seed=0,
+                                  extra_columns=(), hdu=1, sampler="random", memory_budget=None, dtype=np.float64):
+    """
+    Stream a FITS or Parquet catalogue through the Monte Carlo stage with checkpointing.
+
+    Only the columns needed for sampling (plus ``extra_columns``, e.g.
+    ``source_id``) are read, one chunk of rows at a time (see `CatalogueReader`).
+    Every finished chunk is written to a `ChunkStore` in ``output_dir``;
+    rerunning the same call after an interruption skips the chunks already on
+    disk, and rerunning it with settings that change the draws (``seed``,
+    ``block_size``, ``sampler``, ...) raises ``ValueError``. Each chunk draws
+    from the Generator ``SeedSequence(seed)`` spawns for its index, so resumed
+    and in-memory runs (`process_data_monte_carlo` with the same
+    ``chunk_size`` and ``seed``) give identical results.
 
-        ra_samp, dec_samp, dist_samp, pmra_samp, pmdec_samp, vlos_samp = generate_monte_carlo_samples(
-            df_chunk, n_samples, correlation_pmra_pmdec
-        )
+    Parameters
+    ----------
+    input_path : str
+        Catalogue file (``.fits`` or ``.parquet``).
+    output_dir : str
+        Directory of the output chunk store.
+    gc_frame : Galactocentric
+        Target Galactocentric frame.
+    chunk_size, n_samples, method, block_size, sampler, memory_budget, dtype : optional
+        As in `process_data_monte_carlo`.
+    correlation_pmra_pmdec : float or None, optional
+        Scalar correlation, or ``None`` to read the ``pmra_pmdec_corr`` column.
+    seed : int, optional
+        Root seed of the per-chunk random streams (default: 0).
+    extra_columns : sequence of str, optional
+        Additional catalogue columns to carry into the output.
+    hdu : int, optional
+        FITS extension holding the table (default: 1).
 
-        v_R_samp, v_phi_samp, v_Z_samp = compute_velocity_components_for_samples(
-            ra_samp, dec_samp, dist_samp, pmra_samp, pmdec_samp, vlos_samp, gc_frame
+    Returns
+    -------
+    str
+        ``output_dir``; load the result with `catalogue_io.load_chunk_store`.
+    """
+    columns = MONTE_CARLO_INPUT_COLUMNS + list(extra_columns)
+    if correlation_pmra_pmdec is None:
+        columns.append('pmra_pmdec_corr')
+    reader = CatalogueReader(input_path, columns, hdu=hdu)
+    if memory_budget is not None:
+        chunk_size = estimate_chunk_size(memory_budget, n_samples, block_size=block_size, dtype=dtype)
+    num_chunks = -(-reader.num_rows // chunk_size)
+
+    # everything that changes the draws or their order, so a resumed run cannot mix streams
+    store = ChunkStore(output_dir, {
+        'input': os.path.abspath(input_path), 'num_rows': int(reader.num_rows), 'chunk_size': chunk_size,
+        'n_samples': n_samples, 'correlation_pmra_pmdec': correlation_pmra_pmdec, 'method': method,
+        'block_size': block_size, 'seed': seed, 'columns': columns, 'sampler': sampler,
+        'dtype': np.dtype(dtype).name,
+    })
+    seed_seqs = np.random.SeedSequence(seed).spawn(num_chunks)
+
+    for chunk_num in range(num_chunks):
+        if chunk_num in store.completed:
+            continue
+        df_chunk = reader.read_rows(chunk_num * chunk_size, (chunk_num + 1) * chunk_size)
+        df_chunk, elapsed = _process_chunk_monte_carlo(
+            df_chunk, gc_frame, n_samples, correlation_pmra_pmdec, method, block_size, seed_seqs[chunk_num],
+            sampler=sampler, dtype=dtype
         )
+        store.write(chunk_num, df_chunk)
+        print(f"Processed chunk {chunk_num + 1}/{num_chunks}: {len(df_chunk)} stars in {elapsed:.2f} s")
+
+    return output_dir
+
+
+def sample_velocity_covariance(v_R_samples, v_phi_samples, v_Z_samples):
+    """
+    Per-star 3x3 covariance of Monte Carlo velocity samples.
+
+    Uses the same normalisation as ``np.std`` (``ddof=0``), so the square roots
+    of the diagonal equal the ``v_*_uncertainty`` columns.
+
+    Returns
+    -------
+    ndarray
+        Array of shape ``(num_stars, 3, 3)``.
+    """
+    v = np.stack([v_R_samples, v_phi_samples, v_Z_samples], axis=1)
+    dv = v - v.mean(axis=2, keepdims=True, dtype=np.float64)
+    return np.einsum('nis,njs->nij', dv, dv) / v.shape[2]
+
+
+def linearized_velocity_covariance(df, gc_frame, correlation_pmra_pmdec=0.0):
+    """
+    Propagate astrometric uncertainties to (v_R, v_phi, v_Z) to first order.
+
+    The input covariance over (distance, pmra, pmdec, vlos) is block diagonal
+    apart from the pmra/pmdec correlation, and is mapped through the analytic
+    Jacobian of the Galactocentric cylindrical transform, ``C_v = J C J^T``.
+    Positional (ra, dec) errors are neglected.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Stellar data with the same columns as `generate_monte_carlo_samples`.
+    gc_frame : Galactocentric
+        Target Galactocentric frame.
+    correlation_pmra_pmdec : float, array-like or None, optional
+        As in `generate_monte_carlo_samples`.
+
+    Returns
+    -------
+    ndarray
+        Velocity covariance of shape ``(len(df), 3, 3)`` in (km/s)^2.
+    """
+    _, jacobian = galactocentric_cylindrical_jacobian(
+        df['ra'].values, df['dec'].values, df['rpgeo'].values,
+        df['pmra'].values, df['pmdec'].values, df['radial_velocity'].values, gc_frame
+    )
+
+    pmra_err, pmdec_err = df['pmra_error'].values, df['pmdec_error'].values
+    rho = _pm_correlation(df, correlation_pmra_pmdec)
+
+    input_cov = np.zeros((len(df), 4, 4))
+    input_cov[:, 0, 0] = df['rpgeo_error'].values**2
+    input_cov[:, 1, 1] = pmra_err**2
+    input_cov[:, 2, 2] = pmdec_err**2
+    input_cov[:, 1, 2] = input_cov[:, 2, 1] = rho * pmra_err * pmdec_err
+    input_cov[:, 3, 3] = df['radial_velocity_error'].values**2
 
-        df_chunk['v_R_uncertainty'] = np.std(v_R_samp, axis=1)
-        df_chunk['v_phi_uncertainty'] = np.std(v_phi_samp, axis=1)
-        df_chunk['v_Z_uncertainty'] = np.std(v_Z_samp, axis=1)
+    return np.einsum('nij,njk,nlk->nil', jacobian, input_cov, jacobian)
+
+
+def process_data_linearized(df, gc_frame, max_fractional_distance_error=0.1, correlation_pmra_pmdec=0.0,
+                            chunk_size=100000, n_samples=100, method="numpy", seed=None):
+    """
+    Velocity uncertainties from linearized error propagation with a Monte Carlo fallback.
+
+    Stars whose fractional distance error ``rpgeo_error / rpgeo`` exceeds
+    ``max_fractional_distance_error`` (or is not finite) are flagged in the
+    ``linearization_unsafe`` column; only those rows are re-run through the
+    Monte Carlo sampler (see `process_data_monte_carlo`).
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Stellar data with the same columns as `generate_monte_carlo_samples`.
+    gc_frame : Galactocentric
+        Target Galactocentric frame.
+    max_fractional_distance_error : float, optional
+        Threshold above which linearization is considered unsafe (default: 0.1).
+    correlation_pmra_pmdec : float, array-like or None, optional
+        As in `generate_monte_carlo_samples`.
+    chunk_size, n_samples, method : optional
+        Passed to the Monte Carlo fallback.
+    seed : int or numpy.random.SeedSequence, optional
+        Root seed of the fallback. As in `process_data_monte_carlo`, every
+        chunk of unsafe stars draws from its own Generator spawned from
+        ``np.random.SeedSequence(seed)``; without a seed the global
+        ``np.random`` state is used.
+
+    Returns
+    -------
+    df_out : pandas.DataFrame
+        Copy of ``df`` with v_R_uncertainty, v_phi_uncertainty, v_Z_uncertainty,
+        the packed covariance (`VELOCITY_COVARIANCE_COLUMNS`) and
+        linearization_unsafe columns.
+    velocity_cov : ndarray
+        Full velocity covariance of shape ``(len(df), 3, 3)``.
+    """
+    df_out = df.reset_index(drop=True)
+    velocity_cov = linearized_velocity_covariance(df_out, gc_frame, correlation_pmra_pmdec)
+
+    fractional_error = df_out['rpgeo_error'].values / df_out['rpgeo'].values
+    unsafe = ~(np.abs(fractional_error) <= max_fractional_distance_error)
+    df_out['linearization_unsafe'] = unsafe
+
+    if np.any(unsafe):
+        rho = correlation_pmra_pmdec
+        if rho is not None and np.ndim(rho) > 0:
+            rho = np.asarray(rho)[unsafe]
+        df_unsafe = df_out[unsafe].reset_index(drop=True)
+        starts = range(0, len(df_unsafe), chunk_size)
+        if seed is not None:
+            rngs = [np.random.default_rng(seed_seq) for seed_seq in np.random.SeedSequence(seed).spawn(len(starts))]
+        else:
+            rngs = [None] * len(starts)
+        for start, rng in zip(starts, rngs):
+            df_chunk = df_unsafe.iloc[start:start + chunk_size].reset_index(drop=True)
+            rho_chunk = rho[start:start + chunk_size] if rho is not None and np.ndim(rho) > 0 else rho
+            samples = generate_monte_carlo_samples(df_chunk, n_samples, rho_chunk, rng=rng)
+            v_samples = compute_velocity_components_for_samples(*samples, gc_frame, method=method)
+            rows = np.flatnonzero(unsafe)[start:start + chunk_size]
+            velocity_cov[rows] = sample_velocity_covariance(*v_samples)
+
+    variances = np.diagonal(velocity_cov, axis1=1, axis2=2)
+    df_out['v_R_uncertainty'] = np.sqrt(variances[:, 0])
+    df_out['v_phi_uncertainty'] = np.sqrt(variances[:, 1])
+    df_out['v_Z_uncertainty'] = np.sqrt(variances[:, 2])
+    df_out[VELOCITY_COVARIANCE_COLUMNS] = pack_covariance(velocity_cov)
+
+    return df_out, velocity_cov
+
+
+def benchmark_sampler_convergence(df, gc_frame, sample_counts=(16, 32, 64, 128, 256), samplers=("random", "sobol"),
+                                  n_repeats=20, reference_samples=20000, correlation_pmra_pmdec=0.0, seed=0):
+    """
+    Compare velocity-uncertainty error against sample count for several samplers.
 
-        df_combined.append(df_chunk)
-        print(f"Processed chunk {chunk_num + 1}/{num_chunks}")
+    A high-sample pseudo-random run provides the reference standard deviations.
+    Each sampler is then run ``n_repeats`` times per sample count with
+    independent seeds, and the RMS relative error of the (v_R, v_phi, v_Z)
+    standard deviations is recorded over all stars and repeats.
 
-    return pd.concat(df_combined, ignore_index=True)
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Stellar data (see `generate_monte_carlo_samples`); keep it small.
+    gc_frame : Galactocentric
+        Target Galactocentric frame.
+    sample_counts : sequence of int, optional
+        Samples per star to test (powers of two suit Sobol).
+    samplers : sequence of str, optional
+        Sampling schemes to compare (see `standard_normal_block`).
+    n_repeats : int, optional
+        Independent repetitions per configuration (default: 20).
+    reference_samples : int, optional
+        Samples per star for the reference run (default: 20000).
+    correlation_pmra_pmdec : float, array-like or None, optional
+        As in `generate_monte_carlo_samples`.
+    seed : int, optional
+        Root seed (default: 0).
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per (sampler, n_samples) with columns ``rms_relative_error``
+        and ``seconds`` (mean wall time per run).
+    """
+    seeds = np.random.SeedSequence(seed).spawn(1 + len(samplers) * len(sample_counts) * n_repeats)
+    reference, _ = monte_carlo_velocity_moments(
+        df, gc_frame, reference_samples, correlation_pmra_pmdec, block_size=1000, rng=np.random.default_rng(seeds[0])
+    )
+
+    rows = []
+    seed_iter = iter(seeds[1:])
+    for sampler in samplers:
+        for n_samples in sample_counts:
+            errors, start = [], time.perf_counter()
+            for _ in range(n_repeats):
+                std, _ = monte_carlo_velocity_moments(
+                    df, gc_frame, n_samples, correlation_pmra_pmdec,
+                    rng=np.random.default_rng(next(seed_iter)), sampler=sampler
+                )
+                errors.append(std / reference - 1)
+            rows.append({
+                'sampler': sampler,
+                'n_samples': n_samples,
+                'rms_relative_error': np.sqrt(np.nanmean(np.square(errors))),
+                'seconds': (time.perf_counter() - start) / n_repeats,
+            })
+    return pd.DataFrame(rows)
+
+
+def compare_float32_accuracy(df, gc_frame, n_samples=100, seed=0, sampler="lhs", **kwargs):
+    """
+    Check the float32 sample path against float64 on the same sample points.
+
+    Both runs use the same seed. The quasi-random samplers give the same
+    points in both precisions, so the runs differ only by arithmetic
+    precision; pseudo-random float32 normals are a different stream, and with
+    ``sampler="random"`` the differences include Monte-Carlo noise.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Representative subset of the catalogue.
+    gc_frame : Galactocentric
+        Target Galactocentric frame.
+    n_samples : int, optional
+        Samples per star (default: 100).
+    seed : int, optional
+        Seed shared by both runs (default: 0).
+    sampler : {"lhs", "sobol", "random"}, optional
+        Sampler of both runs (default: ``"lhs"``).
+    **kwargs
+        Further options for `monte_carlo_velocity_moments`.
+
+    Returns
+    -------
+    dict
+        Maximum absolute (km/s) and relative differences of the standard
+        deviations, and of the packed covariances in (km/s)^2.
+    """
+    results = {}
+    for dtype in (np.float64, np.float32):
+        results[dtype] = monte_carlo_velocity_moments(
+            df, gc_frame, n_samples, rng=np.random.default_rng(seed), sampler=sampler, dtype=dtype, **kwargs
+        )
+    std64, cov64 = results[np.float64]
+    std32, cov32 = results[np.float32]
+    return {
+        'max_abs_std_diff': float(np.nanmax(np.abs(std32 - std64))),
+        'max_rel_std_diff': float(np.nanmax(np.abs(std32 / std64 - 1))),
+        'max_abs_cov_diff': float(np.nanmax(np.abs(cov32 - cov64))),
+    }
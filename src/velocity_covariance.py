@@ -0,0 +1,172 @@
+"""
+velocity_covariance.py
+
+Helpers for the compact per-star velocity covariance layout shared by the Monte
+Carlo uncertainty stage and the Extreme Deconvolution fits.
+
+Each star's symmetric 3x3 covariance in (v_R, v_phi, v_Z) is stored as its six
+unique terms, ordered as in `VELOCITY_COVARIANCE_COLUMNS`:
+``(RR, phiphi, ZZ, Rphi, RZ, phiZ)``.
+"""
+
+import numpy as np
+
+VELOCITY_COVARIANCE_COLUMNS = [
+    'v_R_v_R_cov', 'v_phi_v_phi_cov', 'v_Z_v_Z_cov',
+    'v_R_v_phi_cov', 'v_R_v_Z_cov', 'v_phi_v_Z_cov',
+]
+UNCERTAINTY_COLUMNS = ['v_R_uncertainty', 'v_phi_uncertainty', 'v_Z_uncertainty']
+
+# (row, column) of each packed term in the 3x3 matrix
+_PACKED_ROWS = np.array([0, 1, 2, 0, 0, 1])
+_PACKED_COLS = np.array([0, 1, 2, 1, 2, 2])
+
+
+def pack_covariance(cov):
+    """
+    Compress a stack of symmetric 3x3 matrices to the (N, 6) layout.
+
+    Parameters
+    ----------
+    cov : ndarray
+        Array of shape ``(N, 3, 3)``.
+
+    Returns
+    -------
+    ndarray
+        Array of shape ``(N, 6)``.
+    """
+    return np.asarray(cov)[:, _PACKED_ROWS, _PACKED_COLS]
+
+
+def unpack_covariance(packed):
+    """
+    Expand the (N, 6) layout to a stack of symmetric 3x3 matrices.
+
+    Parameters
+    ----------
+    packed : ndarray
+        Array of shape ``(N, 6)``.
+
+    Returns
+    -------
+    ndarray
+        Array of shape ``(N, 3, 3)``.
+    """
+    packed = np.asarray(packed, dtype=float)
+    cov = np.empty((len(packed), 3, 3))
+    cov[:, _PACKED_ROWS, _PACKED_COLS] = packed
+    cov[:, _PACKED_COLS, _PACKED_ROWS] = packed
+    return cov
+
+
+def velocity_covariance_stack(df_bin, covariance=None):
+    """
+    Build the (N, 3, 3) noise covariance stack used by Extreme Deconvolution.
+
+    Parameters
+    ----------
+    df_bin : pd.DataFrame
+        DataFrame with either the `VELOCITY_COVARIANCE_COLUMNS` or the
+        `UNCERTAINTY_COLUMNS` (standard deviations).
+    covariance : ndarray, optional
+        Explicit covariances of shape ``(N, 6)`` or ``(N, 3, 3)``; takes
+        precedence over the DataFrame columns.
+
+    Returns
+    -------
+    ndarray
+        Array of shape ``(N, 3, 3)``. Without covariance columns or an explicit
+        ``covariance`` the matrices are diagonal.
+    """
+    if covariance is None and all(col in df_bin.columns for col in VELOCITY_COVARIANCE_COLUMNS):
+        covariance = df_bin[VELOCITY_COVARIANCE_COLUMNS].values
+
+    if covariance is not None:
+        covariance = np.asarray(covariance, dtype=float)
+        if covariance.ndim == 2 and covariance.shape[1] == 6:
+            return unpack_covariance(covariance)
+        if covariance.shape[1:] == (3, 3):
+            return covariance
+        raise ValueError(f"covariance must have shape (N, 6) or (N, 3, 3), got {covariance.shape}")
+
+    variances = df_bin[UNCERTAINTY_COLUMNS].values**2
+    cov = np.zeros((len(variances), 3, 3))
+    cov[:, [0, 1, 2], [0, 1, 2]] = variances
+    return cov
+
+
+class RunningVelocityMoments:
+    """
+    Streaming per-star mean and covariance of (v_R, v_phi, v_Z) samples.
+
+    Blocks of Monte Carlo samples are folded in with the pairwise
+    (Chan et al.) generalisation of Welford's update, so the full
+    (stars x samples) cubes never need to be held in memory. The results equal
+    ``np.mean``/``np.std`` (``ddof=0``) over the concatenated samples up to
+    floating-point round-off.
+
+    Parameters
+    ----------
+    num_stars : int
+        Number of stars being accumulated.
+    full_covariance : bool, optional
+        Track the cross terms as well as the variances (default: True).
+
+    Attributes
+    ----------
+    count : ndarray
+        Number of samples folded in for each star.
+    mean : ndarray
+        (num_stars, 3) running means.
+    """
+
+    def __init__(self, num_stars, full_covariance=True):
+        self.full_covariance = full_covariance
+        n_terms = 6 if full_covariance else 3
+        self.count = np.zeros(num_stars, dtype=int)
+        self.mean = np.zeros((num_stars, 3))
+        self._comoment = np.zeros((num_stars, n_terms))
+
+    def update(self, v_R, v_phi, v_Z, rows=None):
+        """
+        Fold in a block of samples, each of shape ``(num_stars, block_size)``.
+
+        If ``rows`` (integer indices or a boolean mask) is given, the block holds
+        samples for those stars only, in that order, and the other stars are
+        left untouched.
+        """
+        rows_sel = slice(None) if rows is None else rows
+        block = np.stack([v_R, v_phi, v_Z], axis=1).astype(float, copy=False)
+        n_b = block.shape[2]
+        if n_b == 0:
+            return
+        mean_b = block.mean(axis=2)
+        d_b = block - mean_b[:, :, None]
+
+        rows_t, cols_t = _PACKED_ROWS[:self._comoment.shape[1]], _PACKED_COLS[:self._comoment.shape[1]]
+        comoment_b = np.einsum('nts,nts->nt', d_b[:, rows_t], d_b[:, cols_t])
+
+        n_a = self.count[rows_sel]
+        n = n_a + n_b
+        delta = mean_b - self.mean[rows_sel]
+        self.mean[rows_sel] += delta * (n_b / n)[:, None]
+        self._comoment[rows_sel] += comoment_b + delta[:, rows_t] * delta[:, cols_t] * (n_a * n_b / n)[:, None]
+        self.count[rows_sel] = n
+
+    @property
+    def variance(self):
+        """Per-star variances, shape ``(num_stars, 3)``."""
+        return self._comoment[:, :3] / self.count[:, None]
+
+    @property
+    def std(self):
+        """Per-star standard deviations, shape ``(num_stars, 3)``."""
+        return np.sqrt(self.variance)
+
+    @property
+    def packed_covariance(self):
+        """Per-star covariance in the packed ``(num_stars, 6)`` layout."""
+        if not self.full_covariance:
+            raise ValueError("cross terms are not tracked; use full_covariance=True")
+        return self._comoment / self.count[:, None]
@@ -0,0 +1,395 @@
+"""
+xd_em.py
+
+Vectorized Extreme Deconvolution (XD; Bovy, Hogg & Roweis 2011) EM for the
+three-dimensional velocity fits.
+
+The algorithm, regularisation and convergence test follow ``pygmmis.fit``
+(without cutoffs, selection or background), so a fit started from the same
+initial `pygmmis.GMM` reaches the same model and log-likelihood. Instead of
+looping over components and inverting dense (N, 3, 3) stacks, every star and
+component is handled at once: the symmetric 3x3 matrices T_ik = V_i + S_k are
+kept as their six packed terms (see `velocity_covariance`) and inverted in
+closed form, and the E- and M-step sums are accumulated in a single pass over
+chunks of stars. Diagonal noise skips the off-diagonal noise terms entirely.
+"""
+
+import numpy as np
+import pygmmis
+from scipy.special import logsumexp
+
+from velocity_covariance import pack_covariance, unpack_covariance
+
+LOG_2PI = np.log(2 * np.pi)
+
+
+def packed_noise(noise):
+    """
+    Split per-star noise covariances into diagonal and off-diagonal terms.
+
+    Parameters
+    ----------
+    noise : ndarray
+        Either ``(N, 3)`` variances (diagonal noise), ``(N, 6)`` packed
+        covariances or a dense ``(N, 3, 3)`` stack.
+
+    Returns
+    -------
+    diag : ndarray
+        (N, 3) variances.
+    off : ndarray or None
+        (N, 3) covariances (Rphi, RZ, phiZ), or None if the noise is diagonal.
+    """
+    noise = np.asarray(noise, dtype=float)
+    if noise.ndim == 3 and noise.shape[1:] == (3, 3):
+        noise = pack_covariance(noise)
+    if noise.ndim != 2 or noise.shape[1] not in (3, 6):
+        raise ValueError(f"noise must have shape (N, 3), (N, 6) or (N, 3, 3), got {noise.shape}")
+
+    diag = np.ascontiguousarray(noise[:, :3])
+    off = None
+    if noise.shape[1] == 6 and np.any(noise[:, 3:]):
+        off = np.ascontiguousarray(noise[:, 3:])
+    return diag, off
+
+
+def _inverse_packed(T):
+    """Closed-form inverse and determinant of packed symmetric 3x3 matrices."""
+    a, b, c, d, e, f = T
+    c00 = b * c - f * f
+    c11 = a * c - e * e
+    c22 = a * b - d * d
+    c01 = e * f - d * c
+    c02 = d * f - b * e
+    c12 = d * e - a * f
+    det = a * c00 + d * c01 + e * c02
+    return (c00 / det, c11 / det, c22 / det, c01 / det, c02 / det, c12 / det), det
+
+
+def _chunk_terms(X, diag, off, amp, mean, S):
+    """
+    Per-star, per-component quantities for one chunk of stars.
+
+    Returns
+    -------
+    log_p : ndarray
+        (n, K) log(amp_k N(x_i | mu_k, S_k + V_i)).
+    T_inv : tuple of ndarray
+        Six packed terms of (S_k + V_i)^-1, each (n, K).
+    y : tuple of ndarray
+        Three components of (S_k + V_i)^-1 (x_i - mu_k), each (n, K).
+    """
+    diag_T = [diag[:, None, j] + S[None, :, j] for j in range(3)]
+    if off is None:
+        off_T = [S[None, :, j] for j in range(3, 6)]
+    else:
+        off_T = [off[:, None, j - 3] + S[None, :, j] for j in range(3, 6)]
+    T_inv, det = _inverse_packed(diag_T + off_T)
+    i00, i11, i22, i01, i02, i12 = T_inv
+
+    dx0 = X[:, None, 0] - mean[None, :, 0]
+    dx1 = X[:, None, 1] - mean[None, :, 1]
+    dx2 = X[:, None, 2] - mean[None, :, 2]
+    y = (i00 * dx0 + i01 * dx1 + i02 * dx2,
+         i01 * dx0 + i11 * dx1 + i12 * dx2,
+         i02 * dx0 + i12 * dx1 + i22 * dx2)
+    chi2 = dx0 * y[0] + dx1 * y[1] + dx2 * y[2]
+
+    log_p = np.log(amp)[None, :] - 1.5 * LOG_2PI - 0.5 * np.log(det) - 0.5 * chi2
+    return log_p, T_inv, y
+
+
+def chunk_slices(n, chunk_size):
+    """Slices covering ``range(n)`` in consecutive chunks of at most ``chunk_size`` rows."""
+    for start in range(0, n, chunk_size):
+        yield slice(start, min(start + chunk_size, n))
+
+
+def component_log_likelihoods(gmm, X, noise, chunk_size=20000):
+    """
+    Log-likelihood of each star under each component, convolved with its noise.
+
+    Parameters
+    ----------
+    gmm : pygmmis.GMM
+        Mixture model.
+    X : ndarray
+        (N, 3) velocities.
+    noise : ndarray
+        Per-star noise, see `packed_noise`.
+    chunk_size : int, optional
+        Stars processed at once (default: 20000).
+
+    Returns
+    -------
+    ndarray
+        (N, K) array of log(amp_k N(x_i | mu_k, S_k + V_i)).
+    """
+    X = np.asarray(X, dtype=float)
+    diag, off = packed_noise(noise)
+    S = pack_covariance(gmm.covar)
+    log_p = np.empty((len(X), gmm.K))
+    for rows in chunk_slices(len(X), chunk_size):
+        log_p[rows] = _chunk_terms(X[rows], diag[rows], None if off is None else off[rows],
+                                   gmm.amp, gmm.mean, S)[0]
+    return log_p
+
+
+def xd_log_likelihood(gmm, X, noise, chunk_size=20000):
+    """
+    Per-star log-likelihood of noisy data under a deconvolved mixture.
+
+    Equivalent to ``gmm.logL(X, covar=noise)`` in pygmmis.
+
+    Returns
+    -------
+    ndarray
+        (N,) log-likelihoods.
+    """
+    return logsumexp(component_log_likelihoods(gmm, X, noise, chunk_size=chunk_size), axis=1)
+
+
+def _em_sums(gmm, X, diag, off, chunk_size):
+    """One E-step and the M-step sums, accumulated over chunks of stars."""
+    K = gmm.K
+    S = pack_covariance(gmm.covar)
+    rows_t, cols_t = [0, 1, 2, 0, 0, 1], [0, 1, 2, 1, 2, 2]
+
+    log_L = 0.0
+    A = np.zeros(K)
+    Y1 = np.zeros((K, 3))   # sum_i q_ik y_ik
+    Y2 = np.zeros((K, 6))   # sum_i q_ik y_ik y_ik^T (packed)
+    Q = np.zeros((K, 6))    # sum_i q_ik T_ik^-1 (packed)
+    for rows in chunk_slices(len(X), chunk_size):
+        log_p, T_inv, y = _chunk_terms(X[rows], diag[rows], None if off is None else off[rows],
+                                       gmm.amp, gmm.mean, S)
+        log_S = logsumexp(log_p, axis=1)
+        log_L += log_S.sum()
+        q = np.exp(log_p - log_S[:, None])
+
+        A += q.sum(axis=0)
+        for j in range(3):
+            Y1[:, j] += (q * y[j]).sum(axis=0)
+        for t in range(6):
+            Y2[:, t] += (q * y[rows_t[t]] * y[cols_t[t]]).sum(axis=0)
+            Q[:, t] += (q * T_inv[t]).sum(axis=0)
+    return log_L, A, Y1, Y2, Q
+
+
+def _update(gmm, A, Y1, Y2, Q, N, w):
+    """M-step update of `gmm` in place (Bovy et al. eqs. 17-19, pygmmis regularisation)."""
+    S = gmm.covar
+    # sum_i q_ik b_ik = A_k mu_k + S_k Y1_k
+    M = A[:, None] * gmm.mean + np.einsum('kij,kj->ki', S, Y1)
+    # sum_i q_ik [(b_ik - mu_k)(b_ik - mu_k)^T + B_ik] = S_k (Y2_k - Q_k) S_k + A_k S_k
+    C = S @ unpack_covariance(Y2 - Q) @ S + A[:, None, None] * S
+
+    gmm.amp[:] = A / N
+    gmm.mean[:, :] = M / A[:, None]
+    if w > 0:
+        w_eff = w**2 * (N / gmm.K + 1)
+        gmm.covar[:, :, :] = (C + w_eff * np.eye(gmm.D)[None, :, :]) / (A + 1)[:, None, None]
+    else:
+        gmm.covar[:, :, :] = C / A[:, None, None]
+
+
+class XDEM:
+    """
+    Resumable XD EM run on one model.
+
+    The iteration count, last log-likelihood and convergence state are kept
+    between calls to `run`, so a fit can be advanced a few iterations at a
+    time (e.g. by a restart scheduler) and reaches exactly the same model as
+    one uninterrupted `xd_em` call. The data are passed to each `run` rather
+    than stored, so the object stays small enough to send to worker processes.
+
+    Parameters
+    ----------
+    gmm : pygmmis.GMM
+        Initialised model, updated in place.
+    w, tol, miniter, maxiter, chunk_size
+        See `xd_em`.
+
+    Attributes
+    ----------
+    log_L : float or None
+        Log-likelihood of the last E-step.
+    n_iter : int
+        EM iterations run so far.
+    converged : bool
+        Whether the convergence test has been met.
+    """
+
+    def __init__(self, gmm, w=0., tol=1e-3, miniter=1, maxiter=1000, chunk_size=20000):
+        self.gmm = gmm
+        self.w = w
+        self.tol = tol
+        self.miniter = miniter
+        self.maxiter = maxiter
+        self.chunk_size = chunk_size
+        self.log_L = None
+        self.n_iter = 0
+        self.converged = False
+
+    @property
+    def done(self):
+        """True once converged or out of iterations."""
+        return self.converged or self.n_iter >= self.maxiter
+
+    def run(self, X, noise, n_steps=None):
+        """
+        Advance by at most ``n_steps`` iterations (default: until done).
+
+        Returns
+        -------
+        float
+            The current log-likelihood.
+        """
+        X = np.asarray(X, dtype=float)
+        diag, off = packed_noise(noise)
+        gmm = self.gmm
+        shift_cutoff = pygmmis.chi2_cutoff(gmm.D, cutoff=0.1)
+        stop = self.maxiter if n_steps is None else min(self.maxiter, self.n_iter + n_steps)
+
+        while not self.converged and self.n_iter < stop:
+            log_L_, A, Y1, Y2, Q = _em_sums(gmm, X, diag, off, self.chunk_size)
+            mean_, covar_inv_ = gmm.mean.copy(), np.linalg.inv(gmm.covar)
+            _update(gmm, A, Y1, Y2, Q, len(X), self.w)
+
+            # a component that moved by more than sigma/10 is not converged
+            shift = gmm.mean - mean_
+            moved = np.einsum('ki,kij,kj->k', shift, covar_inv_, shift) > shift_cutoff
+            if (self.n_iter > self.miniter and np.abs(log_L_ - self.log_L) < self.tol * np.abs(self.log_L)
+                    and not moved.any()):
+                self.converged = True
+            self.log_L = log_L_
+            self.n_iter += 1
+        return self.log_L
+
+
+def xd_em(gmm, X, noise, w=0., tol=1e-3, miniter=1, maxiter=1000, chunk_size=20000):
+    """
+    Run XD EM on an initialised model until the log-likelihood converges.
+
+    Parameters
+    ----------
+    gmm : pygmmis.GMM
+        Initialised model (e.g. by `pygmmis.initFromKMeans`), updated in place.
+    X : ndarray
+        (N, 3) velocities.
+    noise : ndarray
+        Per-star noise: ``(N, 3)`` variances, packed ``(N, 6)`` or ``(N, 3, 3)``.
+        Dense stacks without off-diagonal terms use the diagonal kernel.
+    w : float, optional
+        Minimum covariance regularisation, as in ``pygmmis.fit``.
+    tol : float, optional
+        Relative log-likelihood tolerance, as in ``pygmmis.fit``.
+    miniter, maxiter : int, optional
+        Iteration limits, as in ``pygmmis.fit``.
+    chunk_size : int, optional
+        Stars processed at once; memory scales as ``chunk_size * K``
+        (default: 20000).
+
+    Returns
+    -------
+    log_L : float
+        Total log-likelihood of the data (same convention as ``pygmmis.fit``).
+    n_iter : int
+        Number of EM iterations.
+    """
+    em = XDEM(gmm, w=w, tol=tol, miniter=miniter, maxiter=maxiter, chunk_size=chunk_size)
+    em.run(X, noise)
+    return em.log_L, em.n_iter
+
+
+def _sufficient_statistics(gmm, A, Y1, Y2, Q):
+    """
+    Parameter-free E-step sums from the output of `_em_sums`.
+
+    Returns ``sum_i q_ik``, ``sum_i q_ik b_ik`` and
+    ``sum_i q_ik (b_ik b_ik^T + B_ik)`` for every component.
+    """
+    S, mu = gmm.covar, gmm.mean
+    M = A[:, None] * mu + np.einsum('kij,kj->ki', S, Y1)
+    C = S @ unpack_covariance(Y2 - Q) @ S + A[:, None, None] * S
+    outer = mu[:, :, None] * M[:, None, :]
+    return A, M, C + outer + outer.transpose(0, 2, 1) - A[:, None, None] * mu[:, :, None] * mu[:, None, :]
+
+
+def _update_from_statistics(gmm, s0, s1, s2, N, w):
+    """M-step from per-star averaged sufficient statistics (see `_sufficient_statistics`)."""
+    gmm.amp[:] = s0 / s0.sum()
+    gmm.mean[:, :] = s1 / s0[:, None]
+    C = N * (s2 - s1[:, :, None] * s1[:, None, :] / s0[:, None, None])
+    A = N * s0
+    if w > 0:
+        w_eff = w**2 * (N / gmm.K + 1)
+        gmm.covar[:, :, :] = (C + w_eff * np.eye(gmm.D)[None, :, :]) / (A + 1)[:, None, None]
+    else:
+        gmm.covar[:, :, :] = C / A[:, None, None]
+
+
+def xd_stochastic_em(gmm, X, noise, batch_size=10000, n_epochs=2, kappa=0.6, w=0., tol=1e-3, miniter=1,
+                     maxiter=1000, chunk_size=20000, rng=None):
+    """
+    Online XD EM on mini-batches of stars, followed by full-data EM polishing.
+
+    Each mini-batch E-step gives per-star averaged sufficient statistics
+    (responsibility-weighted counts, deconvolved means and second moments).
+    These are blended into running statistics with step size
+    ``(t + 1)**-kappa`` (Cappé & Moulines 2009), and the model is updated
+    from the running statistics after every batch. After ``n_epochs`` passes
+    the model is polished with full-data EM (`XDEM`) until the usual
+    convergence test is met, so the final model is a stationary point of the
+    full-data likelihood.
+
+    Parameters
+    ----------
+    gmm : pygmmis.GMM
+        Initialised model, updated in place.
+    X : ndarray
+        (N, 3) velocities.
+    noise : ndarray
+        Per-star noise, see `packed_noise`.
+    batch_size : int, optional
+        Stars per mini-batch (default: 10000).
+    n_epochs : int, optional
+        Stochastic passes over the data before polishing (default: 2).
+    kappa : float, optional
+        Step-size decay exponent in (0.5, 1] (default: 0.6).
+    w, tol, miniter, maxiter, chunk_size
+        As in `xd_em`; ``tol``, ``miniter`` and ``maxiter`` apply to polishing.
+    rng : numpy.random.Generator or int, optional
+        Source of the batch order.
+
+    Returns
+    -------
+    log_L : float
+        Total log-likelihood of the data after polishing.
+    n_iter : int
+        Number of full-data polishing iterations.
+    n_steps : int
+        Number of mini-batch updates.
+    """
+    if not 0.5 < kappa <= 1:
+        raise ValueError(f"kappa must lie in (0.5, 1], got {kappa}")
+    X = np.asarray(X, dtype=float)
+    diag, off = packed_noise(noise)
+    N = len(X)
+    rng = np.random.default_rng(rng)
+    n_batches = max(1, -(-N // batch_size))
+
+    stats, n_steps = None, 0
+    for _ in range(n_epochs):
+        for idx in np.array_split(rng.permutation(N), n_batches):
+            idx.sort()
+            _, A, Y1, Y2, Q = _em_sums(gmm, X[idx], diag[idx], None if off is None else off[idx], chunk_size)
+            batch = [s / len(idx) for s in _sufficient_statistics(gmm, A, Y1, Y2, Q)]
+            gamma = (n_steps + 1) ** -kappa
+            stats = batch if stats is None else [(1 - gamma) * s + gamma * b for s, b in zip(stats, batch)]
+            _update_from_statistics(gmm, *stats, N, w)
+            n_steps += 1
+
+    em = XDEM(gmm, w=w, tol=tol, miniter=miniter, maxiter=maxiter, chunk_size=chunk_size)
+    em.run(X, noise)
+    return em.log_L, em.n_iter, n_steps
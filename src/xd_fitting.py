@@ -0,0 +1,892 @@
+"""
+xd_fitting.py
+
+Restart management for the Extreme Deconvolution (XD) fits used by
+`gmm_analysis.fit_gmm_fixed_components` and
+`bic_vs_components.compute_bic_vs_n_components`.
+
+Every restart gets its own random stream, derived from the root seed and its
+(K, restart index) pair. A restart therefore produces the same model whether it
+runs serially, in a worker pool of any size, or as part of a BIC sweep or a
+single-K fit.
+"""
+
+import copy
+import math
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import pygmmis
+from tqdm import tqdm
+
+from fit_cache import FitCache, data_hash, fit_key
+from xd_em import XDEM, xd_em, xd_log_likelihood, xd_stochastic_em
+
+# Data shared with pool workers, set once per worker by `_init_worker`
+_WORKER_DATA = {}
+# Held while pygmmis._EMstep is wrapped by `_count_em_iterations`
+_EM_COUNT_LOCK = threading.Lock()
+
+
+# Stream keys under one root seed. Restarts use (K, restart) with K >= 1 (and
+# (K, restart, 0) for their mini-batch order); every other stream has a key
+# starting with 0, so it can never collide with a restart:
+#   (0,)               cross-validation fold assignment (`fold_seed`)
+#   (0, 1, replicate)  bootstrap replicate (`bootstrap_seed`)
+
+
+def restart_seed(seed, n_components, restart):
+    """
+    Random stream for one restart.
+
+    Parameters
+    ----------
+    seed : int
+        Root seed of the run.
+    n_components : int
+        Number of components K.
+    restart : int
+        Restart index.
+
+    Returns
+    -------
+    numpy.random.SeedSequence
+    """
+    return np.random.SeedSequence(seed, spawn_key=(n_components, restart))
+
+
+def fold_seed(seed):
+    """
+    Random stream of the fold assignment of a cross-validation run
+    (`stratified_folds` in `bic_vs_components.compute_cv_vs_n_components`).
+
+    Parameters
+    ----------
+    seed : int
+        Root seed of the run.
+
+    Returns
+    -------
+    numpy.random.SeedSequence
+    """
+    return np.random.SeedSequence(seed, spawn_key=(0,))
+
+
+def bootstrap_seed(seed, replicate):
+    """
+    Random stream for one bootstrap replicate of `bootstrap_fits`.
+
+    Parameters
+    ----------
+    seed : int
+        Root seed of the run.
+    replicate : int
+        Replicate index.
+
+    Returns
+    -------
+    numpy.random.SeedSequence
+    """
+    return np.random.SeedSequence(seed, spawn_key=(0, 1, replicate))
+
+
+@contextmanager
+def _count_em_iterations():
+    """
+    Count the pygmmis EM steps run by this thread inside the block.
+
+    ``pygmmis.fit`` reports no iteration count and takes no per-iteration
+    callback, so its private ``_EMstep`` is wrapped for the duration of the
+    block. The lock serialises counted fits within the process, and steps
+    run by other threads are passed through uncounted. If pygmmis drops
+    ``_EMstep``, this raises instead of silently reporting zero iterations.
+    """
+    original = getattr(pygmmis, '_EMstep', None)
+    if not callable(original):
+        raise RuntimeError("pygmmis has no _EMstep to count EM iterations with; "
+                           "this pygmmis version is not supported by engine='pygmmis'")
+    counter = {'n_iter': 0}
+    owner = threading.get_ident()
+
+    def counting_step(*args, **kwargs):
+        if threading.get_ident() == owner:
+            counter['n_iter'] += 1
+        return original(*args, **kwargs)
+
+    with _EM_COUNT_LOCK:
+        pygmmis._EMstep = counting_step
+        try:
+            yield counter
+        finally:
+            pygmmis._EMstep = original
+
+
+def kmeans_start(X, n_components, seed_seq):
+    """
+    k-means initialisation of one restart, as used by `xd_restart`.
+
+    Returns
+    -------
+    pygmmis.GMM
+    """
+    state = np.random.get_state()
+    np.random.seed(seed_seq.generate_state(1)[0])
+    try:
+        gmm = pygmmis.GMM(K=n_components, D=3)
+        pygmmis.initFromKMeans(gmm, X, rng=np.random.RandomState(seed_seq.generate_state(1)[0]))
+    finally:
+        np.random.set_state(state)
+    return gmm
+
+
+def xd_restart(X, cov_matrices, n_components, seed_seq, w=0.1, tol=1e-6, engine="pygmmis", stochastic=None):
+    """
+    Run one k-means-initialised XD fit.
+
+    pygmmis' k-means initialisation draws from the global ``np.random`` state,
+    so it is seeded from ``seed_seq`` for the duration of the initialisation
+    (or the whole pygmmis fit) and restored afterwards.
+
+    Parameters
+    ----------
+    X : ndarray
+        (N, 3) velocities.
+    cov_matrices : ndarray
+        (N, 3, 3) noise covariances.
+    n_components : int
+        Number of Gaussian components.
+    seed_seq : numpy.random.SeedSequence
+        Random stream of this restart (see `restart_seed`).
+    w : float, optional
+        Minimum covariance regularisation (default: 0.1).
+    tol : float, optional
+        Relative log-likelihood tolerance (default: 1e-6).
+    engine : {"numpy", "pygmmis"}, optional
+        ``"pygmmis"`` (default) runs ``pygmmis.fit``; ``"numpy"`` runs the
+        vectorized EM of `xd_em`. Both start from the same k-means initialisation
+        and converge to the same model.
+    stochastic : bool or dict, optional
+        Run mini-batch EM before full-data polishing
+        (`xd_em.xd_stochastic_em`; numpy engine only). A dict is passed on as
+        options (``batch_size``, ``n_epochs``, ``kappa``). The batch order is
+        drawn from a stream derived from ``seed_seq``.
+
+    Returns
+    -------
+    gmm : pygmmis.GMM
+        Fitted model.
+    logL : float
+        Total log-likelihood of the data.
+    n_iter : int
+        Number of (full-data) EM iterations.
+    """
+    if engine == "numpy":
+        gmm = kmeans_start(X, n_components, seed_seq)
+        if stochastic:
+            options = stochastic if isinstance(stochastic, dict) else {}
+            batch_stream = np.random.SeedSequence(seed_seq.entropy, spawn_key=seed_seq.spawn_key + (0,))
+            logL, n_iter, _ = xd_stochastic_em(gmm, X, cov_matrices, w=w, tol=tol,
+                                               rng=np.random.default_rng(batch_stream), **options)
+        else:
+            logL, n_iter = xd_em(gmm, X, cov_matrices, w=w, tol=tol)
+        return gmm, logL, n_iter
+    if stochastic:
+        raise ValueError("stochastic EM requires engine='numpy'")
+    if engine != "pygmmis":
+        raise ValueError(f"Unknown engine '{engine}'; use 'numpy' or 'pygmmis'")
+
+    # pygmmis.fit runs its own k-means initialisation on the global state
+    state = np.random.get_state()
+    np.random.seed(seed_seq.generate_state(1)[0])
+    rng = np.random.RandomState(seed_seq.generate_state(1)[0])
+    try:
+        gmm = pygmmis.GMM(K=n_components, D=3)
+        with _count_em_iterations() as counter:
+            logL, _ = pygmmis.fit(gmm, X, covar=cov_matrices, w=w, tol=tol, init_method='kmeans', rng=rng)
+    finally:
+        np.random.set_state(state)
+    n_iter = counter['n_iter']
+    return gmm, logL, n_iter
+
+
+def _init_worker(X, cov_matrices, folds=None):
+    _WORKER_DATA['X'] = X
+    _WORKER_DATA['cov'] = cov_matrices
+    _WORKER_DATA['folds'] = folds
+
+
+def restart_task(n_components, restart, seed, w, tol, engine, stochastic=None, X=None, cov_matrices=None):
+    """
+    Fit restart ``restart`` of K = ``n_components`` and time it.
+
+    The unit of work of `run_xd_restarts` and `batch_fitting.run_batch_fits`.
+    Without ``X``, the data are taken from the worker process set up by
+    `_init_worker`.
+
+    Parameters
+    ----------
+    n_components : int
+        Number of components K.
+    restart : int
+        Restart index; the random stream is `restart_seed` of ``seed``.
+    seed : int
+        Root seed of the run.
+    w, tol, engine, stochastic : optional
+        Passed to `xd_restart`.
+    X, cov_matrices : ndarray, optional
+        Velocities and noise covariances.
+
+    Returns
+    -------
+    record : dict
+        ``K``, ``restart``, ``logL``, ``n_iter`` and ``seconds``.
+    gmm : pygmmis.GMM
+        Fitted model.
+    """
+    if X is None:
+        X, cov_matrices = _WORKER_DATA['X'], _WORKER_DATA['cov']
+    start = time.perf_counter()
+    gmm, logL, n_iter = xd_restart(X, cov_matrices, n_components, restart_seed(seed, n_components, restart), w=w, tol=tol,
+                                   engine=engine, stochastic=stochastic)
+    record = {'K': n_components, 'restart': restart, 'logL': logL, 'n_iter': n_iter,
+              'seconds': time.perf_counter() - start}
+    return record, gmm
+
+
+def run_xd_restarts(X, cov_matrices, components, n_init=50, seed=None, n_workers=1, w=0.1, tol=1e-6,
+                    engine="pygmmis", stochastic=None, cache=None, first_restart=0, desc="Fitting GMMs"):
+    """
+    Run ``n_init`` XD restarts for each K in ``components``.
+
+    Parameters
+    ----------
+    X : ndarray
+        (N, 3) velocities.
+    cov_matrices : ndarray
+        (N, 3, 3) noise covariances.
+    components : iterable of int
+        Component counts to fit.
+    n_init : int, optional
+        Restarts per component count (default: 50).
+    seed : int, optional
+        Root seed; ``None`` draws fresh entropy, which is then recorded in the
+        returned table's ``seed`` column.
+    n_workers : int, optional
+        Number of worker processes (default: 1, serial). Results do not depend
+        on the number of workers.
+    w, tol : float, optional
+        Passed to `xd_restart`.
+    engine : {"numpy", "pygmmis"}, optional
+        EM implementation, see `xd_restart` (default: ``"pygmmis"``).
+    stochastic : bool or dict, optional
+        Mini-batch EM options, see `xd_restart`.
+    cache : fit_cache.FitCache or str, optional
+        Cache of finished restarts (a string is taken as its directory).
+        Restarts found in it are not refitted and new ones are added. Only
+        used with an explicit ``seed``.
+    first_restart : int, optional
+        Index of the first restart (default: 0). Restarts ``first_restart``
+        to ``first_restart + n_init - 1`` are run, so a seeded run can be
+        extended without refitting the restarts it already has.
+    desc : str, optional
+        Progress bar label.
+
+    Returns
+    -------
+    restarts : pd.DataFrame
+        One row per restart with columns ``K``, ``restart``, ``logL``,
+        ``n_iter``, ``seconds`` and ``seed``, sorted by (K, restart). With a
+        cache, a boolean ``cached`` column marks the restarts taken from it.
+    models : dict
+        Mapping ``(K, restart) -> pygmmis.GMM``.
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+        cache = None
+    # largest K first: they take longest, which balances the pool
+    tasks = [(K, i) for K in sorted(components, reverse=True) for i in range(first_restart, first_restart + n_init)]
+
+    records, models = [], {}
+    if cache is not None:
+        if isinstance(cache, str):
+            cache = FitCache(cache)
+        digest = data_hash(X, cov_matrices)
+        keys = {(K, i): fit_key(digest, K, i, seed, w=w, tol=tol, engine=engine, stochastic=stochastic or None)
+                for K, i in tasks}
+        misses = []
+        for K, i in tasks:
+            hit = cache.get(keys[K, i])
+            if hit is None:
+                misses.append((K, i))
+                continue
+            record, gmm = hit
+            records.append({'K': K, 'restart': i, **record, 'cached': True})
+            models[K, i] = gmm
+        tasks = misses
+
+    if n_workers > 1 and tasks:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(X, cov_matrices)) as executor:
+            futures = [executor.submit(restart_task, K, i, seed, w, tol, engine, stochastic) for K, i in tasks]
+            for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+                record, gmm = future.result()
+                records.append(record)
+                models[record['K'], record['restart']] = gmm
+    else:
+        for K, i in tqdm(tasks, desc=desc):
+            record, gmm = restart_task(K, i, seed, w, tol, engine, stochastic, X=X, cov_matrices=cov_matrices)
+            records.append(record)
+            models[K, i] = gmm
+
+    if cache is not None:
+        for record in records:
+            if 'cached' not in record:
+                cache.put(keys[record['K'], record['restart']], record, models[record['K'], record['restart']])
+                record['cached'] = False
+
+    restarts = pd.DataFrame(records).sort_values(['K', 'restart'], ignore_index=True)
+    restarts['seed'] = seed
+    return restarts, models
+
+
+def best_restart(restarts, models, n_components):
+    """
+    Highest-likelihood model for one component count.
+
+    Returns
+    -------
+    pygmmis.GMM
+    """
+    rows = restarts[restarts['K'] == n_components]
+    if 'pruned' in rows.columns:
+        # partial likelihoods of pruned restarts have no model
+        rows = rows[~rows['pruned']]
+    best = rows.loc[rows['logL'].idxmax()]
+    return models[n_components, int(best['restart'])]
+
+
+def _advance_task(em, n_steps, X=None, cov_matrices=None):
+    if X is None:
+        X, cov_matrices = _WORKER_DATA['X'], _WORKER_DATA['cov']
+    start = time.perf_counter()
+    em.run(X, cov_matrices, n_steps=n_steps)
+    return em, time.perf_counter() - start
+
+
+def successive_halving_restarts(X, cov_matrices, n_components, n_init=50, seed=None, n_workers=1, min_iter=5,
+                                eta=2, batch_size=None, plateau_window=None, w=0.1, tol=1e-6,
+                                desc="Scheduling GMM restarts"):
+    """
+    Run XD restarts for one K with successive halving and early stopping.
+
+    Restarts are launched in batches. Within a batch every restart runs
+    ``min_iter`` EM iterations; the restarts still running are then ranked by
+    their partial log-likelihood, only the best ``1/eta`` of them continue,
+    and the iteration budget is multiplied by ``eta``. This repeats until a
+    single restart is left, which runs to convergence. Restarts that converge
+    along the way are kept whatever their rank.
+
+    With ``plateau_window`` set, no further batches are launched once the
+    last ``plateau_window`` restarts have not improved the best converged
+    log-likelihood by more than ``tol`` (relative).
+
+    Each restart uses the same k-means start and random stream as restart
+    ``i`` of `run_xd_restarts`, so a restart that is never pruned reaches the
+    same model.
+
+    Parameters
+    ----------
+    X : ndarray
+        (N, 3) velocities.
+    cov_matrices : ndarray
+        (N, 3, 3) noise covariances.
+    n_components : int
+        Number of Gaussian components.
+    n_init : int, optional
+        Maximum number of restarts (default: 50).
+    seed : int, optional
+        Root seed, as in `run_xd_restarts`.
+    n_workers : int, optional
+        Worker processes used to advance the restarts of a rung (default: 1).
+    min_iter : int, optional
+        EM iterations before the first pruning (default: 5).
+    eta : int, optional
+        Pruning factor (default: 2, i.e. halving).
+    batch_size : int, optional
+        Restarts launched at a time (default: ``plateau_window`` if given,
+        otherwise all ``n_init``).
+    plateau_window : int, optional
+        Stop launching once this many consecutive restarts brought no
+        improvement (default: None, launch all). The check runs between
+        batches, so ``batch_size`` must be smaller than ``n_init``.
+    w, tol : float, optional
+        Passed to the EM, as in `xd_restart`.
+    desc : str, optional
+        Progress bar label.
+
+    Returns
+    -------
+    restarts : pd.DataFrame
+        One row per launched restart with the columns of `run_xd_restarts`
+        and a boolean ``pruned``; for pruned restarts ``logL`` is the partial
+        log-likelihood at the time of pruning.
+    models : dict
+        Mapping ``(K, restart) -> pygmmis.GMM`` for the restarts that were
+        not pruned.
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    if batch_size is None:
+        batch_size = n_init if plateau_window is None else plateau_window
+    if plateau_window is not None and batch_size >= n_init:
+        raise ValueError(f"plateau_window needs batch_size < n_init, got batch_size={batch_size} "
+                         f"and n_init={n_init}")
+
+    executor = None
+    if n_workers > 1:
+        executor = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                       initargs=(X, cov_matrices))
+
+    def advance(ems, seconds, n_steps):
+        if executor is None:
+            results = [_advance_task(ems[i], n_steps(ems[i]), X=X, cov_matrices=cov_matrices) for i in ems]
+        else:
+            results = list(executor.map(_advance_task, ems.values(), [n_steps(em) for em in ems.values()]))
+        for i, (em, elapsed) in zip(list(ems), results):
+            ems[i] = em
+            seconds[i] += elapsed
+
+    records, models = [], {}
+    best_logL, last_improvement = -np.inf, 0
+    progress = tqdm(total=n_init, desc=desc)
+    try:
+        for batch_start in range(0, n_init, batch_size):
+            if plateau_window is not None and batch_start - last_improvement >= plateau_window:
+                break
+
+            ems, seconds = {}, {}
+            for i in range(batch_start, min(batch_start + batch_size, n_init)):
+                start = time.perf_counter()
+                gmm = kmeans_start(X, n_components, restart_seed(seed, n_components, i))
+                ems[i] = XDEM(gmm, w=w, tol=tol)
+                seconds[i] = time.perf_counter() - start
+
+            budget = min_iter
+            while ems:
+                if len(ems) == 1:
+                    advance(ems, seconds, lambda em: None)
+                else:
+                    advance(ems, seconds, lambda em: budget - em.n_iter)
+
+                survivors = {}
+                for i, em in ems.items():
+                    if em.done:
+                        records.append({'K': n_components, 'restart': i, 'logL': em.log_L, 'n_iter': em.n_iter,
+                                        'seconds': seconds[i], 'pruned': False})
+                        models[n_components, i] = em.gmm
+                        if em.log_L - best_logL > tol * abs(em.log_L):
+                            last_improvement = max(last_improvement, i + 1)
+                        best_logL = max(best_logL, em.log_L)
+                        progress.update()
+                    else:
+                        survivors[i] = em
+
+                ranked = sorted(survivors, key=lambda i: np.nan_to_num(survivors[i].log_L, nan=-np.inf),
+                                reverse=True)
+                n_keep = math.ceil(len(ranked) / eta)
+                for i in ranked[n_keep:]:
+                    em = survivors.pop(i)
+                    records.append({'K': n_components, 'restart': i, 'logL': em.log_L, 'n_iter': em.n_iter,
+                                    'seconds': seconds[i], 'pruned': True})
+                    progress.update()
+                ems = survivors
+                budget *= eta
+    finally:
+        progress.close()
+        if executor is not None:
+            executor.shutdown()
+
+    restarts = pd.DataFrame(records).sort_values(['K', 'restart'], ignore_index=True)
+    restarts['seed'] = seed
+    return restarts[['K', 'restart', 'logL', 'n_iter', 'seconds', 'seed', 'pruned']], models
+
+
+def split_component(gmm, k):
+    """
+    Copy of ``gmm`` with component ``k`` split in two along its major axis.
+
+    The two halves share the amplitude of ``k`` and are displaced by
+    ``+-sqrt(3 lambda)/2`` along the major axis, with the variance along that
+    axis reduced to ``lambda/4``. Together they therefore keep the mean and
+    covariance of the original component.
+
+    Returns
+    -------
+    pygmmis.GMM
+        Model with ``gmm.K + 1`` components.
+    """
+    eigval, eigvec = np.linalg.eigh(gmm.covar[k])
+    lam, axis = eigval[-1], eigvec[:, -1]
+    offset = np.sqrt(3 * lam) / 2 * axis
+    covar = gmm.covar[k] - 0.75 * lam * np.outer(axis, axis)
+
+    split = pygmmis.GMM(K=gmm.K + 1, D=gmm.D)
+    split.amp[:gmm.K] = gmm.amp
+    split.mean[:gmm.K] = gmm.mean
+    split.covar[:gmm.K] = gmm.covar
+    split.amp[[k, gmm.K]] = gmm.amp[k] / 2
+    split.mean[k], split.mean[gmm.K] = gmm.mean[k] - offset, gmm.mean[k] + offset
+    split.covar[[k, gmm.K]] = covar
+    return split
+
+
+def split_candidates(gmm):
+    """
+    Components ordered by how much spread they carry, ``amp * lambda_max``.
+
+    Returns
+    -------
+    ndarray
+        Component indices, best split candidate first.
+    """
+    return np.argsort(-gmm.amp * np.linalg.eigvalsh(gmm.covar)[:, -1], kind='stable')
+
+
+def warm_start_sweep(X, cov_matrices, max_components, n_warm=3, n_cold=2, seed=None, n_workers=1, w=0.1,
+                     tol=1e-6, desc="Warm-started BIC sweep"):
+    """
+    Fit K = 1 .. ``max_components``, seeding each K from the best K - 1 model.
+
+    For every K > 1 the best K - 1 model is split (`split_component`) at each
+    of its ``n_warm`` best `split_candidates`. Each split seeds one restart, and
+    ``n_cold`` k-means restarts are added for diversity. A warm start is close
+    to a K-component optimum already, so it needs far fewer EM iterations than
+    a k-means start.
+
+    Parameters
+    ----------
+    X : ndarray
+        (N, 3) velocities.
+    cov_matrices : ndarray
+        (N, 3, 3) noise covariances.
+    max_components : int
+        Largest K.
+    n_warm : int, optional
+        Split restarts per K (at most K - 1; default: 3).
+    n_cold : int, optional
+        k-means restarts per K (default: 2); for K = 1 at least one is run.
+        Cold restart ``i`` is restart ``i`` of `run_xd_restarts`.
+    seed : int, optional
+        Root seed, as in `run_xd_restarts`.
+    n_workers : int, optional
+        Worker processes used for the restarts of each K (default: 1).
+    w, tol : float, optional
+        Passed to the EM, as in `xd_restart`.
+    desc : str, optional
+        Progress bar label.
+
+    Returns
+    -------
+    restarts : pd.DataFrame
+        Columns of `run_xd_restarts` plus ``init`` (``'cold'`` or
+        ``'split'``), sorted by (K, restart).
+    models : dict
+        Mapping ``(K, restart) -> pygmmis.GMM``.
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+
+    executor = None
+    if n_workers > 1:
+        executor = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                       initargs=(X, cov_matrices))
+
+    records, models = [], {}
+    try:
+        for K in tqdm(range(1, max_components + 1), desc=desc):
+            starts, seconds = {}, {}
+            for i in range(max(n_cold, 1) if K == 1 else n_cold):
+                start = time.perf_counter()
+                starts[i] = ('cold', kmeans_start(X, K, restart_seed(seed, K, i)))
+                seconds[i] = time.perf_counter() - start
+            if K > 1:
+                parent = best_restart(pd.DataFrame(records), models, K - 1)
+                for j, k in enumerate(split_candidates(parent)[:n_warm]):
+                    starts[n_cold + j] = ('split', split_component(parent, k))
+                    seconds[n_cold + j] = 0.0
+
+            ems = [XDEM(gmm, w=w, tol=tol) for _, gmm in starts.values()]
+            if executor is None:
+                results = [_advance_task(em, None, X=X, cov_matrices=cov_matrices) for em in ems]
+            else:
+                results = list(executor.map(_advance_task, ems, [None] * len(ems)))
+
+            for i, (em, elapsed) in zip(starts, results):
+                records.append({'K': K, 'restart': i, 'logL': em.log_L, 'n_iter': em.n_iter,
+                                'seconds': seconds[i] + elapsed, 'init': starts[i][0]})
+                models[K, i] = em.gmm
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    restarts = pd.DataFrame(records).sort_values(['K', 'restart'], ignore_index=True)
+    restarts['seed'] = seed
+    return restarts[['K', 'restart', 'logL', 'n_iter', 'seconds', 'seed', 'init']], models
+
+
+def stratified_folds(values, n_folds=5, seed=None):
+    """
+    Assign stars to cross-validation folds, stratified on ``values``.
+
+    Stars are ranked by ``values`` and each consecutive block of ``n_folds``
+    stars is spread over the folds in random order, so every fold samples the
+    full distribution of ``values`` and fold sizes differ by at most one.
+
+    Parameters
+    ----------
+    values : array_like
+        (N,) stratification variable, e.g. ``v_phi``.
+    n_folds : int, optional
+        Number of folds (default: 5).
+    seed : int, optional
+        Seed of the within-block order.
+
+    Returns
+    -------
+    ndarray
+        (N,) fold index of each star.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(values)
+    ranked = np.concatenate([rng.permutation(n_folds) for _ in range(-(-n // n_folds))])[:n]
+    folds = np.empty(n, dtype=int)
+    folds[np.argsort(values, kind='stable')] = ranked
+    return folds
+
+
+def _fold_task(gmm, fold, w, tol, X=None, cov_matrices=None, folds=None):
+    if X is None:
+        X, cov_matrices, folds = _WORKER_DATA['X'], _WORKER_DATA['cov'], _WORKER_DATA['folds']
+    start = time.perf_counter()
+    gmm = copy.deepcopy(gmm)
+    test = folds == fold
+    logL_train, n_iter = xd_em(gmm, X[~test], cov_matrices[~test], w=w, tol=tol)
+    logL_test = xd_log_likelihood(gmm, X[test], cov_matrices[test]).sum()
+    return {'K': gmm.K, 'fold': int(fold), 'n_test': int(test.sum()), 'logL_train': logL_train,
+            'logL_test': float(logL_test), 'n_iter': n_iter, 'seconds': time.perf_counter() - start}
+
+
+def cross_validate_components(X, cov_matrices, models, folds, n_workers=1, w=0.1, tol=1e-6,
+                              desc="Cross-validating"):
+    """
+    Held-out deconvolved log-likelihood of each model over K folds.
+
+    For every model and fold the model is refitted on the other folds,
+    starting from the given (full-data) parameters, and the held-out stars are
+    scored with `xd_em.xd_log_likelihood`. A warm start is already close to
+    the training-set optimum, so each refit needs only a few EM iterations.
+    All (model, fold) refits share one worker pool.
+
+    Parameters
+    ----------
+    X : ndarray
+        (N, 3) velocities.
+    cov_matrices : ndarray
+        (N, 3, 3) noise covariances.
+    models : dict
+        Mapping ``K -> pygmmis.GMM`` of full-data fits; they are not modified.
+    folds : ndarray
+        (N,) fold index of each star, see `stratified_folds`.
+    n_workers : int, optional
+        Worker processes (default: 1, serial).
+    w, tol : float, optional
+        Passed to `xd_em.xd_em`.
+    desc : str, optional
+        Progress bar label.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per (K, fold) with columns ``K``, ``fold``, ``n_test``,
+        ``logL_train``, ``logL_test`` (summed over the held-out stars),
+        ``n_iter`` and ``seconds``, sorted by (K, fold).
+    """
+    # largest K first: they take longest, which balances the pool
+    tasks = [(models[K], fold) for K in sorted(models, reverse=True) for fold in np.unique(folds)]
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(X, cov_matrices, folds)) as executor:
+            futures = [executor.submit(_fold_task, gmm, fold, w, tol) for gmm, fold in tasks]
+            records = [future.result() for future in tqdm(as_completed(futures), total=len(futures), desc=desc)]
+    else:
+        records = [_fold_task(gmm, fold, w, tol, X=X, cov_matrices=cov_matrices, folds=folds)
+                   for gmm, fold in tqdm(tasks, desc=desc)]
+
+    return pd.DataFrame(records).sort_values(['K', 'fold'], ignore_index=True)
+
+
+def _bootstrap_task(gmm, replicate, seed, method, w, tol, X=None, cov_matrices=None):
+    if X is None:
+        X, cov_matrices = _WORKER_DATA['X'], _WORKER_DATA['cov']
+    start = time.perf_counter()
+    rng = np.random.default_rng(bootstrap_seed(seed, replicate))
+    n = len(X)
+    if method == "resample":
+        index = rng.integers(0, n, n)
+    else:
+        # integer Poisson(1) weights are the same as repeating each star that often
+        index = np.repeat(np.arange(n), rng.poisson(1.0, n))
+    gmm = copy.deepcopy(gmm)
+    logL, n_iter = xd_em(gmm, X[index], cov_matrices[index], w=w, tol=tol)
+    record = {'replicate': replicate, 'n_stars': len(index), 'logL': logL, 'n_iter': n_iter,
+              'seconds': time.perf_counter() - start}
+    return record, gmm
+
+
+def bootstrap_fits(X, cov_matrices, gmm, n_boot=200, method="resample", seed=None, n_workers=1, w=0.1, tol=1e-6,
+                   desc="Bootstrapping"):
+    """
+    Refit a model to bootstrap replicates of the data.
+
+    Every replicate starts from ``gmm``, the full-data solution, so it
+    converges in a few EM iterations and component ``k`` of each replicate is
+    the counterpart of component ``k`` of ``gmm``. Replicate ``b`` draws its
+    sample from its own random stream derived from ``seed``, so the result
+    does not depend on the number of workers.
+
+    Parameters
+    ----------
+    X : ndarray
+        (N, 3) velocities.
+    cov_matrices : ndarray
+        (N, 3, 3) noise covariances.
+    gmm : pygmmis.GMM
+        Full-data fit; it is not modified.
+    n_boot : int, optional
+        Number of replicates (default: 200).
+    method : {"resample", "poisson"}, optional
+        ``"resample"`` draws N stars with replacement; ``"poisson"`` weights
+        each star by an independent Poisson(1) count, so replicate sizes vary.
+    seed : int, optional
+        Root seed; ``None`` draws fresh entropy, recorded in the ``seed``
+        column.
+    n_workers : int, optional
+        Worker processes (default: 1, serial).
+    w, tol : float, optional
+        Passed to `xd_em.xd_em`.
+    desc : str, optional
+        Progress bar label.
+
+    Returns
+    -------
+    replicates : pd.DataFrame
+        One row per replicate with columns ``replicate``, ``n_stars``,
+        ``logL``, ``n_iter``, ``seconds`` and ``seed``.
+    models : dict
+        Mapping ``replicate -> pygmmis.GMM``.
+    """
+    if method not in ("resample", "poisson"):
+        raise ValueError(f"Unknown bootstrap method '{method}'; use 'resample' or 'poisson'")
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+
+    records, models = [], {}
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(X, cov_matrices)) as executor:
+            futures = [executor.submit(_bootstrap_task, gmm, b, seed, method, w, tol) for b in range(n_boot)]
+            for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+                record, fit = future.result()
+                records.append(record)
+                models[record['replicate']] = fit
+    else:
+        for b in tqdm(range(n_boot), desc=desc):
+            record, models[b] = _bootstrap_task(gmm, b, seed, method, w, tol, X=X, cov_matrices=cov_matrices)
+            records.append(record)
+
+    replicates = pd.DataFrame(records).sort_values('replicate', ignore_index=True)
+    replicates['seed'] = seed
+    return replicates, models
+
+
+def _timed_em(em, X, cov_matrices, elapsed=0.0):
+    """Run `em` to convergence one iteration at a time; cumulative (seconds, logL) per iteration."""
+    trace, start = [], time.perf_counter()
+    while not em.done:
+        em.run(X, cov_matrices, n_steps=1)
+        trace.append((elapsed + time.perf_counter() - start, em.log_L))
+    return trace
+
+
+def benchmark_stochastic_em(X, cov_matrices, n_components, sizes=(10000, 100000), batch_size=10000, n_epochs=2,
+                            kappa=0.6, target_rtol=1e-5, seed=0, w=0.1, tol=1e-6):
+    """
+    Compare full-batch and stochastic XD EM as the number of stars grows.
+
+    For each size a random subset of the stars is fitted twice from the same
+    k-means start: with full-data EM (`xd_em`) and with mini-batch EM plus
+    polishing (`xd_em.xd_stochastic_em`). The time to reach the full-batch
+    optimum within ``target_rtol`` (relative logL) is recorded for both.
+
+    Parameters
+    ----------
+    X : ndarray
+        (N, 3) velocities; sizes above N are skipped.
+    cov_matrices : ndarray
+        Per-star noise, see `xd_em.packed_noise`.
+    n_components : int
+        Number of Gaussian components.
+    sizes : sequence of int, optional
+        Numbers of stars to test.
+    batch_size, n_epochs, kappa : optional
+        Passed to `xd_em.xd_stochastic_em`.
+    target_rtol : float, optional
+        Relative logL distance to the full-batch result counted as reached.
+    seed : int, optional
+        Root seed for the subsets, initialisations and batch orders.
+    w, tol : float, optional
+        Passed to the EM.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per (n_stars, method) with ``seconds`` (total),
+        ``seconds_to_target`` (NaN if never reached), ``logL`` and
+        ``data_passes`` (full-data iterations plus stochastic epochs).
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for n_stars in sizes:
+        if n_stars > len(X):
+            continue
+        idx = np.sort(rng.choice(len(X), n_stars, replace=False))
+        X_sub, cov_sub = X[idx], cov_matrices[idx]
+        seed_seq = restart_seed(seed, n_components, 0)
+
+        em = XDEM(kmeans_start(X_sub, n_components, seed_seq), w=w, tol=tol)
+        full_trace = _timed_em(em, X_sub, cov_sub)
+        target = em.log_L - target_rtol * abs(em.log_L)
+
+        start = time.perf_counter()
+        gmm = kmeans_start(X_sub, n_components, seed_seq)
+        xd_stochastic_em(gmm, X_sub, cov_sub, batch_size=batch_size, n_epochs=n_epochs, kappa=kappa, w=w, tol=tol,
+                         maxiter=0, rng=rng)
+        stochastic = XDEM(gmm, w=w, tol=tol)
+        stochastic_trace = _timed_em(stochastic, X_sub, cov_sub, elapsed=time.perf_counter() - start)
+
+        for method, trace, passes in [('full', full_trace, 0), ('stochastic', stochastic_trace, n_epochs)]:
+            reached = [t for t, log_L in trace if log_L >= target]
+            rows.append({
+                'n_stars': n_stars,
+                'method': method,
+                'seconds': trace[-1][0],
+                'seconds_to_target': reached[0] if reached else np.nan,
+                'logL': trace[-1][1],
+                'data_passes': passes + len(trace),
+            })
+    return pd.DataFrame(rows)
@@ -0,0 +1,71 @@
+# test_batch_fitting.py
+
+import sys
+import os
+
+# Ensure the src directory is in the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from batch_fitting import default_bins, partition_catalogue, run_batch_fits
+from bic_vs_components import compute_bic_vs_n_components
+from model_store import ModelStore
+
+
+@pytest.fixture
+def catalogue():
+    rng = np.random.default_rng(8)
+    size = 150
+    X = np.concatenate([rng.normal([0, 150, 0], [40, 40, 30], (size // 2, 3)),
+                        rng.normal([0, 0, 0], [120, 80, 70], (size - size // 2, 3))])
+    return pd.DataFrame({
+        'v_R': X[:, 0], 'v_phi': X[:, 1], 'v_Z': X[:, 2],
+        'v_R_uncertainty': np.full(size, 5.0),
+        'v_phi_uncertainty': np.full(size, 5.0),
+        'v_Z_uncertainty': np.full(size, 5.0),
+        'mh_xgboost': rng.uniform(-2.5, -1.4, size),
+        'aom_xp': rng.choice([0.1, 0.35], size),
+    })
+
+
+def test_default_bins_and_partition(catalogue):
+    bins = default_bins()
+    assert len(bins) == 12
+    assert {b['name'] for b in bins} >= {'vmp', 'vmp_high', 'mp2_low'}
+
+    parts = partition_catalogue(catalogue, bins)
+    imp = catalogue[(catalogue['mh_xgboost'] >= -2.0) & (catalogue['mh_xgboost'] < -1.6)]
+    pd.testing.assert_frame_equal(parts['imp'], imp)
+    assert len(parts['imp_high']) + len(parts['imp_low']) == len(parts['imp'])
+    assert len(parts['mp2']) == 0
+
+
+def test_run_batch_fits(tmp_path, catalogue):
+    bins = [{'name': 'vmp', 'mh_range': (-3.0, -2.0), 'alpha': None},
+            {'name': 'imp_high', 'mh_range': (-2.0, -1.6), 'alpha': 'high', 'n_components': 1},
+            {'name': 'mp2', 'mh_range': (-1.3, -1.0), 'alpha': None}]
+    manifest = run_batch_fits(catalogue, bins, str(tmp_path), max_components=2, n_init=2, seed=3, n_workers=2)
+
+    sizes = [b['n_stars'] for b in manifest['bins']]
+    assert len(sizes) == 2 and sizes == sorted(sizes, reverse=True)
+    assert manifest['skipped_empty_bins'] == ['mp2']
+    with open(tmp_path / 'manifest.json') as f:
+        assert json.load(f)['parameters']['seed'] == 3
+
+    entry = next(b for b in manifest['bins'] if b['name'] == 'imp_high')
+    assert entry['n_components'] == 1
+    model = ModelStore(str(tmp_path)).load('gmm_imp_high')
+    assert model.K == 1 and model.header['seed'] == 3
+    assert entry['files']['model'] == 'gmm_imp_high.npz'
+
+    # each bin matches a standalone seeded sweep
+    df_vmp = partition_catalogue(catalogue, bins)['vmp']
+    reference = compute_bic_vs_n_components(df_vmp, max_components=2, n_init=2, seed=3)
+    with open(tmp_path / 'bic_vmp.json') as f:
+        stored = json.load(f)
+    for K in (1, 2):
+        np.testing.assert_allclose(stored[str(K)], reference[K])
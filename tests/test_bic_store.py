@@ -0,0 +1,91 @@
+# test_bic_store.py
+
+import sys
+import os
+
+# Ensure the src directory is in the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from bic_store import BICStore
+from bic_vs_components import compute_bic_vs_n_components
+
+MODELS_DIR = os.path.join(os.path.dirname(__file__), "../models")
+
+
+def mock_bin(n_samples=300, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'v_R': rng.normal(0, 50, n_samples),
+        'v_phi': rng.normal(200, 30, n_samples),
+        'v_Z': rng.normal(0, 20, n_samples),
+        'v_R_uncertainty': np.full(n_samples, 5.0),
+        'v_phi_uncertainty': np.full(n_samples, 5.0),
+        'v_Z_uncertainty': np.full(n_samples, 5.0),
+    })
+
+
+def test_summary_matches_numpy_and_survives_reload(tmp_path):
+    with open(os.path.join(MODELS_DIR, 'bic_values_vmp.json')) as f:
+        BIC_values = json.load(f)
+    store = BICStore.from_bic_values(BIC_values)
+
+    summary = store.summary()
+    for K, values in BIC_values.items():
+        row = summary.loc[int(K)]
+        assert row['n'] == len(values)
+        np.testing.assert_allclose([row['min'], row['q25'], row['median'], row['q75'], row['max']],
+                                   np.percentile(values, [0, 25, 50, 75, 100]))
+    assert store.to_bic_values() == {int(K): values for K, values in BIC_values.items()}
+
+    path = str(tmp_path / 'bic.json')
+    store.save(path)
+    loaded = BICStore.load(path)
+    pd.testing.assert_frame_equal(loaded.summary(), summary, check_dtype=False)
+    assert loaded.to_bic_values() == store.to_bic_values()
+
+
+def test_add_skips_known_restarts():
+    store = BICStore()
+    assert store.add(2, [5.0, 3.0]) == 2
+    assert store.add(2, [4.0, 1.0], restarts=[1, 2]) == 1
+    np.testing.assert_array_equal(store.values(2), [1.0, 3.0, 5.0])
+    np.testing.assert_array_equal(store.restarts(2), [0, 1, 2])
+    assert store.to_bic_values() == {2: [5.0, 3.0, 1.0]}
+
+
+def test_extending_a_sweep_matches_a_single_sweep(tmp_path):
+    df = mock_bin()
+    path = str(tmp_path / 'bic.json')
+
+    compute_bic_vs_n_components(df, max_components=2, n_init=2, seed=4, store=path)
+    extended, restarts = compute_bic_vs_n_components(df, max_components=2, n_init=4, store=path,
+                                                     return_restarts=True)
+    full = compute_bic_vs_n_components(df, max_components=2, n_init=4, seed=4)
+
+    assert sorted(restarts['restart'].unique()) == [2, 3]       # only the new restarts were fitted
+    for K in (1, 2):
+        np.testing.assert_allclose(extended[K], full[K])
+    assert BICStore.load(path).seed == 4
+
+    with pytest.raises(ValueError):
+        compute_bic_vs_n_components(df, max_components=2, n_init=4, seed=5, store=path)
+
+
+def test_store_rejects_other_settings_and_data(tmp_path):
+    df = mock_bin()
+    path = str(tmp_path / 'bic.json')
+    compute_bic_vs_n_components(df, max_components=1, n_init=1, seed=4, store=path)
+    settings = BICStore.load(path).settings
+    assert (settings['w'], settings['tol'], settings['engine']) == (0.1, 1e-6, 'pygmmis')
+    assert len(settings['data_hash']) == 64
+
+    with pytest.raises(ValueError, match='tol'):
+        compute_bic_vs_n_components(df, max_components=1, n_init=2, store=path, tol=1e-4)
+    shifted = df.assign(v_R=df['v_R'] + 1.0)
+    with pytest.raises(ValueError, match='data_hash'):
+        compute_bic_vs_n_components(shifted, max_components=1, n_init=2, store=path)
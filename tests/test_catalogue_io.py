@@ -0,0 +1,96 @@
+import sys
+import os
+
+# Ensure the src directory is in the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from astropy.table import Table
+from astropy.coordinates import Galactocentric
+
+import montecarlo_velocity
+from catalogue_io import MONTE_CARLO_INPUT_COLUMNS, CatalogueReader, ChunkStore, load_chunk_store
+from montecarlo_velocity import process_catalogue_monte_carlo, process_data_monte_carlo
+
+@pytest.fixture
+def catalogue():
+    rng = np.random.default_rng(0)
+    n = 7
+    df = pd.DataFrame({col: rng.uniform(0.01, 1.0, n) for col in MONTE_CARLO_INPUT_COLUMNS})
+    df['ra'] = rng.uniform(0, 360, n)
+    df['dec'] = rng.uniform(-60, 60, n)
+    df['rpgeo'] = rng.uniform(500, 3000, n)
+    df['rpgeo_error'] = 0.05 * df['rpgeo']
+    df['source_id'] = np.arange(n, dtype=np.int64)
+    df['unused'] = 1.0
+    return df
+
+@pytest.fixture
+def fits_path(catalogue, tmp_path):
+    path = str(tmp_path / "catalogue.fits")
+    Table.from_pandas(catalogue).write(path)
+    return path
+
+def test_reader_fits_rows_and_columns(catalogue, fits_path):
+    reader = CatalogueReader(fits_path, ['ra', 'source_id'])
+    assert reader.num_rows == len(catalogue)
+    rows = reader.read_rows(2, 5)
+    assert list(rows.columns) == ['ra', 'source_id']
+    np.testing.assert_array_equal(rows['ra'], catalogue['ra'][2:5])
+
+def test_reader_parquet_row_groups(catalogue, tmp_path):
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "catalogue.parquet")
+    catalogue.to_parquet(path, row_group_size=3)
+    rows = CatalogueReader(path, ['dec']).read_rows(2, 7)
+    np.testing.assert_array_equal(rows['dec'], catalogue['dec'][2:7])
+
+def test_store_rejects_different_parameters(tmp_path):
+    ChunkStore(str(tmp_path), {'seed': 0})
+    with pytest.raises(ValueError):
+        ChunkStore(str(tmp_path), {'seed': 1})
+
+def test_process_catalogue_resume(catalogue, fits_path, tmp_path, monkeypatch):
+    out = str(tmp_path / "out")
+    frame = Galactocentric()
+    process_catalogue_monte_carlo(fits_path, out, frame, chunk_size=3, n_samples=8, seed=5,
+                                  extra_columns=['source_id'])
+    full = load_chunk_store(out)
+
+    # Simulate an interruption after the first chunk
+    manifest_path = os.path.join(out, 'manifest.json')
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest['completed'] = [0]
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+    calls = []
+    original = montecarlo_velocity._process_chunk_monte_carlo
+    monkeypatch.setattr(montecarlo_velocity, '_process_chunk_monte_carlo',
+                        lambda df, *args, **kwargs: calls.append(len(df)) or original(df, *args, **kwargs))
+    process_catalogue_monte_carlo(fits_path, out, frame, chunk_size=3, n_samples=8, seed=5,
+                                  extra_columns=['source_id'])
+    assert calls == [3, 1]
+    resumed = load_chunk_store(out)
+    pd.testing.assert_frame_equal(full, resumed)
+
+    in_memory = process_data_monte_carlo(catalogue, frame, chunk_size=3, n_samples=8, seed=5)
+    np.testing.assert_allclose(resumed['v_phi_uncertainty'], in_memory['v_phi_uncertainty'])
+    np.testing.assert_array_equal(resumed['source_id'], catalogue['source_id'])
+
+def test_process_catalogue_checkpoint_parameters(catalogue, fits_path, tmp_path):
+    out = str(tmp_path / "out")
+    frame = Galactocentric()
+    # 7 rows in chunks of 7: a single chunk, no empty trailing one
+    process_catalogue_monte_carlo(fits_path, out, frame, chunk_size=7, n_samples=8, seed=5)
+    with open(os.path.join(out, 'manifest.json')) as f:
+        assert json.load(f)['completed'] == [0]
+    assert len(load_chunk_store(out)) == len(catalogue)
+
+    # blocked draws consume the streams in another order
+    with pytest.raises(ValueError):
+        process_catalogue_monte_carlo(fits_path, out, frame, chunk_size=7, n_samples=8, seed=5, block_size=4)
@@ -0,0 +1,86 @@
+# test_fit_cache.py
+
+import sys
+import os
+
+# Ensure the src directory is in the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import numpy as np
+import pandas as pd
+import pytest
+from pygmmis import GMM
+from fit_cache import FitCache, data_hash, fit_key
+from gmm_analysis import fit_gmm_fixed_components
+from bic_vs_components import compute_bic_vs_n_components
+
+
+def _model(K, value=0.0):
+    gmm = GMM(K=K, D=3)
+    gmm.amp[:] = 1.0 / K
+    gmm.mean[:] = value
+    gmm.covar[:] = np.eye(3)
+    return gmm
+
+
+@pytest.fixture
+def mock_df():
+    rng = np.random.default_rng(4)
+    size = 60
+    X = np.concatenate([rng.normal([0, 200, 0], [30, 20, 15], (size // 2, 3)),
+                        rng.normal([0, 0, 0], [120, 80, 70], (size // 2, 3))])
+    return pd.DataFrame({
+        'v_R': X[:, 0], 'v_phi': X[:, 1], 'v_Z': X[:, 2],
+        'v_R_uncertainty': np.full(size, 5.0),
+        'v_phi_uncertainty': np.full(size, 5.0),
+        'v_Z_uncertainty': np.full(size, 5.0),
+    })
+
+
+def test_keys_depend_on_data_and_settings():
+    X = np.arange(12.0).reshape(4, 3)
+    cov = np.ones((4, 3, 3))
+    digest = data_hash(X, cov)
+    assert digest == data_hash(X.copy(), cov.copy())
+    assert digest != data_hash(X + 1e-9, cov)
+
+    key = fit_key(digest, 2, 0, 7, w=0.1, tol=1e-6)
+    assert key == fit_key(digest, 2, 0, 7, tol=1e-6, w=0.1)
+    assert key != fit_key(digest, 2, 0, 7, w=0.2, tol=1e-6)
+    assert key != fit_key(digest, 2, 1, 7, w=0.1, tol=1e-6)
+
+
+@pytest.mark.parametrize("on_disk", [False, True])
+def test_lru_eviction_by_size(tmp_path, on_disk):
+    cache = FitCache(str(tmp_path) if on_disk else None)
+    cache.put('a', {'logL': -1.0, 'n_iter': 3, 'seconds': 0.1}, _model(2))
+    entry_size = cache.nbytes
+    cache.max_bytes = int(2.5 * entry_size)
+
+    cache.put('b', {'logL': -2.0, 'n_iter': 3, 'seconds': 0.1}, _model(2))
+    assert cache.get('a') is not None      # 'a' is now the most recently used
+    cache.put('c', {'logL': -3.0, 'n_iter': 3, 'seconds': 0.1}, _model(2))
+
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+    assert cache.nbytes <= cache.max_bytes
+    record, gmm = cache.get('c')
+    assert record == {'logL': -3.0, 'n_iter': 3, 'seconds': 0.1}
+    np.testing.assert_array_equal(gmm.covar, _model(2).covar)
+
+
+def test_bic_sweep_feeds_final_fit(tmp_path, mock_df):
+    directory = str(tmp_path / 'cache')
+    bic, sweep = compute_bic_vs_n_components(mock_df, max_components=2, n_init=3, seed=11, cache=directory,
+                                             return_restarts=True)
+    assert not sweep['cached'].any()
+
+    # a fresh cache object on the same directory, as after a kernel restart
+    cache = FitCache(directory)
+    assert len(cache) == 6
+    gmm, restarts = fit_gmm_fixed_components(mock_df, 2, n_init=3, seed=11, cache=cache, return_restarts=True)
+    assert restarts['cached'].all()
+    assert cache.hits == 3 and cache.misses == 0
+    np.testing.assert_allclose(restarts['logL'], sweep.loc[sweep['K'] == 2, 'logL'])
+
+    reference = fit_gmm_fixed_components(mock_df, 2, n_init=3, seed=11)
+    np.testing.assert_allclose(gmm.mean, reference.mean)
@@ -0,0 +1,45 @@
+import sys
+import os
+
+# Ensure the src directory is in the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import numpy as np
+import astropy.units as u
+import pytest
+from astropy.coordinates import Galactocentric
+
+from galactocentric_transform import galactocentric_frame_parameters, icrs_to_galactocentric_cylindrical
+from montecarlo_velocity import compute_velocity_components_with_uncertainty
+
+@pytest.fixture
+def random_astrometry():
+    rng = np.random.default_rng(1)
+    n = 300
+    return (rng.uniform(0, 360, n), rng.uniform(-89, 89, n), rng.uniform(10, 20000, n),
+            rng.normal(0, 20, n), rng.normal(0, 20, n), rng.normal(0, 200, n))
+
+@pytest.mark.parametrize("gc_frame", [
+    Galactocentric(),
+    Galactocentric(galcen_distance=8.0 * u.kpc, z_sun=100 * u.pc, roll=3 * u.deg),
+])
+def test_matches_astropy(random_astrometry, gc_frame):
+    ra, dec, d, pmra, pmdec, vlos = random_astrometry
+    expected = compute_velocity_components_with_uncertainty(
+        ra * u.deg, dec * u.deg, d * u.pc, pmra * u.mas/u.yr, pmdec * u.mas/u.yr, vlos * u.km/u.s, gc_frame
+    )
+    result = icrs_to_galactocentric_cylindrical(ra, dec, d, pmra, pmdec, vlos, gc_frame)
+    for r, e in zip(result, expected):
+        np.testing.assert_allclose(r, e, rtol=0, atol=1e-8)
+
+def test_block_shape_and_nan(random_astrometry):
+    ra, dec, d, pmra, pmdec, vlos = (np.tile(a[:, None], (1, 4)) for a in random_astrometry)
+    d[0, 1] = np.nan
+    v_R, v_phi, v_Z = icrs_to_galactocentric_cylindrical(ra, dec, d, pmra, pmdec, vlos, Galactocentric())
+    assert v_R.shape == v_phi.shape == v_Z.shape == ra.shape
+    assert np.isnan(v_R[0, 1]) and np.isfinite(v_R[0, 0])
+
+def test_frame_parameters_rotation():
+    A, offset, v_sun = galactocentric_frame_parameters(Galactocentric())
+    np.testing.assert_allclose(A @ A.T, np.eye(3), atol=1e-12)
+    assert offset.shape == v_sun.shape == (3,)
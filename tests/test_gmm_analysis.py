@@ -11,7 +11,8 @@ import pandas as pd
 import pytest
 import matplotlib.pyplot as plt
 from pygmmis import GMM
-from gmm_analysis import fit_gmm_fixed_components, extract_gmm_parameters, plot_gmm_with_contributions
+from gmm_analysis import (fit_gmm_fixed_components, extract_gmm_parameters, plot_gmm_with_contributions,
+                          bootstrap_gmm_parameters)
 
 @pytest.fixture
 def mock_df():
@@ -59,3 +60,31 @@ def test_plot_gmm_with_contributions_runs(mock_df, monkeypatch):
         )
     except Exception as e:
         pytest.fail(f"Plotting failed with error: {e}")
+
+def test_fit_gmm_fixed_components_packed_covariance(mock_df):
+    """Test that fitting accepts the packed (N, 6) covariance layout."""
+    packed = np.zeros((len(mock_df), 6))
+    packed[:, :3] = mock_df[['v_R_uncertainty', 'v_phi_uncertainty', 'v_Z_uncertainty']].values**2
+    packed[:, 3] = 0.5 * packed[:, 0]
+    gmm = fit_gmm_fixed_components(mock_df, n_components=2, n_init=2, covariance=packed)
+    assert gmm.K == 2
+    assert np.all(np.isfinite(gmm.mean))
+
+def test_bootstrap_gmm_parameters(mock_df):
+    """Test that bootstrap intervals bracket the fit and print through extract_gmm_parameters."""
+    gmm = fit_gmm_fixed_components(mock_df, n_components=2, n_init=2, seed=0)
+    intervals, replicates = bootstrap_gmm_parameters(mock_df, gmm, n_boot=8, seed=1, return_replicates=True)
+
+    assert len(intervals) == 2 * 7
+    assert len(replicates) == 8 * 2
+    assert (intervals['lower'] <= intervals['upper']).all()
+    assert (intervals['std'] > 0).all()
+
+    parallel = bootstrap_gmm_parameters(mock_df, gmm, n_boot=8, seed=1, n_workers=2)
+    pd.testing.assert_frame_equal(parallel, intervals)
+
+    poisson = bootstrap_gmm_parameters(mock_df, gmm, n_boot=4, method="poisson", seed=1)
+    assert np.isfinite(poisson['std']).all()
+
+    output = extract_gmm_parameters(gmm, mock_df, label="test", uncertainties=intervals)
+    assert "+" in output and "/-" in output
@@ -0,0 +1,76 @@
+# test_membership.py
+
+import sys
+import os
+
+# Ensure the src directory is in the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import numpy as np
+import pandas as pd
+import pytest
+from pygmmis import GMM
+from scipy.special import softmax
+from membership import membership_probabilities, score_membership
+from model_store import ModelStore
+from velocity_covariance import unpack_covariance
+from xd_em import component_log_likelihoods, xd_log_likelihood
+
+
+@pytest.fixture
+def gmm():
+    model = GMM(K=3, D=3)
+    model.amp[:] = [0.2, 0.5, 0.3]
+    model.mean[:] = [[0, 180, 0], [10, 0, -5], [-20, 30, 10]]
+    rng = np.random.default_rng(0)
+    for k in range(3):
+        A = rng.normal(size=(3, 3))
+        model.covar[k] = A @ A.T * 400 + np.eye(3) * 100
+    return model
+
+
+@pytest.fixture
+def data(gmm):
+    rng = np.random.default_rng(1)
+    X = gmm.draw(500, rng=np.random.RandomState(1))
+    variances = rng.uniform(2, 20, (len(X), 3))**2
+    return X, variances
+
+
+@pytest.mark.parametrize("noise_layout", ["diagonal", "packed", "dense"])
+def test_matches_xd_likelihood(gmm, data, noise_layout):
+    X, variances = data
+    packed = np.zeros((len(X), 6))
+    packed[:, :3] = variances
+    if noise_layout != "diagonal":
+        packed[:, 3] = 0.4 * np.sqrt(variances[:, 0] * variances[:, 1])
+    noise = packed
+    if noise_layout == "dense":
+        noise = unpack_covariance(packed)
+
+    probabilities, log_like = membership_probabilities(gmm, X, noise, chunk_size=64, return_log_likelihood=True)
+
+    np.testing.assert_allclose(probabilities, softmax(component_log_likelihoods(gmm, X, noise), axis=1),
+                               atol=1e-12)
+    np.testing.assert_allclose(log_like, xd_log_likelihood(gmm, X, noise), rtol=1e-12)
+    np.testing.assert_allclose(probabilities.sum(axis=1), 1)
+
+    threaded = membership_probabilities(gmm, X, noise, chunk_size=64, n_threads=3)
+    np.testing.assert_array_equal(threaded, probabilities)
+
+
+def test_score_membership_columns(gmm, data, tmp_path):
+    X, variances = data
+    df = pd.DataFrame({'v_R': X[:, 0], 'v_phi': X[:, 1], 'v_Z': X[:, 2],
+                       'v_R_uncertainty': np.sqrt(variances[:, 0]),
+                       'v_phi_uncertainty': np.sqrt(variances[:, 1]),
+                       'v_Z_uncertainty': np.sqrt(variances[:, 2])})
+    df.loc[0, 'v_R'] = np.nan
+
+    stored = ModelStore(str(tmp_path)).save('gmm_test', gmm)
+    score_membership(df, stored, names={'Disc': 0, 'GS/E 1': 1}, log_likelihood_column='logL')
+
+    assert {'P_Disc', 'P_GS/E 1', 'logL'} <= set(df.columns)
+    expected = membership_probabilities(gmm, X[1:], variances[1:])
+    np.testing.assert_allclose(df['P_GS/E 1'].values[1:], expected[:, 1])
+    assert np.isnan(df.loc[0, 'P_Disc'])
@@ -0,0 +1,82 @@
+# test_model_store.py
+
+import sys
+import os
+
+# Ensure the src directory is in the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import json
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+from pygmmis import GMM
+from model_store import FORMAT_VERSION, ModelStore
+from gmm_analysis import extract_gmm_parameters
+
+MODELS_DIR = os.path.join(os.path.dirname(__file__), "../models")
+
+
+@pytest.fixture
+def gmm():
+    model = GMM(K=2, D=3)
+    model.amp[:] = [0.3, 0.7]
+    model.mean[:] = [[0, 180, 0], [10, 0, -5]]
+    model.covar[:] = [np.diag([70.0, 50.0, 60.0])**2, np.diag([150.0, 100.0, 90.0])**2]
+    return model
+
+
+def test_save_list_and_lazy_load(tmp_path, gmm):
+    store = ModelStore(str(tmp_path))
+    store.save('gmm_test', gmm, logL=-123.5, w=0.1, tol=1e-6, data_hash='abc')
+
+    listing = store.list()
+    assert listing.loc['gmm_test', 'K'] == 2
+    assert listing.loc['gmm_test', 'logL'] == -123.5
+    assert listing.loc['gmm_test', 'format_version'] == FORMAT_VERSION
+
+    model = store.load('gmm_test')
+    assert model._arrays is None          # header only so far
+    np.testing.assert_array_equal(model.covar, gmm.covar)
+    assert model.to_pygmmis().K == 2
+
+    # plain numpy can read the file
+    with np.load(tmp_path / 'gmm_test.npz') as f:
+        assert json.loads(str(f['__header__']))['data_hash'] == 'abc'
+
+    with pytest.raises(KeyError):
+        store.load('missing')
+
+
+def test_stored_model_is_a_drop_in_replacement(tmp_path, gmm):
+    model = ModelStore(str(tmp_path)).save('gmm_test', gmm)
+
+    df = pd.DataFrame({'v_R': np.zeros(10)})
+    assert extract_gmm_parameters(model, df, 'test') == extract_gmm_parameters(gmm, df, 'test')
+
+    draws = model.draw(50, rng=np.random.RandomState(1))
+    np.testing.assert_array_equal(draws, gmm.draw(50, rng=np.random.RandomState(1)))
+
+
+def test_newer_format_is_rejected(tmp_path, gmm):
+    store = ModelStore(str(tmp_path))
+    store.save('gmm_test', gmm, format_version=FORMAT_VERSION + 1)
+    with pytest.raises(ValueError):
+        store.load('gmm_test')
+
+
+def test_repository_models_match_pickles():
+    store = ModelStore(MODELS_DIR)
+    assert len(store.names()) == 12
+    for name in store.names():
+        model = store.load(name)
+        with open(os.path.join(MODELS_DIR, f'{name}.pkl'), 'rb') as f:
+            reference = pickle.load(f)
+        np.testing.assert_array_equal(model.mean, reference.mean)
+        assert model.header['source'] == f'{name}.pkl'
+        assert model.header['engine'] == 'pygmmis'
+        assert (model.header['w'], model.header['tol']) == (0.1, 1e-6)
+        assert model.header['n_init'] in (50, 100)
+        assert model.header['logL'] is None and model.header['data_hash'] is None
@@ -8,13 +8,19 @@ import numpy as np
 import pandas as pd
 import astropy.units as u
 import pytest
+import tracemalloc
 from astropy.coordinates import Galactocentric
 
 from montecarlo_velocity import (
     generate_monte_carlo_samples,
     compute_velocity_components_with_uncertainty,
     compute_velocity_components_for_samples,
-    process_data_monte_carlo
+    process_data_monte_carlo,
+    process_data_linearized,
+    standard_normal_block,
+    benchmark_sampler_convergence,
+    estimate_chunk_size,
+    compare_float32_accuracy
 )
 
 @pytest.fixture
@@ -66,4 +72,118 @@ def test_process_data_monte_carlo_output(dummy_data, galactocentric_frame):
     assert 'v_phi_uncertainty' in df_out.columns
     assert 'v_Z_uncertainty' in df_out.columns
     assert len(df_out) == len(dummy_data)
+    np.testing.assert_allclose(df_out['v_phi_v_phi_cov'], df_out['v_phi_uncertainty']**2)
+    assert 'v_R_v_phi_cov' in df_out.columns
 
+
+def test_generate_monte_carlo_samples_pm_correlation(dummy_data):
+    np.random.seed(0)
+    df = dummy_data.assign(pmra_pmdec_corr=[0.8, -0.5])
+    _, _, _, pmra_s, pmdec_s, _ = generate_monte_carlo_samples(df, 20000, correlation_pmra_pmdec=None)
+    assert pmra_s.shape == pmdec_s.shape == (2, 20000)
+    measured = [np.corrcoef(pmra_s[i], pmdec_s[i])[0, 1] for i in range(2)]
+    assert np.allclose(measured, [0.8, -0.5], atol=0.02)
+    assert np.allclose(pmdec_s.std(axis=1), df['pmdec_error'], rtol=0.02)
+
+def test_compute_velocity_components_for_samples_methods_agree(dummy_data, galactocentric_frame):
+    np.random.seed(1)
+    samples = generate_monte_carlo_samples(dummy_data, 6, correlation_pmra_pmdec=0.0)
+    fast = compute_velocity_components_for_samples(*samples, galactocentric_frame)
+    reference = compute_velocity_components_for_samples(*samples, galactocentric_frame, method="astropy")
+    for f, r in zip(fast, reference):
+        np.testing.assert_allclose(f, r, rtol=0, atol=1e-8)
+
+def test_process_data_linearized_matches_monte_carlo(dummy_data, galactocentric_frame):
+    np.random.seed(2)
+    df = dummy_data.assign(parallax_error=1e-6)
+    df_lin, cov = process_data_linearized(df, galactocentric_frame, correlation_pmra_pmdec=0.2)
+    df_mc = process_data_monte_carlo(df, galactocentric_frame, n_samples=20000, correlation_pmra_pmdec=0.2)
+    assert cov.shape == (2, 3, 3)
+    assert not df_lin['linearization_unsafe'].any()
+    for col in ['v_R_uncertainty', 'v_phi_uncertainty', 'v_Z_uncertainty']:
+        np.testing.assert_allclose(df_lin[col], df_mc[col], rtol=0.03)
+
+def test_process_data_linearized_fallback(dummy_data, galactocentric_frame):
+    df = dummy_data.assign(rpgeo_error=[10.0, 600.0])
+    df_lin, cov = process_data_linearized(df, galactocentric_frame, max_fractional_distance_error=0.1, n_samples=50)
+    assert list(df_lin['linearization_unsafe']) == [False, True]
+    np.testing.assert_allclose(np.sqrt(cov[:, 1, 1]), df_lin['v_phi_uncertainty'])
+
+def test_process_data_linearized_fallback_seeded(dummy_data, galactocentric_frame):
+    df = dummy_data.assign(rpgeo_error=[600.0, 900.0])
+    _, cov = process_data_linearized(df, galactocentric_frame, n_samples=50, chunk_size=1, seed=4)
+    _, again = process_data_linearized(df, galactocentric_frame, n_samples=50, chunk_size=1, seed=4)
+    _, other = process_data_linearized(df, galactocentric_frame, n_samples=50, chunk_size=1, seed=5)
+    np.testing.assert_array_equal(cov, again)
+    assert not np.allclose(cov, other)
+
+def test_process_data_monte_carlo_streaming(dummy_data, galactocentric_frame):
+    df_out = process_data_monte_carlo(dummy_data, galactocentric_frame, n_samples=25, block_size=7)
+    assert np.all(df_out['v_R_uncertainty'] > 0)
+    np.testing.assert_allclose(df_out['v_Z_v_Z_cov'], df_out['v_Z_uncertainty']**2)
+
+def test_process_data_monte_carlo_seeded_workers(dummy_data, galactocentric_frame):
+    df = pd.concat([dummy_data] * 3, ignore_index=True)
+    serial = process_data_monte_carlo(df, galactocentric_frame, chunk_size=2, n_samples=10, seed=7)
+    parallel = process_data_monte_carlo(df, galactocentric_frame, chunk_size=2, n_samples=10, seed=7, n_workers=2)
+    pd.testing.assert_frame_equal(serial, parallel)
+    assert not serial['v_R_uncertainty'].duplicated().any()
+
+def test_process_data_monte_carlo_adaptive(dummy_data, galactocentric_frame):
+    df = dummy_data.assign(rpgeo_error=[10.0, 900.0])
+    df_out = process_data_monte_carlo(df, galactocentric_frame, n_samples=500, seed=3,
+                                      adaptive_rtol=0.05, adaptive_atol=0.5, block_size=25)
+    n_used = df_out['n_mc_samples'].values
+    assert n_used[0] < n_used[1] <= 500
+    assert np.all(df_out['v_R_uncertainty'] > 0)
+
+@pytest.mark.parametrize("sampler", ["sobol", "lhs"])
+def test_standard_normal_block_quasi_random(sampler):
+    z = standard_normal_block(50, 64, 6, sampler=sampler, rng=np.random.default_rng(0))
+    assert z.shape == (6, 50, 64)
+    assert np.all(np.isfinite(z))
+    np.testing.assert_allclose(z.mean(axis=2), 0, atol=0.05)
+    np.testing.assert_allclose(z.std(axis=2), 1, atol=0.1)
+    assert abs(np.corrcoef(z[0, 0], z[0, 1])[0, 1]) < 0.5
+
+def test_benchmark_sobol_beats_random(dummy_data, galactocentric_frame):
+    table = benchmark_sampler_convergence(dummy_data, galactocentric_frame, sample_counts=(64,),
+                                          n_repeats=5, reference_samples=5000, correlation_pmra_pmdec=0.3)
+    errors = table.set_index('sampler')['rms_relative_error']
+    assert errors['sobol'] < errors['random']
+
+def test_estimate_chunk_size():
+    full = estimate_chunk_size('1GB', n_samples=100)
+    assert estimate_chunk_size(10**9, n_samples=100) == full
+    assert estimate_chunk_size('1GB', n_samples=100, dtype=np.float32) > 1.9 * full
+    assert estimate_chunk_size('1GB', n_samples=100, block_size=10) > 8 * full
+    assert estimate_chunk_size(1, n_samples=100) == 1
+
+@pytest.mark.parametrize("sampler", ["random", "sobol", "lhs"])
+def test_float32_samples_peak_memory(sampler):
+    # the float32 path must not go through float64 sample cubes
+    n_stars, n_samples = 2000, 128
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({col: rng.uniform(1, 50, n_stars) for col in
+                       ['ra', 'dec', 'rpgeo', 'pmra', 'pmdec', 'radial_velocity', 'parallax_error',
+                        'pmra_error', 'pmdec_error', 'rpgeo_error', 'radial_velocity_error']})
+    peaks = {}
+    for dtype in (np.float64, np.float32):
+        tracemalloc.start()
+        samples = generate_monte_carlo_samples(df, n_samples, 0.1, rng=np.random.default_rng(0),
+                                               sampler=sampler, dtype=dtype)
+        peaks[dtype] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert all(s.dtype == dtype for s in samples)
+        del samples
+    cube = n_stars * n_samples * 4
+    assert peaks[np.float32] < 0.52 * peaks[np.float64]
+    assert peaks[np.float32] < 14 * cube
+
+def test_float32_matches_float64(dummy_data, galactocentric_frame):
+    diffs = compare_float32_accuracy(dummy_data, galactocentric_frame, n_samples=50)
+    assert diffs['max_rel_std_diff'] < 1e-3
+    df_out = process_data_monte_carlo(dummy_data, galactocentric_frame, n_samples=20, memory_budget='1MB',
+                                      dtype=np.float32, seed=0)
+    assert df_out['v_R_uncertainty'].dtype == np.float64
+    assert len(df_out) == len(dummy_data)
@@ -8,6 +8,11 @@ import numpy as np
 import pandas as pd
 from pygmmis import GMM
 from residual_analysis import (
+    NoiseModel,
+    disc_2sigma,
+    disc_mean_3d,
+    ellipse_probability,
+    expected_disc_probabilities,
     inside_ellipse,
     assign_uncertainties,
     compute_residual_map,
@@ -65,3 +70,91 @@ def test_plotting_functions(mock_df, simple_gmm):
 
     results = run_residual_analysis(mock_df, simple_gmm, [0.0, 0.3], n_realizations=5)
     plot_disc_fraction([0.0, 0.3], results, name="Test")
+
+def test_noise_model_stacked_realizations(mock_df):
+    obs = mock_df[['v_R', 'v_phi', 'v_Z']].values
+    err = mock_df[['v_R_uncertainty', 'v_phi_uncertainty', 'v_Z_uncertainty']].values
+    noise_model = NoiseModel(obs, err)
+
+    mocks = np.stack([obs + 1.0, obs - 1.0])
+    assert noise_model.assign(mocks).shape == (2, len(obs), 3)
+    np.testing.assert_array_equal(noise_model.errors(mocks)[0], err)
+
+def test_disc_counts_match_perturbing_every_star(mock_df, simple_gmm):
+    obs = mock_df[['v_R', 'v_phi', 'v_Z']].values
+    err = mock_df[['v_R_uncertainty', 'v_phi_uncertainty', 'v_Z_uncertainty']].values * 10
+    noise_model = NoiseModel(obs, err)
+    draw = lambda size, rng: simple_gmm.draw(size, rng=rng)
+
+    counts = noise_model.disc_counts(draw, 50, 12, rng=np.random.RandomState(3), block_size=200)
+
+    rng = np.random.RandomState(3)
+    expected = []
+    for _ in range(3):  # blocks of 4 mocks of 50 stars
+        stars = draw(200, rng)
+        stars = stars[rng.permutation(200)]
+        noisy = rng.normal(stars[:, :2], noise_model.errors(stars)[:, :2])
+        inside = inside_ellipse(noisy[:, 0], noisy[:, 1], disc_mean_3d[:2], *disc_2sigma)
+        expected.extend(inside.reshape(4, 50).sum(axis=1))
+    np.testing.assert_array_equal(counts, expected)
+
+def test_common_random_numbers_sweep(mock_df, simple_gmm):
+    fractions = [0.0, 0.1, 0.3]
+    serial = run_residual_analysis(mock_df, simple_gmm, fractions, n_realizations=6,
+                                   common_random_numbers=True, seed=2)
+    parallel = run_residual_analysis(mock_df, simple_gmm, fractions, n_realizations=6,
+                                     common_random_numbers=True, seed=2, n_workers=2)
+    assert serial == parallel
+
+    obs_mean, obs_std, frac_means, frac_stds = serial
+    # the baseline is shared, so without injection the residual vanishes
+    assert frac_means[0] == 0 and frac_stds[0] == 0
+    assert frac_means[0] <= frac_means[1] <= frac_means[2]
+
+    independent = run_residual_analysis(mock_df, simple_gmm, fractions, n_realizations=6, seed=2)
+    assert independent == run_residual_analysis(mock_df, simple_gmm, fractions, n_realizations=6, seed=2)
+
+def test_ellipse_probability_matches_sampling():
+    rng = np.random.default_rng(0)
+    means = np.array([[10.0, 150.0], [200.0, -50.0], [0.0, 180.0], [139.0, 180.0]])
+    covs = np.array([[[900, 300], [300, 400]], [[1e4, 0], [0, 2500]], [[4, 0], [0, 2]], [[4, 1], [1, 2]]],
+                    dtype=float)
+    probabilities = ellipse_probability(means, covs, disc_mean_3d[:2], disc_2sigma)
+    for mean, cov, p in zip(means, covs, probabilities):
+        y = rng.multivariate_normal(mean, cov, 200000)
+        assert p == pytest.approx(inside_ellipse(y[:, 0], y[:, 1], disc_mean_3d[:2], *disc_2sigma).mean(),
+                                  abs=5e-3)
+
+def test_analytic_mode_matches_monte_carlo(mock_df, simple_gmm):
+    fractions = [0.0, 0.1, 0.3]
+    analytic = run_residual_analysis(mock_df, simple_gmm, fractions, analytic=True)
+    mc = run_residual_analysis(mock_df, simple_gmm, fractions, n_realizations=400, seed=0)
+
+    assert analytic[0] == pytest.approx(mc[0], abs=3 * mc[1] / np.sqrt(400) + 0.01)
+    assert analytic[1] == pytest.approx(mc[1], rel=0.2, abs=0.01)
+    np.testing.assert_allclose(analytic[2], mc[2], atol=2.0)
+    np.testing.assert_allclose(analytic[3], mc[3], rtol=0.2, atol=0.5)
+
+@pytest.mark.parametrize("errors_grow, tolerance", [(False, 1e-3), (True, 4e-3)])
+def test_expected_disc_probabilities_match_nearest_neighbour_mocks(errors_grow, tolerance):
+    rng = np.random.RandomState(42)
+    gmm = GMM(K=2, D=3)
+    gmm.mean = np.array([[0.0, 180.0, 0.0], [0.0, 20.0, 0.0]])
+    gmm.covar = np.array([np.diag([60.0, 40.0, 50.0])**2, np.diag([150.0, 80.0, 90.0])**2])
+    gmm.amp = np.array([0.6, 0.4])
+    obs_stars = gmm.draw(2000, rng=rng)
+    if errors_grow:
+        obs_errors = (5 + 0.2 * np.abs(obs_stars - disc_mean_3d)) * rng.uniform(0.5, 1.5, (2000, 3))
+    else:
+        obs_errors = rng.uniform(2, 5, (2000, 3))
+    obs_stars = obs_stars + rng.normal(0, obs_errors)
+
+    p_gmm, p_disc = expected_disc_probabilities(gmm, obs_stars, obs_errors)
+    noise = NoiseModel(obs_stars, obs_errors)
+    n_mock = 1_000_000
+    mc_gmm = noise.inside_disc(gmm.draw(n_mock, rng=rng), rng).mean()
+    disc = rng.normal(disc_mean_3d, [70, 50, 60], (n_mock, 3))
+    mc_disc = noise.inside_disc(disc, rng).mean()
+    # the statistical error of the mocks is below 5e-4
+    assert p_gmm == pytest.approx(mc_gmm, abs=tolerance)
+    assert p_disc == pytest.approx(mc_disc, abs=tolerance)
@@ -0,0 +1,60 @@
+import sys
+import os
+
+# Ensure the src directory is in the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from velocity_covariance import (
+    VELOCITY_COVARIANCE_COLUMNS,
+    RunningVelocityMoments,
+    pack_covariance,
+    unpack_covariance,
+    velocity_covariance_stack
+)
+
+@pytest.fixture
+def random_covariances():
+    rng = np.random.default_rng(0)
+    L = rng.normal(size=(10, 3, 3))
+    return L @ L.transpose(0, 2, 1)
+
+def test_pack_unpack_roundtrip(random_covariances):
+    packed = pack_covariance(random_covariances)
+    assert packed.shape == (10, 6)
+    np.testing.assert_array_equal(unpack_covariance(packed), random_covariances)
+
+def test_stack_from_uncertainties():
+    df = pd.DataFrame({'v_R_uncertainty': [1.0, 2.0], 'v_phi_uncertainty': [3.0, 4.0], 'v_Z_uncertainty': [5.0, 6.0]})
+    cov = velocity_covariance_stack(df)
+    np.testing.assert_array_equal(cov[1], np.diag([4.0, 16.0, 36.0]))
+
+def test_stack_prefers_covariance_columns(random_covariances):
+    df = pd.DataFrame(pack_covariance(random_covariances), columns=VELOCITY_COVARIANCE_COLUMNS)
+    np.testing.assert_allclose(velocity_covariance_stack(df), random_covariances)
+    with pytest.raises(ValueError):
+        velocity_covariance_stack(df, covariance=np.zeros((10, 4)))
+
+def test_running_moments_match_batch():
+    rng = np.random.default_rng(1)
+    v = rng.normal([10.0, 200.0, -5.0], [30.0, 20.0, 10.0], size=(50, 103, 3)).transpose(2, 0, 1)
+    moments = RunningVelocityMoments(50)
+    for start in range(0, 103, 10):
+        moments.update(*(c[:, start:start + 10] for c in v))
+    assert np.all(moments.count == 103)
+    np.testing.assert_allclose(moments.std, np.stack([c.std(axis=1) for c in v], axis=1), rtol=1e-12)
+    expected = [np.cov(v[:, i], bias=True) for i in range(50)]
+    np.testing.assert_allclose(unpack_covariance(moments.packed_covariance), expected, rtol=1e-10)
+
+def test_running_moments_row_subsets():
+    rng = np.random.default_rng(2)
+    v = rng.normal(size=(3, 4, 30))
+    moments = RunningVelocityMoments(4, full_covariance=False)
+    moments.update(*(c[:, :10] for c in v))
+    moments.update(*(c[[1, 3], 10:] for c in v), rows=[1, 3])
+    assert list(moments.count) == [10, 30, 10, 30]
+    np.testing.assert_allclose(moments.std[1], v[:, 1].std(axis=1))
+    np.testing.assert_allclose(moments.std[0], v[:, 0, :10].std(axis=1))
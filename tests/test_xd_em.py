@@ -0,0 +1,105 @@
+# test_xd_em.py
+
+import sys
+import os
+
+# Ensure the src directory is in the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import numpy as np
+import pytest
+import pygmmis
+from xd_em import packed_noise, xd_em, xd_log_likelihood, xd_stochastic_em
+from xd_fitting import restart_seed, xd_restart
+from velocity_covariance import unpack_covariance
+
+
+@pytest.fixture
+def mock_data():
+    rng = np.random.default_rng(0)
+    size = 200
+    X = np.concatenate([rng.normal([0, 200, 0], [30, 20, 15], (size // 2, 3)),
+                        rng.normal([0, 0, 0], [120, 80, 70], (size // 2, 3))])
+    err = rng.uniform(2, 10, (size, 3))
+    rho = rng.uniform(-0.5, 0.5, (size, 3))
+    packed = np.column_stack([err**2, rho[:, 0] * err[:, 0] * err[:, 1],
+                              rho[:, 1] * err[:, 0] * err[:, 2], rho[:, 2] * err[:, 1] * err[:, 2]])
+    return X, err**2, packed
+
+
+def _kmeans_pair(X, K):
+    gmm = pygmmis.GMM(K=K, D=3)
+    np.random.seed(1)
+    pygmmis.initFromKMeans(gmm, X)
+    copy = pygmmis.GMM(K=K, D=3)
+    copy.amp[:], copy.mean[:], copy.covar[:] = gmm.amp, gmm.mean, gmm.covar
+    return gmm, copy
+
+
+@pytest.mark.parametrize("full_noise", [False, True])
+def test_xd_em_matches_pygmmis(mock_data, full_noise):
+    X, variances, packed = mock_data
+    noise = packed if full_noise else variances
+    cov = unpack_covariance(packed) if full_noise else unpack_covariance(np.column_stack([variances, np.zeros_like(variances)]))
+
+    reference, native = _kmeans_pair(X, 2)
+    logL_ref, _ = pygmmis.fit(reference, X, covar=cov, w=0.1, tol=1e-6, init_method='none')
+    logL, n_iter = xd_em(native, X, noise, w=0.1, tol=1e-6, chunk_size=64)
+
+    assert n_iter > 1
+    np.testing.assert_allclose(logL, logL_ref, rtol=1e-10)
+    np.testing.assert_allclose(native.mean, reference.mean, atol=1e-6)
+    np.testing.assert_allclose(native.covar, reference.covar, rtol=1e-6)
+    np.testing.assert_allclose(xd_log_likelihood(native, X, cov), native.logL(X, covar=cov), rtol=1e-10)
+
+
+def test_engines_agree(mock_data):
+    X, variances, _ = mock_data
+    cov = unpack_covariance(np.column_stack([variances, np.zeros_like(variances)]))
+    _, logL_np, _ = xd_restart(X, cov, 2, restart_seed(3, 2, 0), engine="numpy")
+    _, logL_pg, _ = xd_restart(X, cov, 2, restart_seed(3, 2, 0), engine="pygmmis")
+    np.testing.assert_allclose(logL_np, logL_pg, rtol=1e-8)
+
+    with pytest.raises(ValueError):
+        xd_restart(X, cov, 2, restart_seed(3, 2, 0), engine="sklearn")
+
+
+def test_pygmmis_iteration_count_fails_loudly(mock_data, monkeypatch):
+    X, variances, _ = mock_data
+    cov = unpack_covariance(np.column_stack([variances, np.zeros_like(variances)]))
+    _, _, n_iter = xd_restart(X, cov, 2, restart_seed(3, 2, 0), engine="pygmmis")
+    assert n_iter > 1
+    assert pygmmis._EMstep.__name__ == '_EMstep'  # the wrapper is removed again
+
+    monkeypatch.delattr(pygmmis, '_EMstep')
+    with pytest.raises(RuntimeError):
+        xd_restart(X, cov, 2, restart_seed(3, 2, 0), engine="pygmmis")
+
+
+def test_packed_noise_shapes(mock_data):
+    _, variances, packed = mock_data
+    diag, off = packed_noise(unpack_covariance(np.column_stack([variances, np.zeros_like(variances)])))
+    assert off is None
+    np.testing.assert_array_equal(diag, variances)
+
+    diag, off = packed_noise(packed)
+    np.testing.assert_array_equal(off, packed[:, 3:])
+
+    with pytest.raises(ValueError):
+        packed_noise(np.ones((5, 4)))
+
+
+def test_stochastic_em_reaches_full_batch_optimum(mock_data):
+    X, variances, packed = mock_data
+    full, stochastic = _kmeans_pair(X, 2)
+    logL, _ = xd_em(full, X, packed, w=0.1, tol=1e-8)
+    logL_sto, n_iter, n_steps = xd_stochastic_em(stochastic, X, packed, batch_size=50, n_epochs=2, w=0.1,
+                                                 tol=1e-8, rng=0)
+
+    assert n_steps == 8
+    assert n_iter > 0
+    np.testing.assert_allclose(logL_sto, logL, rtol=1e-6)
+    np.testing.assert_allclose(np.sort(stochastic.mean[:, 1]), np.sort(full.mean[:, 1]), atol=0.5)
+
+    with pytest.raises(ValueError):
+        xd_stochastic_em(stochastic, X, packed, kappa=0.4)
@@ -0,0 +1,159 @@
+# test_xd_fitting.py
+
+import sys
+import os
+
+# Ensure the src directory is in the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import numpy as np
+import pandas as pd
+import pytest
+from xd_fitting import (run_xd_restarts, best_restart, successive_halving_restarts, split_component,
+                        benchmark_stochastic_em, stratified_folds, restart_seed, fold_seed, bootstrap_seed)
+from velocity_covariance import velocity_covariance_stack
+from gmm_analysis import fit_gmm_fixed_components
+from bic_vs_components import compute_bic_vs_n_components, compute_cv_vs_n_components
+
+
+@pytest.fixture
+def mock_df():
+    rng = np.random.default_rng(1)
+    size = 60
+    X = np.concatenate([rng.normal([0, 200, 0], [30, 20, 15], (size // 2, 3)),
+                        rng.normal([0, 0, 0], [120, 80, 70], (size // 2, 3))])
+    return pd.DataFrame({
+        'v_R': X[:, 0], 'v_phi': X[:, 1], 'v_Z': X[:, 2],
+        'v_R_uncertainty': np.full(size, 5.0),
+        'v_phi_uncertainty': np.full(size, 5.0),
+        'v_Z_uncertainty': np.full(size, 5.0),
+    })
+
+
+def test_restart_table(mock_df):
+    X = mock_df[['v_R', 'v_phi', 'v_Z']].values
+    cov = np.broadcast_to(np.eye(3) * 25.0, (len(X), 3, 3)).copy()
+    restarts, models = run_xd_restarts(X, cov, [1, 2], n_init=2, seed=3)
+
+    assert list(restarts.columns) == ['K', 'restart', 'logL', 'n_iter', 'seconds', 'seed']
+    assert restarts[['K', 'restart']].values.tolist() == [[1, 0], [1, 1], [2, 0], [2, 1]]
+    assert (restarts['n_iter'] > 0).all()
+    assert set(models) == {(1, 0), (1, 1), (2, 0), (2, 1)}
+    best = best_restart(restarts, models, 2)
+    assert best.K == 2
+
+
+def test_seeded_restarts_independent_of_workers(mock_df):
+    serial, restarts_serial = fit_gmm_fixed_components(mock_df, 2, n_init=2, seed=7, return_restarts=True)
+    pooled, restarts_pooled = fit_gmm_fixed_components(mock_df, 2, n_init=2, seed=7, n_workers=2,
+                                                       return_restarts=True)
+
+    np.testing.assert_allclose(restarts_serial['logL'], restarts_pooled['logL'])
+    np.testing.assert_allclose(serial.mean, pooled.mean)
+
+    # a BIC sweep reuses the same restart streams for each K
+    bic, restarts_bic = compute_bic_vs_n_components(mock_df, max_components=2, n_init=2, seed=7,
+                                                    return_restarts=True)
+    np.testing.assert_allclose(restarts_bic.loc[restarts_bic['K'] == 2, 'logL'], restarts_serial['logL'])
+    assert len(bic[2]) == 2
+
+
+def test_successive_halving(mock_df):
+    X = mock_df[['v_R', 'v_phi', 'v_Z']].values
+    cov = np.broadcast_to(np.eye(3) * 25.0, (len(X), 3, 3)).copy()
+    full, full_models = run_xd_restarts(X, cov, [2], n_init=8, seed=5, engine="numpy")
+    halved, models = successive_halving_restarts(X, cov, 2, n_init=8, seed=5, min_iter=2)
+
+    assert len(halved) == 8
+    assert halved['pruned'].any()
+    assert halved['n_iter'].sum() < full['n_iter'].sum()
+    # restarts that were not pruned reach the same model as a full run
+    kept = halved.loc[~halved['pruned']].set_index('restart')['logL']
+    np.testing.assert_allclose(kept, full.set_index('restart').loc[kept.index, 'logL'])
+    assert set(models) == {(2, i) for i in kept.index}
+    assert best_restart(halved, models, 2) is models[2, kept.idxmax()]
+
+    # pooled rungs give the same schedule
+    pooled, _ = successive_halving_restarts(X, cov, 2, n_init=8, seed=5, min_iter=2, n_workers=2)
+    pd.testing.assert_frame_equal(pooled.drop(columns='seconds'), halved.drop(columns='seconds'))
+
+
+def test_plateau_stops_launching(mock_df):
+    X = mock_df[['v_R', 'v_phi', 'v_Z']].values
+    cov = np.broadcast_to(np.eye(3) * 25.0, (len(X), 3, 3)).copy()
+    restarts, _ = successive_halving_restarts(X, cov, 1, n_init=12, seed=5, batch_size=2, plateau_window=2)
+    # K=1 restarts all reach the same optimum, so launching stops after two batches
+    assert len(restarts) == 4
+
+    # the batches default to the plateau window
+    restarts, _ = successive_halving_restarts(X, cov, 1, n_init=12, seed=5, plateau_window=2)
+    assert len(restarts) == 4
+    with pytest.raises(ValueError):
+        successive_halving_restarts(X, cov, 1, n_init=12, seed=5, batch_size=12, plateau_window=2)
+
+
+def test_split_component_keeps_moments():
+    from pygmmis import GMM
+    gmm = GMM(K=1, D=3)
+    gmm.amp[:] = 1.0
+    gmm.mean[:] = [10.0, 200.0, 0.0]
+    gmm.covar[:] = np.diag([900.0, 400.0, 100.0])
+    split = split_component(gmm, 0)
+
+    assert split.K == 2
+    np.testing.assert_allclose(split.amp, [0.5, 0.5])
+    np.testing.assert_allclose(split.amp @ split.mean, gmm.mean[0])
+    d = split.mean - gmm.mean[0]
+    total = (split.amp[:, None, None] * (split.covar + d[:, :, None] * d[:, None, :])).sum(axis=0)
+    np.testing.assert_allclose(total, gmm.covar[0], atol=1e-9)
+
+
+def test_warm_start_bic_sweep(mock_df):
+    bic, restarts = compute_bic_vs_n_components(mock_df, max_components=3, seed=2, return_restarts=True,
+                                                engine="numpy", warm_start={'n_warm': 2, 'n_cold': 1})
+    assert set(bic) == {1, 2, 3}
+    assert [len(bic[K]) for K in (1, 2, 3)] == [1, 2, 3]
+    assert restarts.loc[restarts['K'] == 3, 'init'].tolist() == ['cold', 'split', 'split']
+
+    # the cold restart is the usual k-means restart 0
+    cold, _ = run_xd_restarts(mock_df[['v_R', 'v_phi', 'v_Z']].values, velocity_covariance_stack(mock_df), [3], n_init=1, seed=2,
+                              engine="numpy")
+    np.testing.assert_allclose(restarts.loc[(restarts['K'] == 3) & (restarts['restart'] == 0), 'logL'],
+                               cold['logL'])
+
+
+def test_benchmark_stochastic_em(mock_df):
+    X = mock_df[['v_R', 'v_phi', 'v_Z']].values
+    bench = benchmark_stochastic_em(X, np.full((len(X), 3), 25.0), 2, sizes=(40, 60, 100), batch_size=20)
+    assert bench['n_stars'].tolist() == [40, 40, 60, 60]
+    assert bench['method'].tolist() == ['full', 'stochastic'] * 2
+    assert (bench['data_passes'] > 0).all()
+
+
+def test_stratified_folds():
+    values = np.random.default_rng(0).normal(size=103)
+    folds = stratified_folds(values, n_folds=5, seed=1)
+
+    assert set(np.bincount(folds)) == {20, 21}
+    # each fold holds one star of every block of 5 ranked stars
+    ranked = folds[np.argsort(values)]
+    assert all(len(set(ranked[i:i + 5])) == 5 for i in range(0, 100, 5))
+
+
+def test_cross_validation(mock_df):
+    CV_values, scores = compute_cv_vs_n_components(mock_df, max_components=2, n_folds=3, n_init=2, seed=3,
+                                                   return_folds=True)
+    assert set(CV_values) == {1, 2}
+    assert all(len(v) == 3 for v in CV_values.values())
+    assert scores.groupby('K')['n_test'].sum().tolist() == [len(mock_df)] * 2
+    np.testing.assert_allclose(CV_values[2], -2 * scores.loc[scores['K'] == 2, 'logL_test'])
+
+    parallel = compute_cv_vs_n_components(mock_df, max_components=2, n_folds=3, n_init=2, seed=3, n_workers=2)
+    for K in (1, 2):
+        np.testing.assert_allclose(parallel[K], CV_values[K])
+
+
+def test_stream_keys_are_distinct():
+    keys = {restart_seed(3, K, i).spawn_key for K in range(1, 4) for i in range(3)}
+    keys |= {fold_seed(3).spawn_key} | {bootstrap_seed(3, b).spawn_key for b in range(3)}
+    assert len(keys) == 9 + 1 + 3